@@ -0,0 +1,38 @@
+import numpy as np
+import rasterio.mask
+
+# Scene classification band of L2A products
+SCL_BAND = "SCL"
+
+# Scene classes which are excluded from NDVI:
+# no data, saturated or defective, cloud shadows, medium and high
+# probability clouds, thin cirrus and snow
+MASKED_CLASSES = (0, 1, 3, 8, 9, 10, 11)
+
+
+def get_cloud_mask(scl):
+    """
+    Marks pixels covered by clouds, their shadows or snow.
+    :param scl: scene classification block
+    :return: boolean array, True where pixel is masked
+    """
+    return np.isin(scl, MASKED_CLASSES)
+
+
+def calculate_cloud_cover(scl_src, shapes):
+    """
+    Calculates share of the field covered by clouds, their shadows
+    or snow. Only the window covering the field is read.
+    :param scl_src: opened scene classification image
+    :param shapes: field geometries in image projection
+    :return float: share of masked field pixels from 0 to 1
+    """
+    outside_field, _, window = rasterio.mask.raster_geometry_mask(
+        scl_src, shapes, crop=True, all_touched=True)
+    inside_field = ~outside_field
+    field_pixels = np.count_nonzero(inside_field)
+    if field_pixels == 0:
+        return 1.0
+
+    cloudy = get_cloud_mask(scl_src.read(1, window=window))
+    return np.count_nonzero(cloudy & inside_field) / field_pixels
@@ -0,0 +1,169 @@
+import functools
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import shapely
+from pyproj import Transformer
+from shapely.errors import ShapelyError
+from shapely.geometry import GeometryCollection, shape
+
+from backend.app.instrumentation import instrumented
+
+# GeoJSON coordinates are always longitude and latitude
+GEOJSON_CRS = "EPSG:4326"
+# 7 decimal places of a degree are about 1 cm
+HASH_PRECISION = 7
+# Fields kept reprojected, one field takes a few KB
+REPROJECTED_FIELDS_CACHE_SIZE = int(os.getenv(
+    "REPROJECTED_FIELDS_CACHE_SIZE", default=4096))
+
+
+class GeometryCache:
+    """
+    This class keeps the most recently used geometries in memory,
+    it is shared by threads of the worker.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.__items = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :return: cached geometries or None
+        """
+        with self.__lock:
+            value = self.__items.get(key)
+            if value is not None:
+                self.__items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.__lock:
+            self.__items[key] = value
+            self.__items.move_to_end(key)
+            while len(self.__items) > self.max_size:
+                self.__items.popitem(last=False)
+
+
+reprojected_fields = GeometryCache(REPROJECTED_FIELDS_CACHE_SIZE)
+
+
+def geometry_hash(field_geojson: dict):
+    """
+    Calculates canonical hash of the field geometry, so the same field
+    submitted again gets the same hash. Coordinates are rounded to
+    HASH_PRECISION, rings are normalized, so their start vertex and
+    orientation don't matter, and order of features and their
+    properties are ignored.
+    :param dict field_geojson: field information in GeoJSON format
+    :return str: hex sha256 digest
+    """
+    geometries = []
+    for feature in field_geojson["features"]:
+        geometry = shapely.transform(
+            shape(feature["geometry"]),
+            lambda coordinates: np.round(coordinates, HASH_PRECISION))
+        geometries.append(shapely.normalize(geometry).wkb)
+
+    digest = hashlib.sha256(f"{GEOJSON_CRS}:{HASH_PRECISION}".encode())
+    for wkb in sorted(geometries):
+        digest.update(wkb)
+    return digest.hexdigest()
+
+
+def field_shape(field_geojson: dict):
+    """
+    Converts features of the field to one geometry.
+    :param dict field_geojson: field information in GeoJSON format
+    :return: shapely geometry in WGS 84
+    """
+    shapes = [shape(feature["geometry"])
+              for feature in field_geojson["features"]]
+    return shapes[0] if len(shapes) == 1 else GeometryCollection(shapes)
+
+
+def prepare_field(field_geojson: dict):
+    """
+    Validates geometry of the field and prepares columns of its row,
+    so single and bulk ingestion accept the same fields.
+    :param dict field_geojson: field information in GeoJSON format
+    :return dict: row of the field with geo_json, geometry in WKT
+        and geometry_hash
+    :raise ValueError: if field has no valid geometry
+    """
+    if not field_geojson["features"]:
+        raise ValueError("Field must have at least one feature.")
+    if any(feature["geometry"] is None
+           for feature in field_geojson["features"]):
+        raise ValueError("Every feature of the field must have geometry.")
+    try:
+        return {"geo_json": field_geojson,
+                "geometry": field_shape(field_geojson).wkt,
+                "geometry_hash": geometry_hash(field_geojson)}
+    except ShapelyError as ex:
+        raise ValueError(f"Invalid geometry: {ex}")
+
+
+def group_by_footprints(geometries: dict, footprints: list):
+    """
+    Finds geometries intersecting every footprint. R-tree of the
+    geometries is built once and queried with every footprint.
+    :param dict geometries: id -> shapely geometry
+    :param list footprints: shapely footprints
+    :return list(list): ids of geometries intersecting every footprint
+    """
+    ids = list(geometries)
+    tree = shapely.STRtree([geometries[key] for key in ids])
+    return [[ids[i] for i in sorted(tree.query(footprint,
+                                               predicate="intersects"))]
+            for footprint in footprints]
+
+
+@functools.lru_cache(maxsize=32)
+def get_transformer(src_crs: str, dst_crs: str):
+    """
+    Creates transformer between projections once, creation of
+    transformer is much slower than transformation of a field.
+    :param str src_crs: source projection e.g. EPSG:4326
+    :param str dst_crs: target projection e.g. EPSG:32637
+    :return Transformer: transformer with x, y axis order
+    """
+    return Transformer.from_crs(src_crs, dst_crs, always_xy=True)
+
+
+@instrumented("reproject")
+def reproject_field(field_geojson: dict, crs, key=None):
+    """
+    Transforms field coordinates to the satellite image projection,
+    which is read from the image, so fields in any UTM zone
+    are supported. When key is passed, transformed geometries are
+    cached per key and projection, so repeated and batch runs
+    don't transform the field again.
+    :param dict field_geojson: field information in GeoJSON format
+    :param crs: projection of the image e.g. src.crs or EPSG:32637
+    :param key: id of the field geometry e.g. geometry hash,
+        geometry of the key must not change, so ids of fields
+        which can be reused after deletion don't fit
+    :return tuple: field geometries in image projection
+    """
+    crs = str(crs)
+    if key is not None:
+        shapes = reprojected_fields.get((key, crs))
+        if shapes is not None:
+            return shapes
+
+    transformer = get_transformer(GEOJSON_CRS, crs)
+    shapes = tuple(
+        shapely.transform(shape(feature["geometry"]),
+                          lambda coordinates: np.column_stack(
+                              transformer.transform(coordinates[:, 0],
+                                                    coordinates[:, 1])))
+        for feature in field_geojson["features"])
+    if key is not None:
+        reprojected_fields.put((key, crs), shapes)
+    return shapes
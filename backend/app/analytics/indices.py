@@ -0,0 +1,188 @@
+import logging
+from contextlib import ExitStack
+
+import numpy as np
+import rasterio
+import rasterio.mask
+from rasterio.windows import Window
+
+from backend.app.analytics.geometry import reproject_field
+from backend.app.analytics.ndvi_counter import open_on_grid
+from backend.app.analytics.ndvi_kernel import BLOCK_ROWS
+from backend.app.analytics.ndvi_stats import VALUE_RANGE, NdviStatistics
+from backend.app.fs.image_saver import ImageSaverToFileSystem
+from backend.app.instrumentation import stage
+
+logger = logging.getLogger()
+
+# Sentinel-2 band values are reflectance multiplied by 10000
+REFLECTANCE_SCALE = 10000
+
+
+class SpectralIndex:
+    """
+    Spectral index declares bands it is calculated from
+    and vectorized formula over reflectance of these bands.
+    """
+
+    def __init__(self, name: str, bands, formula, value_range=VALUE_RANGE):
+        """
+        :param str name: name of the index
+        :param bands: band names formula uses
+        :param formula: callable which accepts band -> float32 reflectance
+            array and returns index array
+        :param value_range: (low, high) values of the index statistics
+            histogram covers
+        """
+        self.name = name
+        self.bands = tuple(bands)
+        self.formula = formula
+        self.value_range = value_range
+
+
+INDICES = {}
+
+
+def register_index(name: str, bands, formula, value_range=VALUE_RANGE):
+    """
+    Adds index to the registry.
+    :param str name: name of the index
+    :param bands: band names formula uses
+    :param formula: vectorized formula of the index
+    :param value_range: (low, high) values of the index,
+        normalized indices are from -1 to 1
+    """
+    INDICES[name] = SpectralIndex(name, bands, formula, value_range)
+
+
+register_index("NDVI", ("B08", "B04"),
+               lambda b: (b["B08"] - b["B04"]) / (b["B08"] + b["B04"]))
+register_index("EVI", ("B08", "B04", "B02"),
+               lambda b: 2.5 * (b["B08"] - b["B04"]) /
+               (b["B08"] + 6 * b["B04"] - 7.5 * b["B02"] + 1),
+               value_range=(-2.5, 2.5))
+register_index("NDWI", ("B03", "B08"),
+               lambda b: (b["B03"] - b["B08"]) / (b["B03"] + b["B08"]))
+register_index("SAVI", ("B08", "B04"),
+               lambda b: 1.5 * (b["B08"] - b["B04"]) /
+               (b["B08"] + b["B04"] + 0.5),
+               value_range=(-1.5, 1.5))
+register_index("NDRE", ("B08", "B05"),
+               lambda b: (b["B08"] - b["B05"]) / (b["B08"] + b["B05"]))
+
+
+def get_required_bands(names):
+    """
+    Returns union of bands the indices are calculated from.
+    :param names: names of the indices
+    :return list: sorted band names
+    """
+    bands = set()
+    for name in names:
+        if name not in INDICES:
+            raise ValueError(f"Unknown index {name}.")
+        bands.update(INDICES[name].bands)
+    return sorted(bands)
+
+
+def calculate_indices(sources: dict, shapes, names):
+    """
+    Calculates several indices of the field in one pass.
+    Every band window is read once per block and shared
+    by all indices which use the band, so cost of several indices
+    is close to reading union of their bands.
+    Pixels outside of the field, without data or with
+    invalid result are filled with NaN.
+    :param dict sources: band -> opened band image
+    :param shapes: field geometries in image projection
+    :param names: names of the indices
+    :return tuple(dict, dict): index name -> (index array, statistics)
+        and meta of the cropped image
+    """
+    indices = [INDICES[name] for name in names]
+
+    with ExitStack() as stack:
+        # The finest band defines the grid of all indices
+        reference = min(sources.values(), key=lambda src: src.res[0])
+        readers = {}
+        for band, src in sources.items():
+            reader = open_on_grid(src, reference)
+            if reader is not src:
+                logger.info(f"Resampling {band} band to "
+                            f"{reference.res[0]} m.")
+                stack.enter_context(reader)
+            readers[band] = reader
+
+        with stage("mask"):
+            outside_field, transform, window = \
+                rasterio.mask.raster_geometry_mask(reference, shapes,
+                                                   crop=True)
+
+        height, width = outside_field.shape
+        results = {index.name: np.empty((1, height, width), dtype=np.float32)
+                   for index in indices}
+        statistics = {index.name: NdviStatistics(index.value_range)
+                      for index in indices}
+        for row in range(0, height, BLOCK_ROWS):
+            rows = slice(row, row + BLOCK_ROWS)
+            block = Window(window.col_off, window.row_off + row,
+                           width, min(BLOCK_ROWS, height - row))
+
+            valid = ~outside_field[rows]
+            reflectance = {}
+            with stage("read"):
+                for band, reader in readers.items():
+                    data = reader.read(1, window=block)
+                    if reader.nodata is not None:
+                        valid &= data != reader.nodata
+                    reflectance[band] = np.divide(data, REFLECTANCE_SCALE,
+                                                  dtype=np.float32)
+
+            with stage("compute"), \
+                    np.errstate(divide="ignore", invalid="ignore"):
+                for index in indices:
+                    out = results[index.name][0, rows]
+                    out[...] = index.formula(reflectance)
+                    out[~(valid & np.isfinite(out))] = np.nan
+                    statistics[index.name].update(out)
+
+        meta = reference.meta.copy()
+
+    meta.update({"driver": "GTiff",
+                 "dtype": rasterio.float32,
+                 "count": 1,
+                 "nodata": np.nan,
+                 "height": height,
+                 "width": width,
+                 "transform": transform})
+    return {name: (results[name], statistics[name].result())
+            for name in results}, meta
+
+
+def calculate_and_save_indices(band_paths: dict, field_geojson,
+                               file_paths: dict, field_key=None):
+    """
+    Calculates indices of the field and saves their images
+    to file system.
+    :param dict band_paths: band -> path to band image
+    :param dict field_geojson: field information in GeoJSON format
+    :param dict file_paths: index name -> path to index image
+    :param field_key: geometry hash of the field, reprojected field
+        is cached under it when passed
+    :return dict: index name -> statistics
+    """
+    bands = get_required_bands(file_paths)
+
+    with ExitStack() as stack:
+        sources = {band: stack.enter_context(rasterio.open(band_paths[band]))
+                   for band in bands}
+        # Bands of one product share projection
+        shapes = reproject_field(field_geojson, sources[bands[0]].crs,
+                                 key=field_key)
+        results, meta = calculate_indices(sources, shapes, file_paths)
+
+    saver = ImageSaverToFileSystem()
+    with stage("write"):
+        for name, (image, _) in results.items():
+            saver.save_ndvi_image(meta, image, file_path=file_paths[name])
+    return {name: statistics for name, (_, statistics) in results.items()}
@@ -1,54 +1,198 @@
+import logging
+from contextlib import ExitStack
+
+import numpy as np
 import rasterio
 import rasterio.mask
-from geopandas import GeoDataFrame
+import shapely
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
 
+from backend.app.analytics.cloud_mask import get_cloud_mask
+from backend.app.analytics.geometry import reproject_field
+from backend.app.analytics.ndvi_kernel import (BLOCK_ROWS, NdviWorkspace,
+                                               compute_ndvi)
+from backend.app.analytics.ndvi_stats import NdviStatistics
 from backend.app.fs.image_saver import ImageSaverToFileSystem
+from backend.app.instrumentation import stage
+
+logger = logging.getLogger()
+
+# NIR and Red bands NDVI is calculated from
+NDVI_BANDS = ("B08", "B04")
+
+
+def open_on_grid(src, reference, resampling=Resampling.bilinear):
+    """
+    Returns band aligned to the reference grid. Band is resampled
+    only when its grid differs, e.g. 20 m bands are resampled to 10 m.
+    :param src: opened band image
+    :param reference: opened band image with target grid
+    :param resampling: resampling method, nearest for classes
+    :return: band image or WarpedVRT above it
+    """
+    if src.crs == reference.crs and src.transform == reference.transform \
+            and src.shape == reference.shape:
+        return src
+
+    return WarpedVRT(src, crs=reference.crs, transform=reference.transform,
+                     width=reference.width, height=reference.height,
+                     resampling=resampling)
+
+
+def calculate_ndvi(nir_src, red_src, shapes, scl_src=None):
+    """
+    Calculates NDVI of the field from opened NIR and Red images.
+    Only the window covering the field is read and decoded
+    block by block, so memory stays bounded for large fields.
+    Pixels outside of the field are filled with nodata.
+    When scene classification image is passed, the same window of it
+    is resampled to the band grid and pixels covered by clouds,
+    their shadows or snow are filled with nodata too.
+    Zonal statistics are accumulated in the same pass.
+    Formula:
+    NDVI = nir - red /(nir + red)
+    :param nir_src: opened NIR image
+    :param red_src: opened Red image
+    :param shapes: field geometries in image projection
+    :param scl_src: opened scene classification image or None
+    :return tuple(ndarray, dict, dict): NDVI, meta of the cropped image
+        and NDVI statistics with share of masked field pixels
+        when scene classification is used
+    """
+
+    # Red and NIR bands share grid, so window is computed once
+    with stage("mask"):
+        outside_field, transform, window = \
+            rasterio.mask.raster_geometry_mask(red_src, shapes, crop=True)
 
+    height, width = outside_field.shape
+    ndvi = np.empty((1, height, width), dtype=np.float32)
+    statistics = NdviStatistics()
+    # Temporaries of the kernel are shared by all blocks of the image
+    workspace = NdviWorkspace((min(BLOCK_ROWS, height), width))
+    cloudy_pixels = 0
+    with ExitStack() as stack:
+        scl_reader = None
+        if scl_src is not None:
+            # Classes are not interpolated
+            scl_reader = open_on_grid(scl_src, red_src,
+                                      resampling=Resampling.nearest)
+            if scl_reader is not scl_src:
+                stack.enter_context(scl_reader)
 
-def calculate_and_save_ndvi_image(nir, red, file_path, field_geojson):
+        # Reading of band windows is recorded as part of computation
+        with stage("compute"):
+            for row in range(0, height, BLOCK_ROWS):
+                rows = slice(row, row + BLOCK_ROWS)
+                block = Window(window.col_off, window.row_off + row,
+                               width, min(BLOCK_ROWS, height - row))
+                mask = outside_field[rows]
+                if scl_reader is not None:
+                    cloudy = get_cloud_mask(scl_reader.read(1, window=block))
+                    cloudy_pixels += np.count_nonzero(cloudy & ~mask)
+                    mask = mask | cloudy
+                compute_ndvi(nir_src.read(1, window=block),
+                             red_src.read(1, window=block),
+                             mask=mask, out=ndvi[0, rows],
+                             nodata=red_src.nodata, workspace=workspace)
+                statistics.update(ndvi[0, rows])
+
+    meta = red_src.meta.copy()
+    meta.update({"driver": "GTiff",
+                 "dtype": rasterio.float32,
+                 "nodata": np.nan,
+                 "height": height,
+                 "width": width,
+                 "transform": transform})
+
+    result = statistics.result()
+    if result is not None and scl_src is not None:
+        result["cloud_cover"] = \
+            cloudy_pixels / np.count_nonzero(~outside_field)
+    return ndvi, meta, result
+
+
+def calculate_and_save_ndvi_image(nir, red, file_path, field_geojson,
+                                  scl=None, field_key=None):
     """
     Calculates NDVI, creates NDVI image and saves to file system.
     Formula:
     NDVI = nir - red /(nir + red)
-    :return:
-    """
-
-    # Transform coordinates
-    field_geo = GeoDataFrame.from_features(
-        field_geojson['features'], crs="EPSG:4326")
-    n_reserve_proj = field_geo.to_crs(epsg=32637)
-
-    # Open and crop b4 and b8
-    with rasterio.open(red) as src:
-        out_image_red, out_transform_red = rasterio.mask.mask(
-            src, n_reserve_proj.geometry, crop=True)
-        out_meta_red = src.meta.copy()
-        out_meta_red.update({"driver": "GTiff",
-                             "height": out_image_red.shape[1],
-                             "width": out_image_red.shape[2],
-                             "transform": out_transform_red})
-
-    with rasterio.open(nir) as src:
-        out_image_nir, out_transform_nir = rasterio.mask.mask(
-            src, n_reserve_proj.geometry, crop=True)
-        out_meta = src.meta.copy()
-        out_meta.update({"driver": "GTiff",
-                         "height": out_image_nir.shape[1],
-                         "width": out_image_nir.shape[2],
-                         "transform": out_transform_nir})
-
-    # Open one of the images for meta
-    b4 = rasterio.open(red)
-
-    nir = out_image_nir
-    red = out_image_red
-
-    # Calculate ndvi
-    ndvi = (nir.astype(float) - red.astype(float)) / (nir + red)
-
-    # Write the NDVI image
-    meta = b4.meta
-    meta.update(driver='GTiff')
-    meta.update(dtype=rasterio.float32)
-
-    ImageSaverToFileSystem().save_ndvi_image(meta, ndvi, file_path=file_path)
+    :param scl: path to scene classification image, clouds, their
+        shadows and snow are masked when passed
+    :param field_key: geometry hash of the field, reprojected field
+        is cached under it when passed
+    :return dict: NDVI statistics
+    """
+
+    # Open b4 and b8 once and read only the field window
+    with ExitStack() as stack:
+        nir_src = stack.enter_context(rasterio.open(nir))
+        red_src = stack.enter_context(rasterio.open(red))
+        scl_src = stack.enter_context(rasterio.open(scl)) \
+            if scl is not None else None
+        # Transform coordinates to projection of the bands
+        shapes = reproject_field(field_geojson, red_src.crs, key=field_key)
+        ndvi, meta, statistics = calculate_ndvi(nir_src, red_src, shapes,
+                                                scl_src)
+
+    with stage("write"):
+        ImageSaverToFileSystem().save_ndvi_image(meta, ndvi,
+                                                 file_path=file_path)
+    return statistics
+
+
+def calculate_and_save_ndvi_images(nir, red, fields: dict, scl=None):
+    """
+    Calculates NDVI for many fields lying in the same product
+    and saves NDVI images to file system.
+    Bands are opened once for all fields. Fields are processed
+    in raster order, so neighbouring fields reuse blocks
+    already decoded into GDAL block cache. Reprojected fields
+    are cached under their geometry hashes.
+    :param nir: path to NIR image
+    :param red: path to Red image
+    :param dict fields: field id -> (path to NDVI image, field GeoJSON,
+        geometry hash of the field)
+    :param scl: path to scene classification image, clouds, their
+        shadows and snow are masked when passed
+    :return tuple(dict, dict): field id -> NDVI statistics
+        and field id -> exception for fields which failed
+    """
+    statistics = {}
+    errors = {}
+    saver = ImageSaverToFileSystem()
+    with ExitStack() as stack:
+        nir_src = stack.enter_context(rasterio.open(nir))
+        red_src = stack.enter_context(rasterio.open(red))
+        scl_src = stack.enter_context(rasterio.open(scl)) \
+            if scl is not None else None
+
+        shapes = {}
+        for field_id, (_, field_geojson, field_key) in fields.items():
+            try:
+                shapes[field_id] = reproject_field(
+                    field_geojson, red_src.crs, key=field_key)
+            except Exception as ex:
+                errors[field_id] = ex
+
+        # Top to bottom, left to right like blocks are stored
+        bounds = {field_id: shapely.total_bounds(field_shapes)
+                  for field_id, field_shapes in shapes.items()}
+        order = sorted(shapes, key=lambda field_id: (
+            -bounds[field_id][3], bounds[field_id][0]))
+
+        for field_id in order:
+            try:
+                ndvi, meta, statistics[field_id] = calculate_ndvi(
+                    nir_src, red_src, shapes[field_id], scl_src)
+                with stage("write"):
+                    saver.save_ndvi_image(meta, ndvi,
+                                          file_path=fields[field_id][0])
+            except Exception as ex:
+                logger.exception(f"NDVI calculation failed for {field_id}.")
+                errors[field_id] = ex
+
+    return statistics, errors
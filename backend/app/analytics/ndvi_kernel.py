@@ -0,0 +1,97 @@
+import numpy as np
+
+# Rows processed at once, keeps temporaries of a 10980 px wide
+# Sentinel-2 tile under ~10 MB
+BLOCK_ROWS = 256
+
+
+class NdviWorkspace:
+    """
+    This class keeps temporaries of compute_ndvi, so callers which
+    calculate NDVI block by block allocate them once per image.
+    """
+
+    def __init__(self, block_shape, dtype=np.float32):
+        """
+        :param block_shape: (rows, cols) of the largest block
+        :param dtype: float type calculation is done in
+        """
+        self.numerator = np.empty(block_shape, dtype=dtype)
+        self.denominator = np.empty(block_shape, dtype=dtype)
+        self.valid = np.empty(block_shape, dtype=bool)
+        self.buffer = np.empty(block_shape, dtype=bool)
+
+    def fits(self, block_shape, dtype):
+        """
+        :return bool: True when blocks of the shape can be calculated
+            in the workspace
+        """
+        rows, cols = self.numerator.shape
+        return self.numerator.dtype == dtype and \
+            block_shape[0] <= rows and block_shape[1] == cols
+
+
+def compute_ndvi(nir, red, mask=None, out=None, nodata=None,
+                 dtype=np.float32, fill_value=np.nan,
+                 block_rows: int = BLOCK_ROWS, workspace=None):
+    """
+    Calculates NDVI of 2D band arrays block by block.
+    Temporaries are taken from workspace and reused for every block,
+    bands are cast to dtype before subtraction and addition, so there
+    is no integer overflow. Pixels which are masked, equal to band nodata
+    or have zero denominator are filled with fill_value.
+    Formula:
+    NDVI = (nir - red) / (nir + red)
+    :param nir: NIR band
+    :param red: Red band
+    :param mask: boolean array, True where pixel is outside of the field
+        like masks returned by rasterio.mask
+    :param out: preallocated output array, created when not provided
+    :param nodata: nodata value of the bands
+    :param dtype: float type calculation is done in
+    :param fill_value: value of invalid pixels
+    :param int block_rows: number of rows processed at once
+    :param workspace: NdviWorkspace reused between calls,
+        created when not provided
+    :return: NDVI array
+    """
+    if out is None:
+        out = np.empty(nir.shape, dtype=dtype)
+
+    rows, cols = nir.shape
+    block_shape = (min(block_rows, rows), cols)
+    if workspace is None:
+        workspace = NdviWorkspace(block_shape, dtype)
+    elif not workspace.fits(block_shape, dtype):
+        raise ValueError(f"Workspace doesn't fit blocks of {block_shape} "
+                         f"{np.dtype(dtype).name} pixels.")
+    numerator = workspace.numerator
+    denominator = workspace.denominator
+    valid = workspace.valid
+    buffer = workspace.buffer
+
+    for start in range(0, rows, block_rows):
+        stop = min(start + block_rows, rows)
+        size = stop - start
+        nir_block = nir[start:stop]
+        red_block = red[start:stop]
+
+        np.subtract(nir_block, red_block, out=numerator[:size], dtype=dtype)
+        np.add(nir_block, red_block, out=denominator[:size], dtype=dtype)
+
+        # Pixel is valid when it is inside field and has data
+        np.not_equal(denominator[:size], 0, out=valid[:size])
+        if mask is not None:
+            np.logical_not(mask[start:stop], out=buffer[:size])
+            np.logical_and(valid[:size], buffer[:size], out=valid[:size])
+        if nodata is not None:
+            for band in (nir_block, red_block):
+                np.not_equal(band, nodata, out=buffer[:size])
+                np.logical_and(valid[:size], buffer[:size],
+                               out=valid[:size])
+
+        out[start:stop] = fill_value
+        np.divide(numerator[:size], denominator[:size],
+                  out=out[start:stop], where=valid[:size])
+
+    return out
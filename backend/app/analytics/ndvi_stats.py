@@ -0,0 +1,92 @@
+import numpy as np
+
+# Fine histogram percentiles are taken from, NDVI step is 0.001
+PERCENTILE_BINS = 2000
+# Values of NDVI and other normalized indices
+VALUE_RANGE = (-1, 1)
+# Histogram returned to users
+HISTOGRAM_BINS = 20
+PERCENTILES = (10, 25, 50, 75, 90)
+
+
+class NdviStatistics:
+    """
+    This class accumulates zonal statistics of NDVI block by block,
+    so statistics are calculated in the same pass as NDVI itself.
+    Median and percentiles are taken from a fine histogram
+    with 0.001 precision instead of sorting all pixels. Other indices
+    pass their range of values, values out of range fall
+    into the edge bins of histogram.
+    """
+
+    def __init__(self, value_range=VALUE_RANGE):
+        """
+        :param value_range: (low, high) values histogram covers
+        """
+        self.low, self.high = value_range
+        self.count = 0
+        self.sum = 0.0
+        self.sum_of_squares = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.histogram = np.zeros(PERCENTILE_BINS, dtype=np.int64)
+
+    def update(self, ndvi):
+        """
+        Adds NDVI block to statistics, NaN pixels are skipped.
+        :param ndvi: NDVI block
+        """
+        values = ndvi[~np.isnan(ndvi)]
+        if values.size == 0:
+            return
+
+        self.count += values.size
+        self.sum += float(values.sum(dtype=np.float64))
+        self.sum_of_squares += float(np.dot(values.astype(np.float64),
+                                            values))
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+        bins = ((values - self.low) *
+                (PERCENTILE_BINS / (self.high - self.low))).astype(np.int64)
+        np.clip(bins, 0, PERCENTILE_BINS - 1, out=bins)
+        self.histogram += np.bincount(bins, minlength=PERCENTILE_BINS)
+
+    def __percentile(self, cumulative, percentile):
+        bin_index = int(np.searchsorted(cumulative,
+                                        self.count * percentile / 100))
+        # Center of the histogram bin limited by observed values
+        value = self.low + (bin_index + 0.5) * \
+            (self.high - self.low) / PERCENTILE_BINS
+        return min(max(value, self.min), self.max)
+
+    def result(self):
+        """
+        Returns accumulated statistics.
+        :return dict|None: statistics or None if there were no valid pixels
+        """
+        if self.count == 0:
+            return None
+
+        mean = self.sum / self.count
+        cumulative = np.cumsum(self.histogram)
+        percentiles = {f"p{percentile}": self.__percentile(cumulative,
+                                                           percentile)
+                       for percentile in PERCENTILES}
+        counts = self.histogram.reshape(HISTOGRAM_BINS, -1).sum(axis=1)
+
+        return {
+            "count": self.count,
+            "mean": mean,
+            "std": max(self.sum_of_squares / self.count - mean ** 2,
+                       0) ** 0.5,
+            "min": self.min,
+            "max": self.max,
+            "median": percentiles["p50"],
+            "percentiles": percentiles,
+            "histogram": {
+                "bins": np.linspace(self.low, self.high,
+                                    HISTOGRAM_BINS + 1).tolist(),
+                "counts": counts.tolist(),
+            },
+        }
@@ -0,0 +1,97 @@
+import io
+import math
+
+import matplotlib
+import matplotlib.image
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+
+TILE_SIZE = 256
+TILE_CRS = "EPSG:3857"
+WEB_MERCATOR_EXTENT = 20037508.342789244
+COLORMAP = "RdYlGn"
+
+
+def get_tile_bounds(z: int, x: int, y: int):
+    """
+    Returns bounds of XYZ tile in Web Mercator projection.
+    :return tuple: left, bottom, right, top
+    """
+    size = 2 * WEB_MERCATOR_EXTENT / 2 ** z
+    left = -WEB_MERCATOR_EXTENT + x * size
+    top = WEB_MERCATOR_EXTENT - y * size
+    return left, top - size, left + size, top
+
+
+def get_overview_level(src, bounds):
+    """
+    Chooses the smallest overview which is still finer than the tile,
+    so rendering low zoom tiles doesn't read full resolution image.
+    :param src: opened NDVI image
+    :param bounds: tile bounds in Web Mercator projection
+    :return int|None: overview level or None for full resolution
+    """
+    # Web Mercator pixel size shrinks with latitude
+    latitude = math.atan(math.sinh((bounds[1] + bounds[3]) / 2 /
+                                   6378137))
+    tile_resolution = (bounds[2] - bounds[0]) / TILE_SIZE * \
+        math.cos(latitude)
+
+    level = None
+    for i, factor in enumerate(src.overviews(1)):
+        if src.res[0] * factor <= tile_resolution:
+            level = i
+    return level
+
+
+def colorize(ndvi, colormap: str = COLORMAP):
+    """
+    Applies colormap to NDVI, pixels without data are transparent.
+    :param ndvi: NDVI array
+    :param str colormap: matplotlib colormap name
+    :return: RGBA array
+    """
+    normalized = np.ma.masked_invalid((ndvi + 1) / 2)
+    cmap = matplotlib.colormaps[colormap].with_extremes(bad=(0, 0, 0, 0))
+    return cmap(normalized, bytes=True)
+
+
+def render_tile(path: str, z: int, x: int, y: int,
+                colormap: str = COLORMAP):
+    """
+    Renders XYZ tile of NDVI image as PNG. Only the part of image
+    covering the tile is read from the closest overview.
+    :param str path: path to NDVI image
+    :param int z: zoom
+    :param int x: column of the tile
+    :param int y: row of the tile
+    :param str colormap: matplotlib colormap name
+    :return bytes|None: PNG image or None if tile is out of image
+    """
+    bounds = get_tile_bounds(z, x, y)
+
+    with rasterio.open(path) as src:
+        left, bottom, right, top = transform_bounds(src.crs, TILE_CRS,
+                                                    *src.bounds)
+        if left >= bounds[2] or right <= bounds[0] or \
+                bottom >= bounds[3] or top <= bounds[1]:
+            return None
+        overview_level = get_overview_level(src, bounds)
+
+    open_options = {} if overview_level is None else {
+        "overview_level": overview_level}
+    with rasterio.open(path, **open_options) as src, \
+            WarpedVRT(src, crs=TILE_CRS,
+                      transform=from_bounds(*bounds, TILE_SIZE, TILE_SIZE),
+                      width=TILE_SIZE, height=TILE_SIZE,
+                      src_nodata=np.nan, nodata=np.nan,
+                      resampling=Resampling.bilinear) as vrt:
+        ndvi = vrt.read(1)
+
+    buffer = io.BytesIO()
+    matplotlib.image.imsave(buffer, colorize(ndvi, colormap), format="png")
+    return buffer.getvalue()
@@ -0,0 +1,70 @@
+import logging
+import math
+import os
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.warp import reproject, transform_bounds
+
+from backend.app.fs.image_saver import ImageSaverToFileSystem
+
+logger = logging.getLogger()
+
+
+def build_ndvi_cube(images: list, file_path: str):
+    """
+    Stacks NDVI images of the field into one multi-band image,
+    band per date. Images are aligned to the grid of the first one,
+    so dates taken from neighbouring tiles can be compared pixel by pixel.
+    :param list images: (date in ISO format, path to NDVI image) pairs
+        sorted by date
+    :param str file_path: path to the NDVI cube
+    """
+    with rasterio.open(images[0][1]) as src:
+        crs = src.crs
+        x_res, y_res = src.res
+
+    # Cube covers all images
+    lefts, bottoms, rights, tops = [], [], [], []
+    for _, path in images:
+        with rasterio.open(path) as src:
+            left, bottom, right, top = transform_bounds(src.crs, crs,
+                                                        *src.bounds)
+        lefts.append(left)
+        bottoms.append(bottom)
+        rights.append(right)
+        tops.append(top)
+
+    transform = from_origin(min(lefts), max(tops), x_res, y_res)
+    width = math.ceil((max(rights) - min(lefts)) / x_res)
+    height = math.ceil((max(tops) - min(bottoms)) / y_res)
+
+    cube = np.full((len(images), height, width), np.nan, dtype=np.float32)
+    for band, (_, path) in enumerate(images):
+        with rasterio.open(path) as src:
+            reproject(source=rasterio.band(src, 1), destination=cube[band],
+                      dst_transform=transform, dst_crs=crs,
+                      src_nodata=np.nan, dst_nodata=np.nan,
+                      resampling=Resampling.nearest)
+
+    meta = {
+        "driver": "GTiff",
+        "dtype": "float32",
+        "count": len(images),
+        "height": height,
+        "width": width,
+        "crs": crs,
+        "transform": transform,
+        "nodata": np.nan,
+    }
+
+    # Cube may be built by several workers, so it is replaced atomically
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    logger.info(f"Saving NDVI cube of {len(images)} dates to {file_path}.")
+    ImageSaverToFileSystem().save_ndvi_image(
+        meta, cube, tmp_path,
+        descriptions=[acquisition_date for acquisition_date, _ in images])
+    os.replace(tmp_path, file_path)
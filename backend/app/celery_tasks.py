@@ -1,15 +1,36 @@
 import logging
 import os
 import shutil
+import tempfile
+from datetime import date
 
-from celery import Celery
+import rasterio
+import shapely
+from celery import Celery, chain, group
+from celery.signals import task_postrun
 from sentinelsat import SentinelAPI, geojson_to_wkt
 
-from backend.app.analytics.ndvi_counter import calculate_and_save_ndvi_image
+from backend.app.analytics.cloud_mask import SCL_BAND, calculate_cloud_cover
+from backend.app.analytics.geometry import (field_shape, geometry_hash,
+                                            reproject_field)
+from backend.app.analytics.indices import (calculate_and_save_indices,
+                                           get_required_bands)
+from backend.app.analytics.ndvi_counter import (NDVI_BANDS,
+                                                calculate_and_save_ndvi_image,
+                                                calculate_and_save_ndvi_images)
+from backend.app.analytics.ndvi_time_series import build_ndvi_cube
 from backend.app.database.crud import CRUD, Status
+from backend.app.database.database_config import ScopedSession
+from backend.app.fair_share import DEFAULT_TENANT, acquire
 from backend.app.fs.file_system_storage import ArtifactsFileSystemStorage
-from backend.app.satellite_data_providers.satellite_data_client import \
-    SatelliteDataClient
+from backend.app.fs.product_cache import ProductCache
+from backend.app.fs.storage_manager import StorageManager
+from backend.app.instrumentation import pipeline_run, stage
+from backend.app.satellite_data_providers.downloader import (CHUNK_SIZE,
+                                                             MAX_WORKERS,
+                                                             ChunkedDownloader)
+from backend.app.satellite_data_providers.satellite_data_client import (
+    CLOUD_COVER, SatelliteDataClient, get_tile_id)
 from backend.app.satellite_data_providers.satellite_data_extractor import \
     SciHubSatelliteDataExtractor
 from backend.app.utils import unzip_files
@@ -22,94 +43,768 @@ logging.basicConfig(
            "(%(filename)s).%(funcName)s(%(lineno)d) - "
            "%(message)s",
 )
+logger = logging.getLogger()
 
 app = Celery('get_information',
              broker=os.environ.get('BROKER_URL'))
+# Workers take one task at a time, so tasks with higher priority
+# aren't stuck behind tasks already prefetched by busy workers
+app.conf.worker_prefetch_multiplier = 1
+
+# Downloads wait for network and are run by worker with many processes,
+# calculations are run by worker with a process per CPU, so long
+# downloads don't delay calculations. Stages of pipeline runs read
+# process-wide IO and memory counters, so workers must not run tasks
+# in threads
+IO_QUEUE = os.getenv("IO_QUEUE", default="io")
+COMPUTE_QUEUE = os.getenv("COMPUTE_QUEUE", default="compute")
+# Lower value is consumed first from redis. Single field tasks go before
+# batches, tasks deferred by fair share go last
+INTERACTIVE_PRIORITY = 0
+BATCH_PRIORITY = 6
+DEFERRED_PRIORITY = 9
 
 api = SentinelAPI(user=os.environ.get("login"),
                   password=os.environ.get("password"),
                   api_url=os.environ.get("api"))
 
-dp_client = SatelliteDataClient(api_client=api)
-crud = CRUD()
+downloader = ChunkedDownloader(
+    session=api.session,
+    chunk_size=int(os.getenv("DOWNLOAD_CHUNK_SIZE", default=CHUNK_SIZE)),
+    max_workers=int(os.getenv("DOWNLOAD_MAX_WORKERS", default=MAX_WORKERS)))
+dp_client = SatelliteDataClient(api_client=api, downloader=downloader)
+crud = CRUD(db=ScopedSession)
 storage = ArtifactsFileSystemStorage(
     base_path=os.getenv("FS_STORAGE_BASE_PATH", default="STORAGE"))
+product_cache = ProductCache(
+    storage=storage,
+    max_size=int(os.getenv("PRODUCT_CACHE_MAX_SIZE", default=0)))
+storage_manager = StorageManager(
+    storage=storage, product_cache=product_cache,
+    quota=int(os.getenv("STORAGE_QUOTA", default=0)),
+    min_product_age=int(os.getenv("STORAGE_MIN_PRODUCT_AGE",
+                                  default=3600)))
+# Storage is checked by celery beat with this interval in seconds
+storage_check_interval = int(os.getenv("STORAGE_CHECK_INTERVAL",
+                                       default=600))
+
+# Bands are read directly from zipped products when enabled
+keep_zipped = os.getenv("KEEP_SATELLITE_DATA_ZIPPED",
+                        default="false").lower() == "true"
+# Clouds, their shadows and snow are masked with scene classification
+# of L2A products when enabled, so scenes with more clouds are accepted
+scl_masking = os.getenv("SCL_MASKING", default="false").lower() == "true"
+cloud_cover = (0, int(os.getenv("MAX_SCENE_CLOUD_COVER", default=60))) \
+    if scl_masking else CLOUD_COVER
+# The least cloudy scenes which cloud cover over the field is compared
+cloud_ranking_candidates = int(os.getenv("CLOUD_RANKING_CANDIDATES",
+                                         default=3))
+ndvi_bands = NDVI_BANDS + (SCL_BAND,) if scl_masking else NDVI_BANDS
+# Only files of bands used by NDVI are downloaded when enabled
+download_bands_only = os.getenv("DOWNLOAD_BANDS_ONLY",
+                                default="true").lower() == "true"
+required_bands = ndvi_bands if download_bands_only else None
 
 
-@app.task()
-def get_satellite_data(geo_json: dict, field_id: int):
+@task_postrun.connect
+def close_db_session(**kwargs):
     """
-    Gets field data from api,
-    takes zipped data and
-    unzips it.
-    :param field_id:
-    :param dict geo_json:
-    :return str zipped_path:
+    Closes database session of the task, so every task
+    works in its own unit of work.
+    """
+    ScopedSession.remove()
+
+
+def save_pipeline_run(field_id: int, run):
     """
+    Saves stages of the pipeline run, failure to save them
+    doesn't fail the task.
+    :param int field_id: id provided by api
+    :param PipelineRun run: recorded run or None
+    """
+    if run is None:
+        return
     try:
-        crud.change_status(field_id, Status.STARTED_DOWNLOAD)
+        crud.save_pipeline_run(field_id, run)
+    except Exception:
+        logging.exception(f"Failed to save {run.name} stages of {field_id}.")
+        crud.db.rollback()
+
+
+def throttle(task, tenant: str, cost: int = 1):
+    """
+    Defers the task when its tenant has used up its share
+    of workers. Task is sent back to the queue with the lowest
+    priority, so tasks of other tenants run meanwhile.
+    It is called before the task changes anything.
+    :param task: bound task
+    :param str tenant: id of the tenant
+    :param int cost: tokens the task takes e.g. number of its fields
+    """
+    wait = acquire(tenant, cost)
+    if wait > 0:
+        logging.info(f"Deferred {task.name} of {tenant} for {wait:.1f} s.")
+        raise task.retry(countdown=wait, max_retries=None,
+                         priority=DEFERRED_PRIORITY)
 
-        # Convert a GeoJSON object to Well-Known Text
-        footprint = geojson_to_wkt(geo_json)
-        zipped_folder = storage.get_path_to_satellite_data_zipped(field_id)
 
-        # Get data from footprint and return path to zipped data
+def fetch_product(product_id: str, title: str = None, bands=None):
+    """
+    Downloads product into the cache and unzips it
+    unless products are kept zipped. Only files of the bands
+    are downloaded when bands are passed.
+    :param str product_id: uuid of the product
+    :param str title: title of the product, requested when not passed
+    :param bands: band names or None for the whole product
+    """
+    try:
+        if bands is not None:
+            dp_client.download_product(
+                product_id=product_id, title=title,
+                output_folder=storage.get_path_to_product_unzipped(
+                    product_id),
+                bands=bands)
+            return
+
+        if title is None:
+            title = dp_client.get_product_title(product_id)
+        zipped_folder = storage.get_path_to_product_zipped(product_id)
+
         # TODO check on exception, particularly UnAuthorized
-        zipped_path = dp_client.get_data(footprint=footprint,
-                                         output_folder=zipped_folder)
+        zipped_path = dp_client.download_product(product_id=product_id,
+                                                 title=title,
+                                                 output_folder=zipped_folder)
+        if keep_zipped:
+            return
 
         # Unzip directory and return path to it
         unzip_files(path_to_zip=zipped_path,
-                    output_folder=storage.get_path_to_satellite_data_unzipped(
-                        field_id))
+                    output_folder=storage.get_path_to_product_unzipped(
+                        product_id))
         # Delete zipped data
         shutil.rmtree(zipped_folder)
+    finally:
+        # Band files index of the product is rebuilt with new files.
+        # It is removed when files are complete, product lock is still
+        # held, so index built from partial files isn't kept
+        SciHubSatelliteDataExtractor(
+            path_to_data=storage.get_path_to_product(
+                product_id)).reset_index()
+
+
+def find_best_product(geo_json: dict, field_key: str = None):
+    """
+    Finds the best product for the field. When scene classification
+    masking is enabled, the least cloudy scenes are ranked by cloud
+    cover over the field, only their scene classification images
+    are downloaded to compare them.
+    :param dict geo_json: field information in GeoJSON format
+    :param str field_key: geometry hash of the field, reprojected
+        field is cached under it
+    :return tuple(str, str): uuid and title of the best product
+    """
+    footprint = geojson_to_wkt(geo_json)
+    if not scl_masking:
+        return dp_client.find_product(footprint=footprint)
 
-        # Change status
-        crud.change_status(field_id, Status.FINISHED_DOWNLOAD)
+    candidates = dp_client.find_products(
+        footprint=footprint,
+        cloud_cover=cloud_cover)[:cloud_ranking_candidates]
+    if not candidates:
+        raise Exception(f"There are no products for footprint {footprint}.")
+    if len(candidates) == 1:
+        product_id, title, _ = candidates[0]
+        return product_id, title
+
+    covers = []
+    with stage("rank"), tempfile.TemporaryDirectory() as folder:
+        for product_id, title, _ in candidates:
+            # Products without scene classification go last
+            cover = 1.0
+            try:
+                path = dp_client.download_product(
+                    product_id=product_id, title=title,
+                    output_folder=folder, bands=[SCL_BAND])
+                scl = SciHubSatelliteDataExtractor(
+                    path_to_data=path).extract_scl_image_path()
+                if scl is not None:
+                    with rasterio.open(scl) as scl_src:
+                        shapes = reproject_field(geo_json, scl_src.crs,
+                                                 key=field_key)
+                        cover = calculate_cloud_cover(scl_src, shapes)
+            except Exception:
+                logging.exception(f"Failed to get cloud cover of "
+                                  f"{product_id}.")
+            covers.append(cover)
+
+    logging.info(f"Cloud cover of the field in candidates: {covers}.")
+    product_id, title, _ = candidates[covers.index(min(covers))]
+    return product_id, title
+
+
+def reuse_ndvi_image(field_id: int, geo_json: dict, product_id: str):
+    """
+    Shares NDVI image and statistics of another field with the same
+    geometry which NDVI is calculated with the same product.
+    :param int field_id: id provided by api
+    :param dict geo_json: field information in GeoJSON format
+    :param str product_id: uuid of the product
+    :return tuple(str, dict): path to NDVI image and statistics
+        or None when there is no such field
+    """
+    duplicate = crud.get_calculated_duplicate(
+        field_id, geometry_hash(geo_json), product_id)
+    if duplicate is None:
+        return None
+
+    try:
+        file_path = storage.share_ndvi_image(duplicate.id, field_id)
+    except FileNotFoundError:
+        # Duplicate was deleted meanwhile
+        return None
+
+    logging.info(f"Reused NDVI of {duplicate.id} for {field_id}.")
+    return file_path, duplicate.ndvi_stats
+
+
+@app.task(bind=True, queue=IO_QUEUE, priority=INTERACTIVE_PRIORITY)
+def get_satellite_data(self, geo_json: dict, field_id: int,
+                       tenant: str = DEFAULT_TENANT):
+    """
+    Gets field data from api,
+    takes zipped data and
+    unzips it. Products are shared between fields via product cache.
+    :param field_id:
+    :param dict geo_json:
+    :param str tenant: id of the tenant
+    :return:
+    """
+    throttle(self, tenant)
+    run = None
+    try:
+        with pipeline_run("get_satellite_data") as run:
+            crud.change_status(field_id, Status.STARTED_DOWNLOAD)
+
+            # Find the best product for footprint
+            field_key = geometry_hash(geo_json)
+            product_id, title = find_best_product(geo_json, field_key)
+
+            # Product isn't needed when NDVI of the same geometry
+            # is already calculated with it
+            with stage("db"):
+                duplicate = crud.get_calculated_duplicate(
+                    field_id, field_key, product_id)
+
+            # Reuse product if it was already downloaded for another field
+            if duplicate is None:
+                with stage("acquire"):
+                    product_cache.acquire(
+                        product_id=product_id, field_id=field_id,
+                        fetch=lambda product, bands: fetch_product(
+                            product, title, bands),
+                        bands=required_bands)
+            storage.link_field_to_product(field_id, product_id)
+
+            # Save product and change status with one query
+            with stage("db"), crud.writer() as writer:
+                writer.update(field_id, product_id=product_id,
+                              status=Status.FINISHED_DOWNLOAD)
 
     except Exception as ex:
         crud.change_status(field_id, Status.ERROR_DOWNLOAD)
         raise ex
+    finally:
+        save_pipeline_run(field_id, run)
+
+
+@app.task(bind=True, queue=IO_QUEUE, priority=BATCH_PRIORITY)
+def get_satellite_data_by_tile(self, field_ids: list,
+                               tenant: str = DEFAULT_TENANT):
+    """
+    Gets satellite data of many fields with one query to api.
+    Fields are grouped by Sentinel-2 tile of the best product covering
+    them and download of every tile is fanned out to workers,
+    so product of the tile is downloaded once for all its fields.
+    :param list field_ids: ids provided by api
+    :param str tenant: id of the tenant
+    :return dict: tile -> ids of the fields
+    """
+    throttle(self, tenant)
+    fields = crud.get_fields(field_ids)
+    field_ids = [field.id for field in fields]
+    crud.change_status_bulk(field_ids, Status.STARTED_DOWNLOAD)
+
+    try:
+        # Products are queried once for the area covering all fields
+        area = shapely.GeometryCollection(
+            [field_shape(field.geo_json) for field in fields]).convex_hull
+        products = dp_client.find_products(footprint=area.wkt,
+                                           cloud_cover=cloud_cover)
+        groups = crud.get_fields_by_footprints(
+            field_ids, [footprint for _, _, footprint in products])
+    except Exception as ex:
+        crud.change_status_bulk(field_ids, Status.ERROR_DOWNLOAD)
+        raise ex
+
+    # Every field is assigned to the best product covering it
+    tiles = {}
+    remaining = set(field_ids)
+    downloads = []
+    for (product_id, title, _), group_ids in zip(products, groups):
+        group_ids = [field_id for field_id in group_ids
+                     if field_id in remaining]
+        if not group_ids:
+            continue
+        remaining.difference_update(group_ids)
+        tiles[get_tile_id(title)] = group_ids
+        downloads.append(get_tile_data.si(product_id, title, group_ids,
+                                          tenant))
+
+    crud.change_status_bulk(sorted(remaining), Status.ERROR_DOWNLOAD)
+
+    logging.info(f"Started download of {len(tiles)} tiles "
+                 f"for {len(field_ids)} fields: {tiles}.")
+    if downloads:
+        group(downloads).delay()
+    return tiles
 
 
-@app.task()
-def count_ndvi(field_id: int):
+@app.task(bind=True, queue=IO_QUEUE, priority=BATCH_PRIORITY)
+def get_tile_data(self, product_id: str, title: str, field_ids: list,
+                  tenant: str = DEFAULT_TENANT):
+    """
+    Downloads product of the tile once and links all fields
+    lying in the tile to it.
+    :param str product_id: uuid of the product
+    :param str title: title of the product
+    :param list field_ids: ids provided by api
+    :param str tenant: id of the tenant
+    :return:
+    """
+    throttle(self, tenant, cost=len(field_ids))
+    try:
+        # The first field fetches product, others reuse it from cache
+        for field_id in field_ids:
+            product_cache.acquire(
+                product_id=product_id, field_id=field_id,
+                fetch=lambda product, bands: fetch_product(product, title,
+                                                           bands),
+                bands=required_bands)
+            storage.link_field_to_product(field_id, product_id)
+
+        with crud.writer() as writer:
+            for field_id in field_ids:
+                writer.update(field_id, product_id=product_id,
+                              status=Status.FINISHED_DOWNLOAD)
+    except Exception as ex:
+        crud.change_status_bulk(field_ids, Status.ERROR_DOWNLOAD)
+        raise ex
+
+
+@app.task(bind=True, queue=COMPUTE_QUEUE, priority=INTERACTIVE_PRIORITY)
+def count_ndvi(self, field_id: int, tenant: str = DEFAULT_TENANT):
     """
     Calculates NDVI and creates NDVI image for field
     under field_id provided by api.
     :param int field_id: id provide by api
+    :param str tenant: id of the tenant
     :return:
     """
+    throttle(self, tenant)
+    run = None
     try:
-        crud.change_status(field_id, Status.STARTED_CALCULATION)
+        with pipeline_run("count_ndvi") as run:
+            crud.change_status(field_id, Status.STARTED_CALCULATION)
+
+            # Get field with its geojson and product from database
+            with stage("db"):
+                field = crud.get_field(field_id)
+            with stage("reuse"):
+                reused = reuse_ndvi_image(field_id, field.geo_json,
+                                          field.product_id)
 
-        # Get path to the unzipped satellite data
-        path = storage.get_path_to_satellite_data_unzipped(field_id)
+            if reused is not None:
+                file_path, statistics = reused
+            else:
+                # Product is skipped on download when duplicate is found
+                with stage("acquire"):
+                    product_cache.acquire(
+                        product_id=field.product_id, field_id=field_id,
+                        fetch=lambda product, bands: fetch_product(
+                            product, bands=bands),
+                        bands=required_bands)
 
-        # Get path to Red and NIR satellite images
-        provider = SciHubSatelliteDataExtractor(path_to_data=path)
-        nir = provider.extract_nir_image_path()
-        red = provider.extract_red_image_path()
+                # Get path to the satellite data linked to field
+                path = storage.get_path_to_satellite_data(field_id)
 
-        # Create path to the NDVI file.
-        ndvi_folder_path = storage.get_path_to_ndvi_image(field_id=field_id)
-        file_path = ndvi_folder_path
+                # Get path to Red and NIR satellite images
+                with stage("extract"):
+                    provider = SciHubSatelliteDataExtractor(path_to_data=path)
+                    nir = provider.extract_nir_image_path()
+                    red = provider.extract_red_image_path()
+                    scl = provider.extract_scl_image_path() \
+                        if scl_masking else None
 
-        # Get geojson from database
-        field_geojson = crud.get_geojson_by_field_id(field_id=field_id)
+                # Create path to the NDVI file.
+                file_path = storage.get_path_to_ndvi_image(field_id=field_id)
 
-        logging.info(
-            f"Started ndvi calculation! nir:{nir} red:{red} out: {file_path}")
+                logging.info(f"Started ndvi calculation! "
+                             f"nir:{nir} red:{red} scl:{scl} "
+                             f"out: {file_path}")
 
-        calculate_and_save_ndvi_image(nir=nir, red=red, file_path=file_path,
-                                      field_geojson=field_geojson)
+                statistics = calculate_and_save_ndvi_image(
+                    nir=nir, red=red, file_path=file_path,
+                    field_geojson=field.geo_json, scl=scl,
+                    field_key=field.geometry_hash)
 
-        # Save path to NDVI image to database.
-        # It is used when we return image from endpoint
-        crud.save_ndvi_path_to_db(path=file_path, field_id=field_id)
-        crud.change_status(field_id, Status.FINISHED_CALCULATION)
+            # Save path to NDVI image to database.
+            # It is used when we return image from endpoint
+            with stage("db"), crud.writer() as writer:
+                writer.update(field_id, ndvi=file_path, ndvi_stats=statistics,
+                              status=Status.FINISHED_CALCULATION)
 
     except Exception as ex:
         crud.change_status(field_id, Status.ERROR_CALCULATION)
         raise ex
+    finally:
+        save_pipeline_run(field_id, run)
+
+
+@app.task(bind=True, queue=COMPUTE_QUEUE, priority=BATCH_PRIORITY)
+def count_ndvi_batch(self, field_ids: list, tenant: str = DEFAULT_TENANT):
+    """
+    Calculates NDVI and creates NDVI images for many fields.
+    Fields are grouped by satellite product, so every product
+    is opened once for all fields lying in it. NDVI of fields
+    with the same geometry is reused, products of other fields
+    are fetched again when they are not in cache.
+    :param list field_ids: ids provided by api
+    :param str tenant: id of the tenant
+    :return:
+    """
+    throttle(self, tenant, cost=len(field_ids))
+    fields = crud.get_fields(field_ids)
+    crud.change_status_bulk(field_ids, Status.STARTED_CALCULATION)
+
+    # Group fields by product they were downloaded with
+    products = {}
+    for field in fields:
+        products.setdefault(field.product_id, []).append(field)
+
+    paths = {}
+    statistics = {}
+    found = {field.id for field in fields}
+    failed = [field_id for field_id in field_ids if field_id not in found]
+    for product_id, product_fields in products.items():
+        # Product isn't needed by fields which NDVI is reused
+        calculated_fields = []
+        for field in product_fields:
+            reused = reuse_ndvi_image(field.id, field.geo_json, product_id)
+            if reused is None:
+                calculated_fields.append(field)
+                continue
+            paths[field.id], statistics[field.id] = reused
+        if not calculated_fields:
+            continue
+
+        product_fields = calculated_fields
+        product_paths = {
+            field.id: storage.get_path_to_ndvi_image(field_id=field.id)
+            for field in product_fields}
+        try:
+            # The first field fetches product, others reuse it from cache
+            for field in product_fields:
+                product_path = product_cache.acquire(
+                    product_id=product_id, field_id=field.id,
+                    fetch=lambda product, bands: fetch_product(
+                        product, bands=bands),
+                    bands=required_bands)
+
+            provider = SciHubSatelliteDataExtractor(
+                path_to_data=product_path)
+            nir = provider.extract_nir_image_path()
+            red = provider.extract_red_image_path()
+            scl = provider.extract_scl_image_path() if scl_masking else None
+
+            logging.info(f"Started ndvi calculation of "
+                         f"{len(product_fields)} fields! "
+                         f"nir:{nir} red:{red} scl:{scl}")
+
+            product_statistics, errors = calculate_and_save_ndvi_images(
+                nir=nir, red=red,
+                fields={field.id: (product_paths[field.id], field.geo_json,
+                                   field.geometry_hash)
+                        for field in product_fields},
+                scl=scl)
+        except Exception:
+            logging.exception(f"Failed to open product {product_id}.")
+            product_statistics = {}
+            errors = {field.id: None for field in product_fields}
+
+        failed.extend(errors)
+        statistics.update(product_statistics)
+        paths.update({field_id: path
+                      for field_id, path in product_paths.items()
+                      if field_id not in errors})
+
+    # Save results of all fields at once
+    with crud.writer() as writer:
+        for field_id, path in paths.items():
+            writer.update(field_id, ndvi=path,
+                          ndvi_stats=statistics[field_id],
+                          status=Status.FINISHED_CALCULATION)
+        for field_id in failed:
+            writer.update(field_id, status=Status.ERROR_CALCULATION)
+
+
+@app.task(bind=True, queue=COMPUTE_QUEUE, priority=INTERACTIVE_PRIORITY)
+def count_indices(self, field_id: int, names: list,
+                  tenant: str = DEFAULT_TENANT):
+    """
+    Calculates several spectral indices of the field in one pass
+    and creates their images. Product is fetched again when
+    it lacks bands of the indices.
+    :param int field_id: id provided by api
+    :param list names: names of the indices e.g. NDVI, EVI
+    :param str tenant: id of the tenant
+    :return:
+    """
+    throttle(self, tenant)
+    field = crud.get_field(field_id)
+    indices = dict(field.indices or {})
+    indices.update({name: {"status": Status.STARTED_CALCULATION}
+                    for name in names})
+    with crud.writer() as writer:
+        writer.update(field_id, indices=indices)
+
+    try:
+        bands = get_required_bands(names)
+        product_cache.acquire(
+            product_id=field.product_id, field_id=field_id,
+            fetch=lambda product, missing_bands: fetch_product(
+                product, bands=missing_bands),
+            bands=bands if download_bands_only else None)
+
+        provider = SciHubSatelliteDataExtractor(
+            path_to_data=storage.get_path_to_satellite_data(field_id))
+        band_paths = {band: provider.extract_finest_band_image_path(band)
+                      for band in bands}
+
+        logging.info(f"Started {names} calculation of {field_id}! "
+                     f"bands: {band_paths}")
+        statistics = calculate_and_save_indices(
+            band_paths=band_paths, field_geojson=field.geo_json,
+            file_paths={name: storage.get_path_to_index_image(field_id, name)
+                        for name in names},
+            field_key=field.geometry_hash)
+
+        indices.update({name: {"status": Status.FINISHED_CALCULATION,
+                               "stats": statistics[name]}
+                        for name in names})
+    except Exception as ex:
+        indices.update({name: {"status": Status.ERROR_CALCULATION}
+                        for name in names})
+        raise ex
+    finally:
+        with crud.writer() as writer:
+            writer.update(field_id, indices=indices)
+
+
+def run_pipeline(geo_json: dict, field_id: int,
+                 tenant: str = DEFAULT_TENANT):
+    """
+    Links satellite data download and NDVI calculation,
+    so NDVI calculation starts as soon as data is downloaded.
+    Calculation is not started if download fails.
+    :param dict geo_json:
+    :param int field_id: id provided by api
+    :param str tenant: id of the tenant
+    :return: result of the chain
+    """
+    return chain(get_satellite_data.si(geo_json, field_id, tenant),
+                 count_ndvi.si(field_id, tenant)).delay()
+
+
+@app.task(bind=True, queue=IO_QUEUE, priority=BATCH_PRIORITY)
+def count_ndvi_time_series(self, field_id: int, date_from: str, date_to: str,
+                           build_cube: bool = False,
+                           tenant: str = DEFAULT_TENANT):
+    """
+    Finds the best product of every acquisition date in the date range
+    and fans out download and NDVI calculation of every date
+    to workers, so dates are processed in parallel.
+    :param int field_id: id provided by api
+    :param str date_from: first date of the range in ISO format
+    :param str date_to: last date of the range in ISO format
+    :param bool build_cube: stack NDVI images of all dates into one image
+    :param str tenant: id of the tenant
+    :return int: number of dates in time series
+    """
+    throttle(self, tenant)
+    geo_json = crud.get_geojson_by_field_id(field_id=field_id)
+    products = dp_client.find_products_by_date(
+        footprint=geojson_to_wkt(geo_json),
+        date_from=date.fromisoformat(date_from),
+        date_to=date.fromisoformat(date_to),
+        cloud_cover=cloud_cover)
+    crud.create_time_series(field_id, [
+        (acquisition_date, product_id)
+        for acquisition_date, product_id, _ in products])
+
+    logging.info(f"Started NDVI time series of {field_id} "
+                 f"for {len(products)} dates.")
+    # Every date is downloaded by io worker and calculated
+    # by compute worker
+    group(chain(fetch_product_for_date.si(field_id, acquisition_date,
+                                          product_id, title, build_cube,
+                                          tenant),
+                count_ndvi_for_date.si(field_id, acquisition_date,
+                                       product_id, build_cube, tenant))
+          for acquisition_date, product_id, title in products).delay()
+    return len(products)
+
+
+@app.task(bind=True, queue=IO_QUEUE, priority=BATCH_PRIORITY)
+def fetch_product_for_date(self, field_id: int, acquisition_date: str,
+                           product_id: str, title: str,
+                           build_cube: bool = False,
+                           tenant: str = DEFAULT_TENANT):
+    """
+    Downloads product of one date of the time series. The date keeps
+    reference to the product until its NDVI is calculated.
+    :param int field_id: id provided by api
+    :param str acquisition_date: date in ISO format
+    :param str product_id: uuid of the product
+    :param str title: title of the product
+    :param bool build_cube: stack NDVI images of all dates into one image
+        when the last date is processed
+    :param str tenant: id of the tenant
+    """
+    throttle(self, tenant)
+    try:
+        product_cache.acquire(
+            product_id=product_id, field_id=field_id,
+            fetch=lambda product, bands: fetch_product(product, title,
+                                                       bands),
+            date=acquisition_date, bands=required_bands)
+        crud.update_time_series_date(field_id, acquisition_date,
+                                     status=Status.FINISHED_DOWNLOAD)
+    except Exception as ex:
+        crud.update_time_series_date(field_id, acquisition_date,
+                                     status=Status.ERROR_DOWNLOAD)
+        if build_cube:
+            try_build_ndvi_cube(field_id)
+        raise ex
+
+
+@app.task(bind=True, queue=COMPUTE_QUEUE, priority=BATCH_PRIORITY)
+def count_ndvi_for_date(self, field_id: int, acquisition_date: str,
+                        product_id: str, build_cube: bool = False,
+                        tenant: str = DEFAULT_TENANT):
+    """
+    Calculates NDVI of the field with product of one date
+    of the time series. Product is released right after
+    calculation, only NDVI image of the date is kept.
+    :param int field_id: id provided by api
+    :param str acquisition_date: date in ISO format
+    :param str product_id: uuid of the product fetched for the date
+    :param bool build_cube: stack NDVI images of all dates into one image
+        when the last date is calculated
+    :param str tenant: id of the tenant
+    """
+    throttle(self, tenant)
+    try:
+        try:
+            crud.update_time_series_date(field_id, acquisition_date,
+                                         status=Status.STARTED_CALCULATION)
+
+            field = crud.get_field(field_id)
+            provider = SciHubSatelliteDataExtractor(
+                path_to_data=storage.get_path_to_product(product_id))
+            file_path = storage.get_path_to_time_series_ndvi_image(
+                field_id=field_id, date=acquisition_date)
+            statistics = calculate_and_save_ndvi_image(
+                nir=provider.extract_nir_image_path(),
+                red=provider.extract_red_image_path(),
+                file_path=file_path,
+                field_geojson=field.geo_json,
+                scl=provider.extract_scl_image_path()
+                if scl_masking else None,
+                field_key=field.geometry_hash)
+        finally:
+            product_cache.release(field_id, date=acquisition_date)
+            product_cache.evict()
+
+        crud.update_time_series_date(field_id, acquisition_date,
+                                     ndvi=file_path, ndvi_stats=statistics,
+                                     status=Status.FINISHED_CALCULATION)
+    except Exception as ex:
+        crud.update_time_series_date(field_id, acquisition_date,
+                                     status=Status.ERROR_CALCULATION)
+        if build_cube:
+            try_build_ndvi_cube(field_id)
+        raise ex
+
+    if build_cube:
+        try_build_ndvi_cube(field_id)
+
+
+def try_build_ndvi_cube(field_id: int):
+    """
+    Builds NDVI cube of the field if it is ready. Errors are only
+    logged, so they don't replace the result of the date.
+    :param int field_id: id provided by api
+    """
+    try:
+        build_ndvi_cube_if_ready(field_id)
+    except Exception:
+        logger.exception(f"Failed to build NDVI cube of {field_id}.")
+
+
+def build_ndvi_cube_if_ready(field_id: int):
+    """
+    Builds NDVI cube of the field once all dates of time series
+    are processed.
+    :param int field_id: id provided by api
+    """
+    time_series = crud.get_time_series(field_id)
+    if any(entry.status not in (Status.FINISHED_CALCULATION,
+                                Status.ERROR_DOWNLOAD,
+                                Status.ERROR_CALCULATION)
+           for entry in time_series):
+        return
+
+    images = [(entry.date.isoformat(), entry.ndvi) for entry in time_series
+              if entry.status == Status.FINISHED_CALCULATION]
+    if images:
+        build_ndvi_cube(images, storage.get_path_to_ndvi_cube(field_id))
+
+
+# Products of these fields are needed soon, so they are not evicted
+IN_PROGRESS_STATUSES = (Status.STARTED_DOWNLOAD, Status.FINISHED_DOWNLOAD,
+                        Status.STARTED_CALCULATION)
+
+
+@app.task(queue=IO_QUEUE, priority=BATCH_PRIORITY)
+def manage_storage():
+    """
+    Keeps storage within quota, raw products are evicted
+    in least recently used order and outputs of fields are kept.
+    :return dict: bytes used by products and fields
+    """
+    # Products are read by indices after NDVI is calculated
+    pinned = crud.get_field_ids_by_status(IN_PROGRESS_STATUSES) + \
+        crud.get_field_ids_calculating_indices()
+    usage = storage_manager.enforce_quota(pinned=pinned)
+    return {"products_size": usage["products_size"],
+            "fields_size": usage["fields_size"]}
+
+
+app.conf.beat_schedule = {
+    "manage_storage": {
+        "task": manage_storage.name,
+        "schedule": storage_check_interval,
+        # Checks which didn't start in time are skipped
+        "options": {"expires": storage_check_interval},
+    },
+}
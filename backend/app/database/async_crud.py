@@ -0,0 +1,177 @@
+import logging
+
+from geojson_pydantic import FeatureCollection
+from sqlalchemy import delete, insert, select
+
+from backend.app.analytics.geometry import prepare_field
+
+from . import models
+from .crud import Status
+from .database_config import AsyncSessionLocal
+
+logger = logging.getLogger()
+
+
+class AsyncCRUD:
+    """
+    This class is responsible for communicating with database
+    from API without blocking event loop.
+    Session is reused by all calls and is closed by caller
+    when request is finished.
+    """
+
+    def __init__(self, db=None):
+        self.db = db if db is not None else AsyncSessionLocal()
+
+    async def close(self):
+        """
+        Closes database session.
+        """
+        await self.db.close()
+
+    async def create_field(self, field: FeatureCollection):
+        """
+        Function that creates row in field table.
+        :param field: field information from GeoJSON
+        :return int field_id: field id from database
+        :raise ValueError: if field has no valid geometry
+        """
+
+        geo_json = field.dict()
+        db_field = models.Fields(**prepare_field(geo_json),
+                                 status=Status.FIELD_CREATED)
+
+        logger.info("Adding field to database.")
+        self.db.add(db_field)
+
+        # Committing database changes, id is filled in by flush.
+        await self.db.commit()
+        return db_field.id
+
+    async def create_fields(self, fields: list):
+        """
+        Creates rows of many fields with one multi-row insert.
+        :param list fields: validated fields with geo_json, geometry
+            in WKT and geometry_hash
+        :return list: field ids from database in order of fields
+        """
+
+        if not fields:
+            return []
+
+        rows = [dict(field, status=Status.FIELD_CREATED) for field in fields]
+
+        logger.info(f"Adding {len(rows)} fields to database.")
+        result = await self.db.scalars(
+            insert(models.Fields).returning(models.Fields.id,
+                                            sort_by_parameter_order=True),
+            rows)
+        field_ids = result.all()
+
+        # Committing database changes.
+        await self.db.commit()
+        return field_ids
+
+    async def get_field(self, field_id: int):
+        """
+        Function that gets field row by field_id.
+        :param int field_id: id of the field from user
+        :return models.Fields: field row
+        """
+
+        logger.info(f"Getting field {field_id}.")
+        return await self.db.get(models.Fields, field_id)
+
+    async def get_fields(self, field_ids: list):
+        """
+        Gets fields rows by their ids with one query.
+        :param list field_ids: ids of the fields from user
+        :return list: fields rows
+        """
+
+        logger.info(f"Getting fields {field_ids}.")
+        result = await self.db.scalars(select(models.Fields).where(
+            models.Fields.id.in_(field_ids)))
+        return result.all()
+
+    async def get_status(self, field_id: int):
+        """
+        Gets and returns status of the server process in the database.
+        :param int field_id: id of the field from user
+        :return str: status text
+        """
+
+        logger.info(f"Getting {field_id} status.")
+        return await self.db.scalar(select(models.Fields.status).where(
+            models.Fields.id == field_id))
+
+    async def get_ndvi_stats(self, field_id: int):
+        """
+        Gets status and NDVI statistics of the field with one query.
+        :param int field_id: id of the field from user
+        :return: row with status and ndvi_stats
+        """
+
+        logger.info(f"Getting {field_id} NDVI statistics.")
+        result = await self.db.execute(select(
+            models.Fields.status, models.Fields.ndvi_stats).where(
+            models.Fields.id == field_id))
+        return result.first()
+
+    async def get_time_series(self, field_id: int):
+        """
+        Gets NDVI time series of the field sorted by date.
+        :param int field_id: id of the field from user
+        :return list: time series rows
+        """
+
+        logger.info(f"Getting {field_id} NDVI time series.")
+        result = await self.db.scalars(
+            select(models.FieldNdviTimeSeries).where(
+                models.FieldNdviTimeSeries.field_id == field_id).order_by(
+                models.FieldNdviTimeSeries.date))
+        return result.all()
+
+    async def get_pipeline_stages(self, field_id: int):
+        """
+        Gets recorded pipeline stages of the field, latest first.
+        :param int field_id: id of the field from user
+        :return list: stages rows
+        """
+
+        logger.info(f"Getting {field_id} pipeline stages.")
+        result = await self.db.scalars(
+            select(models.PipelineStage).where(
+                models.PipelineStage.field_id == field_id).order_by(
+                models.PipelineStage.id.desc()))
+        return result.all()
+
+    async def get_pipeline_stage_totals(self):
+        """
+        Gets running totals of pipeline stages of all fields
+        by run and stage. Totals are kept when fields are deleted.
+        :return list: rows with run, stage, count, sums of seconds
+            and bytes and max of peak memory
+        """
+
+        result = await self.db.execute(select(
+            models.PipelineStageTotal).order_by(
+            models.PipelineStageTotal.run, models.PipelineStageTotal.stage))
+        return result.scalars().all()
+
+    async def delete_field_data_from_db(self, field_id: int):
+        """
+        Deletes all data about the field under field_id.
+        :param int field_id: id of the field from user
+        """
+
+        logger.info(f"Deleting {field_id} from db.")
+        await self.db.execute(delete(models.PipelineStage).where(
+            models.PipelineStage.field_id == field_id))
+        await self.db.execute(delete(models.FieldNdviTimeSeries).where(
+            models.FieldNdviTimeSeries.field_id == field_id))
+        await self.db.execute(delete(models.Fields).where(
+            models.Fields.id == field_id))
+
+        # Committing database changes.
+        await self.db.commit()
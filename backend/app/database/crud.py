@@ -1,9 +1,18 @@
 import logging
+from datetime import date
 
+import shapely
 from geojson_pydantic import FeatureCollection
+from sqlalchemy import case, func
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from backend.app.analytics.geometry import group_by_footprints, prepare_field
+from backend.app.status_events import publish_status
 
 from . import models
 from .database_config import SessionLocal
+from .spatial import SRID, is_spatial
 
 logger = logging.getLogger()
 
@@ -20,23 +29,107 @@ class Status:
     ERROR_CALCULATION = "ERROR_CALCULATION"
 
 
+class FieldWriter:
+    """
+    This class collects updates of fields and writes them
+    to database with one round trip. Later updates of the field
+    override earlier ones, so only the last status is written.
+    Updates of fields deleted meanwhile are skipped.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.pending = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.db.rollback()
+
+    def update(self, field_id: int, **values):
+        """
+        Adds update of the field.
+        :param int field_id: id of the field from user
+        :param values: column -> value
+        """
+        self.pending.setdefault(field_id, {}).update(values)
+
+    def flush(self):
+        """
+        Writes collected updates to database.
+        """
+        if not self.pending:
+            return
+
+        # Bulk update fails when any row is missing
+        existing = {field_id for field_id, in self.db.query(
+            models.Fields.id).filter(models.Fields.id.in_(self.pending))}
+        missing = set(self.pending) - existing
+        if missing:
+            logger.warning(f"Fields {sorted(missing)} don't exist, "
+                           f"their updates are skipped.")
+            self.pending = {field_id: values
+                            for field_id, values in self.pending.items()
+                            if field_id in existing}
+
+        logger.info(f"Updating {list(self.pending)} fields in db.")
+        self.db.bulk_update_mappings(models.Fields, [
+            {"id": field_id, **values}
+            for field_id, values in self.pending.items()
+        ])
+
+        # Committing database changes.
+        self.db.commit()
+
+        # Push status changes to clients
+        statuses = {}
+        for field_id, values in self.pending.items():
+            if "status" in values:
+                statuses.setdefault(values["status"], []).append(field_id)
+        for status, field_ids in statuses.items():
+            publish_status(field_ids, status)
+
+        self.pending = {}
+
+
 class CRUD:
     """
     This class is responsible for communicating with database.
+    Session is reused by all calls and is closed by caller
+    when request or task is finished.
     """
 
-    def __init__(self):
-        self.db = SessionLocal()
+    def __init__(self, db=None):
+        self.db = db if db is not None else SessionLocal()
+
+    def close(self):
+        """
+        Closes database session.
+        """
+        self.db.close()
+
+    def writer(self):
+        """
+        Returns writer which updates many fields with one round trip.
+        :return FieldWriter:
+        """
+        return FieldWriter(self.db)
 
     def create_field(self, field: FeatureCollection):
         """
         Function that creates row in field table.
         :param field: field information from GeoJSON
         :return int field_id: field id from database
+        :raise ValueError: if field has no valid geometry
         """
 
         # Creating product ID and URL model.
-        db_field = models.Fields(**{"geo_json": field.dict()},
+        geo_json = field.dict()
+        db_field = models.Fields(**prepare_field(geo_json),
                                  status=Status.FIELD_CREATED)
 
         logger.info("Adding field to database.")
@@ -49,10 +142,37 @@ class CRUD:
         self.db.refresh(db_field)
 
         # Save field id
-        field_id = db_field.id
+        return db_field.id
 
-        self.db.close()
-        return field_id
+    def get_field(self, field_id: int):
+        """
+        Function that gets field row by field_id, so status and GeoJSON
+        are taken with one query.
+        :param int field_id: id of the field from user
+        :return models.Fields: field row
+        """
+
+        logger.info(f"Getting field {field_id}.")
+        return self.db.query(models.Fields).filter_by(id=field_id).first()
+
+    def get_calculated_duplicate(self, field_id: int, geometry_hash: str,
+                                 product_id: str):
+        """
+        Finds another field with the same geometry whose NDVI
+        is already calculated with the same product.
+        :param int field_id: id of the field from user
+        :param str geometry_hash: canonical hash of the field geometry
+        :param str product_id: uuid of the product
+        :return models.Fields: duplicate field row or None
+        """
+
+        logger.info(f"Looking for calculated duplicate of {field_id}.")
+        return self.db.query(models.Fields).filter(
+            models.Fields.geometry_hash == geometry_hash,
+            models.Fields.product_id == product_id,
+            models.Fields.status == Status.FINISHED_CALCULATION,
+            models.Fields.id != field_id).order_by(
+            models.Fields.id.desc()).first()
 
     def get_geojson_by_field_id(self, field_id: int):
         """
@@ -63,9 +183,8 @@ class CRUD:
 
         logger.info(f"Getting GeoJSON by {field_id}.")
         # Getting JSON by fields id.
-        data = self.db.query(models.Fields).filter_by(id=field_id).first()
-
-        self.db.close()
+        data = self.db.query(models.Fields.geo_json).filter_by(
+            id=field_id).first()
         return data.geo_json
 
     def save_ndvi_path_to_db(self, path: str, field_id: int):
@@ -82,8 +201,6 @@ class CRUD:
         # Committing database changes.
         self.db.commit()
 
-        self.db.close()
-
     def delete_field_data_from_db(self, field_id: int):
         """
         Deletes all data about the field under field_id.
@@ -91,10 +208,15 @@ class CRUD:
         """
 
         logger.info(f"Deleting {field_id} from db.")
+        self.db.query(models.PipelineStage).filter(
+            models.PipelineStage.field_id == field_id).delete()
+        self.db.query(models.FieldNdviTimeSeries).filter(
+            models.FieldNdviTimeSeries.field_id == field_id).delete()
         self.db.query(models.Fields).filter(
             models.Fields.id == field_id).delete()
 
-        self.db.close()
+        # Committing database changes.
+        self.db.commit()
 
     def change_status(self, field_id: int, status_text: str):
         """
@@ -109,8 +231,88 @@ class CRUD:
 
         # Committing database changes.
         self.db.commit()
+        publish_status([field_id], status_text)
 
-        self.db.close()
+    def change_status_bulk(self, field_ids: list, status_text: str):
+        """
+        Changes status of many fields with one query.
+        :param list field_ids: ids of the fields from user
+        :param str status_text: status text
+        """
+
+        if not field_ids:
+            return
+
+        logger.info(f"Updating {field_ids} status column with {status_text}.")
+        self.db.query(models.Fields).where(
+            models.Fields.id.in_(field_ids)).update(
+            {"status": status_text}, synchronize_session=False)
+
+        # Committing database changes.
+        self.db.commit()
+        publish_status(field_ids, status_text)
+
+    def get_fields(self, field_ids: list):
+        """
+        Gets fields rows by their ids with one query.
+        :param list field_ids: ids of the fields from user
+        :return list: fields rows
+        """
+
+        logger.info(f"Getting fields {field_ids}.")
+        return self.db.query(models.Fields).filter(
+            models.Fields.id.in_(field_ids)).all()
+
+    def get_field_ids_by_status(self, statuses):
+        """
+        Gets ids of the fields in any of the statuses.
+        :param statuses: status texts
+        :return list: ids of the fields
+        """
+
+        logger.info(f"Getting fields with status {statuses}.")
+        return [row.id for row in self.db.query(models.Fields.id).filter(
+            models.Fields.status.in_(statuses))]
+
+    def get_field_ids_calculating_indices(self):
+        """
+        Gets ids of the fields which indices are being calculated,
+        their status stays FINISHED_CALCULATION meanwhile.
+        :return list: ids of the fields
+        """
+
+        logger.info("Getting fields calculating indices.")
+        return [row.id for row in self.db.query(
+            models.Fields.id, models.Fields.indices).filter(
+            models.Fields.indices.isnot(None))
+            if any(index.get("status") == Status.STARTED_CALCULATION
+                   for index in (row.indices or {}).values())]
+
+    def get_fields_by_footprints(self, field_ids: list, footprints: list):
+        """
+        Finds which of the fields intersect every footprint,
+        e.g. footprints of products. Spatial index of the database
+        is used on PostgreSQL, R-tree is built in process on others.
+        :param list field_ids: ids of the fields from user
+        :param list footprints: footprints in WKT
+        :return list(list): ids of the fields intersecting every footprint
+        """
+
+        logger.info(f"Grouping fields {field_ids} by "
+                    f"{len(footprints)} footprints.")
+        if is_spatial(self.db.get_bind().dialect):
+            return [[row.id for row in self.db.query(models.Fields.id).filter(
+                models.Fields.id.in_(field_ids),
+                func.ST_Intersects(models.Fields.geometry,
+                                   func.ST_GeomFromText(footprint, SRID))
+            ).order_by(models.Fields.id)] for footprint in footprints]
+
+        rows = self.db.query(models.Fields.id, models.Fields.geometry).filter(
+            models.Fields.id.in_(field_ids),
+            models.Fields.geometry.isnot(None)).all()
+        return group_by_footprints(
+            {row.id: shapely.from_wkt(row.geometry) for row in rows},
+            [shapely.from_wkt(footprint) for footprint in footprints])
 
     def get_status(self, field_id: int):
         """
@@ -121,5 +323,109 @@ class CRUD:
 
         logger.info(f"Getting {field_id} status.")
 
-        data = self.db.query(models.Fields).filter_by(id=field_id).first()
+        data = self.db.query(models.Fields.status).filter_by(
+            id=field_id).first()
         return data.status
+
+    def create_time_series(self, field_id: int, products: list):
+        """
+        Replaces NDVI time series of the field with new dates,
+        every date starts with download.
+        :param int field_id: id of the field from user
+        :param list products: (date in ISO format, product uuid) pairs
+        """
+
+        logger.info(f"Creating {field_id} NDVI time series of "
+                    f"{len(products)} dates.")
+        self.db.query(models.FieldNdviTimeSeries).filter(
+            models.FieldNdviTimeSeries.field_id == field_id).delete()
+        self.db.bulk_insert_mappings(models.FieldNdviTimeSeries, [
+            {"field_id": field_id,
+             "date": date.fromisoformat(acquisition_date),
+             "product_id": product_id,
+             "status": Status.STARTED_DOWNLOAD}
+            for acquisition_date, product_id in products
+        ])
+
+        # Committing database changes.
+        self.db.commit()
+
+    def update_time_series_date(self, field_id: int, acquisition_date: str,
+                                **values):
+        """
+        Updates one date of NDVI time series of the field.
+        :param int field_id: id of the field from user
+        :param str acquisition_date: date in ISO format
+        :param values: column -> value
+        """
+
+        logger.info(f"Updating {field_id} NDVI time series "
+                    f"of {acquisition_date}.")
+        self.db.query(models.FieldNdviTimeSeries).where(
+            models.FieldNdviTimeSeries.field_id == field_id,
+            models.FieldNdviTimeSeries.date == date.fromisoformat(
+                acquisition_date)).update(values)
+
+        # Committing database changes.
+        self.db.commit()
+
+    def get_time_series(self, field_id: int):
+        """
+        Gets NDVI time series of the field sorted by date.
+        :param int field_id: id of the field from user
+        :return list: time series rows
+        """
+
+        logger.info(f"Getting {field_id} NDVI time series.")
+        return self.db.query(models.FieldNdviTimeSeries).filter_by(
+            field_id=field_id).order_by(
+            models.FieldNdviTimeSeries.date).all()
+
+    def add_to_stage_totals(self, run: str, stage: str, values: dict):
+        """
+        Adds stage of the run to running totals with one upsert,
+        concurrent workers update the same row safely.
+        :param str run: name of the run
+        :param str stage: name of the stage
+        :param dict values: seconds, bytes read and written
+            and peak memory of the stage
+        """
+
+        table = models.PipelineStageTotal.__table__
+        insert = postgresql_insert \
+            if self.db.get_bind().dialect.name == "postgresql" \
+            else sqlite_insert
+        statement = insert(table).values(run=run, stage=stage, count=1,
+                                         **values)
+        excluded = statement.excluded
+        self.db.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.run, table.c.stage],
+            set_={
+                "count": table.c.count + 1,
+                "seconds": table.c.seconds + excluded.seconds,
+                "read_bytes": table.c.read_bytes + excluded.read_bytes,
+                "written_bytes":
+                    table.c.written_bytes + excluded.written_bytes,
+                "peak_rss_bytes": case(
+                    (excluded.peak_rss_bytes > table.c.peak_rss_bytes,
+                     excluded.peak_rss_bytes),
+                    else_=table.c.peak_rss_bytes),
+            }))
+
+    def save_pipeline_run(self, field_id: int, run):
+        """
+        Saves stages of the pipeline run of the field.
+        :param int field_id: id of the field from user
+        :param PipelineRun run: recorded run
+        """
+
+        logger.info(f"Saving {run.name} stages of {field_id}.")
+        self.db.bulk_insert_mappings(models.PipelineStage, [
+            {"field_id": field_id, "run": run.name, "stage": name, **values}
+            for name, values in run.stages.items()
+        ])
+        for name, values in run.stages.items():
+            self.add_to_stage_totals(run.name, name, values)
+
+        # Committing database changes.
+        self.db.commit()
@@ -1,22 +1,126 @@
+import logging
 import os
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from backend.app.analytics.geometry import prepare_field
 
 SQLALCHEMY_DATABASE_URL = os.environ.get('SQLALCHEMY_DATABASE_URL')
+# Fields which geometry columns are filled in at once on upgrade
+BACKFILL_BATCH_SIZE = 1000
+
+# Drivers used by API to talk to the same database without blocking
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
 
 engine = create_engine(SQLALCHEMY_DATABASE_URL,
                        pool_size=20, max_overflow=0)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Rows stay loaded after commit, so reading them again takes no round trip
+SessionLocal = sessionmaker(autocommit=False, autoflush=False,
+                            expire_on_commit=False, bind=engine)
+
+# Session per thread, used by celery tasks and removed after each task
+ScopedSession = scoped_session(SessionLocal)
+
+
+def to_async_url(url: str):
+    """
+    Converts database url to url of the async driver.
+    :param str url: database url
+    :return: database url with async driver
+    """
+    url = make_url(url)
+    drivername = ASYNC_DRIVERS.get(url.drivername, url.drivername)
+    return url.set(drivername=drivername)
+
+
+async_engine = create_async_engine(
+    os.environ.get('SQLALCHEMY_ASYNC_DATABASE_URL') or to_async_url(
+        SQLALCHEMY_DATABASE_URL),
+    pool_size=20, max_overflow=0)
+
+AsyncSessionLocal = async_sessionmaker(autoflush=False,
+                                       expire_on_commit=False,
+                                       bind=async_engine)
 
 Base = declarative_base()
 
+logger = logging.getLogger()
+
 
 def init_tables():
     """
-    Create tables.
+    Create tables. PostGIS extension is enabled on PostgreSQL,
+    so geometry columns can be created.
     :return:
     """
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as connection:
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS postgis"))
     Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+    backfill_field_geometry()
+
+
+def add_missing_columns():
+    """
+    Adds columns and indexes of models which tables created by
+    previous versions don't have, create_all doesn't alter existing
+    tables. Added columns are empty in existing rows.
+    :return:
+    """
+    inspector = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            columns = {column["name"]
+                       for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                logger.info(f"Adding column {column.name} to {table.name}.")
+                connection.execute(text(
+                    f"ALTER TABLE {quote(table.name)} "
+                    f"ADD COLUMN {quote(column.name)} "
+                    f"{column.type.compile(dialect=engine.dialect)}"))
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+
+def backfill_field_geometry():
+    """
+    Fills in geometry and geometry hash of fields created before
+    these columns were added, so they are found by spatial queries
+    and NDVI reuse. Fields with invalid geometry are left empty.
+    :return:
+    """
+    table = Base.metadata.tables["field_data"]
+    last_id = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                select(table.c.id, table.c.geo_json).where(
+                    table.c.geometry_hash.is_(None),
+                    table.c.id > last_id).order_by(table.c.id).limit(
+                    BACKFILL_BATCH_SIZE)).all()
+            for row in rows:
+                try:
+                    values = prepare_field(row.geo_json)
+                except (ValueError, KeyError, TypeError):
+                    logger.warning(f"Field {row.id} has invalid geometry.")
+                    continue
+                connection.execute(table.update().where(
+                    table.c.id == row.id).values(
+                    geometry=values["geometry"],
+                    geometry_hash=values["geometry_hash"]))
+        if len(rows) < BACKFILL_BATCH_SIZE:
+            return
+        last_id = rows[-1].id
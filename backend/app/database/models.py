@@ -1,12 +1,71 @@
-from sqlalchemy import JSON, Column, Integer, String
+from sqlalchemy import (JSON, BigInteger, Column, Date, DateTime, Float,
+                        ForeignKey, Index, Integer, String, UniqueConstraint,
+                        func)
 
 from .database_config import Base
+from .spatial import Geometry
 
 
 class Fields(Base):
     __tablename__ = "field_data"
+    __table_args__ = (Index("ix_field_data_geometry", "geometry",
+                            postgresql_using="gist"),)
 
     id = Column(Integer, primary_key=True, index=True, unique=True)
     geo_json = Column(JSON)
+    geometry = Column(Geometry, default=None)
+    geometry_hash = Column(String(64), default=None, index=True)
     ndvi = Column(String, default=None)
     status = Column(String)
+    product_id = Column(String, default=None, index=True)
+    ndvi_stats = Column(JSON, default=None)
+    indices = Column(JSON, default=None)
+
+
+class FieldNdviTimeSeries(Base):
+    __tablename__ = "field_ndvi_time_series"
+    __table_args__ = (UniqueConstraint("field_id", "date"),)
+
+    id = Column(Integer, primary_key=True, index=True, unique=True)
+    field_id = Column(Integer,
+                      ForeignKey("field_data.id", ondelete="CASCADE"),
+                      index=True)
+    date = Column(Date)
+    product_id = Column(String)
+    status = Column(String)
+    ndvi = Column(String, default=None)
+    ndvi_stats = Column(JSON, default=None)
+
+
+class PipelineStage(Base):
+    __tablename__ = "pipeline_stages"
+
+    id = Column(Integer, primary_key=True, index=True, unique=True)
+    field_id = Column(Integer,
+                      ForeignKey("field_data.id", ondelete="CASCADE"),
+                      index=True)
+    run = Column(String)
+    stage = Column(String)
+    seconds = Column(Float)
+    read_bytes = Column(BigInteger)
+    written_bytes = Column(BigInteger)
+    peak_rss_bytes = Column(BigInteger)
+    created_at = Column(DateTime, server_default=func.now())
+
+
+class PipelineStageTotal(Base):
+    """
+    Running totals of pipeline stages by run and stage, updated with
+    every saved run, so metrics don't aggregate all recorded stages.
+    """
+    __tablename__ = "pipeline_stage_totals"
+    __table_args__ = (UniqueConstraint("run", "stage"),)
+
+    id = Column(Integer, primary_key=True, index=True, unique=True)
+    run = Column(String)
+    stage = Column(String)
+    count = Column(BigInteger)
+    seconds = Column(Float)
+    read_bytes = Column(BigInteger)
+    written_bytes = Column(BigInteger)
+    peak_rss_bytes = Column(BigInteger)
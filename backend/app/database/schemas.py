@@ -1,3 +1,6 @@
+from datetime import date
+from typing import List
+
 from pydantic import BaseModel
 
 
@@ -7,3 +10,19 @@ class AddNDVI(BaseModel):
 
 class FieldID(BaseModel):
     field_id: int
+
+
+class FieldIDs(BaseModel):
+    field_ids: List[int]
+
+
+class TimeSeriesRequest(BaseModel):
+    field_id: int
+    date_from: date
+    date_to: date
+    build_cube: bool = False
+
+
+class IndicesRequest(BaseModel):
+    field_id: int
+    indices: List[str]
@@ -0,0 +1,78 @@
+from sqlalchemy import Text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import TypeDecorator, UserDefinedType
+
+# Fields and footprints are stored in WGS 84
+SRID = 4326
+
+
+class PostgisGeometry(UserDefinedType):
+    cache_ok = True
+
+    def get_col_spec(self, **kw):
+        return f"geometry(Geometry, {SRID})"
+
+
+class geometry_from_text(FunctionElement):
+    """
+    Converts WKT to PostGIS geometry, WKT is kept as is
+    in other databases.
+    """
+    inherit_cache = True
+
+
+class geometry_as_text(FunctionElement):
+    """
+    Converts PostGIS geometry to WKT, other databases
+    already store WKT.
+    """
+    inherit_cache = True
+
+
+@compiles(geometry_from_text)
+@compiles(geometry_as_text)
+def compile_as_is(element, compiler, **kw):
+    return compiler.process(element.clauses, **kw)
+
+
+@compiles(geometry_from_text, "postgresql")
+def compile_geometry_from_text(element, compiler, **kw):
+    return f"ST_GeomFromText({compiler.process(element.clauses, **kw)}, " \
+           f"{SRID})"
+
+
+@compiles(geometry_as_text, "postgresql")
+def compile_geometry_as_text(element, compiler, **kw):
+    return f"ST_AsText({compiler.process(element.clauses, **kw)})"
+
+
+class Geometry(TypeDecorator):
+    """
+    Geometry column which accepts and returns WKT. It is PostGIS
+    geometry on PostgreSQL, so it can be indexed with GiST,
+    and text on other databases, e.g. SQLite in tests, where
+    spatial queries fall back to in-process R-tree.
+    """
+    impl = Text
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(PostgisGeometry())
+        return dialect.type_descriptor(Text())
+
+    def bind_expression(self, bindvalue):
+        return geometry_from_text(bindvalue)
+
+    def column_expression(self, column):
+        return geometry_as_text(column)
+
+
+def is_spatial(dialect):
+    """
+    Checks if database supports spatial queries.
+    :param dialect: SQLAlchemy dialect
+    :return bool:
+    """
+    return dialect.name == "postgresql"
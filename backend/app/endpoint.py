@@ -4,7 +4,7 @@ import uvicorn
 from fastapi import FastAPI
 
 from backend.app.database.database_config import init_tables
-from backend.app.routers import fields
+from backend.app.routers import fields, metrics
 
 logging.basicConfig(
     level=logging.INFO,
@@ -17,6 +17,7 @@ logging.basicConfig(
 
 app = FastAPI()
 app.include_router(fields.router)
+app.include_router(metrics.router)
 
 
 @app.on_event("startup")
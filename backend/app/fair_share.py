@@ -0,0 +1,82 @@
+import logging
+import os
+
+import redis
+
+# Every tenant gets a token bucket in redis, every started task takes
+# tokens from the bucket of its tenant, so one tenant can't occupy
+# all workers while tasks of other tenants wait
+FAIR_SHARE_URL = os.environ.get("FAIR_SHARE_URL",
+                                os.environ.get("BROKER_URL"))
+# Tasks started by one tenant per second, 0 disables limiting
+TENANT_TASK_RATE = float(os.getenv("TENANT_TASK_RATE", default=0))
+# Tasks one tenant can start at once after being idle
+TENANT_TASK_BURST = int(os.getenv("TENANT_TASK_BURST", default=20))
+# Tenant of requests without X-Tenant-ID header
+DEFAULT_TENANT = "default"
+KEY_PREFIX = "tenant_tokens:"
+
+# Refills bucket by time passed since the last call and takes tokens,
+# returns seconds to wait until there are enough tokens
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - updated) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens),
+           "updated", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+logger = logging.getLogger()
+
+_client = None
+_script = None
+
+
+def get_key(tenant: str):
+    return f"{KEY_PREFIX}{tenant}"
+
+
+def is_enabled():
+    return TENANT_TASK_RATE > 0 and FAIR_SHARE_URL is not None and \
+        FAIR_SHARE_URL.startswith(("redis://", "rediss://"))
+
+
+def acquire(tenant: str, cost: int = 1):
+    """
+    Takes tokens of the tenant for the task. Tasks aren't limited
+    when redis is unavailable, errors are only logged.
+    :param str tenant: id of the tenant
+    :param int cost: tokens the task takes e.g. number of its fields,
+        it is capped by TENANT_TASK_BURST
+    :return float: seconds to wait before the task can start,
+        0 when tokens are taken
+    """
+    global _client, _script
+    if not is_enabled():
+        return 0.0
+
+    try:
+        if _client is None:
+            _client = redis.Redis.from_url(FAIR_SHARE_URL)
+            _script = _client.register_script(TOKEN_BUCKET_SCRIPT)
+        wait = _script(keys=[get_key(tenant or DEFAULT_TENANT)],
+                       args=[TENANT_TASK_RATE, TENANT_TASK_BURST,
+                             min(max(cost, 1), TENANT_TASK_BURST)])
+        return float(wait)
+    except redis.RedisError:
+        logger.exception(f"Failed to take tokens of {tenant}.")
+        return 0.0
@@ -1,10 +1,17 @@
 import os
 import pathlib
+import shutil
 
 ZIPPED_FOLDER = "zipped"
 UNZIPPED_FOLDER = "unzipped"
 NDVI_IMAGE_DATA_FOLDER = "ndvi"
 NDVI_IMAGE_FILE = "NDVI.tif"
+NDVI_TILES_FOLDER = "ndvi_tiles"
+PRODUCTS_FOLDER = "products"
+PRODUCT_LINK = "product"
+TIME_SERIES_FOLDER = "ndvi_time_series"
+NDVI_CUBE_FILE = "NDVI_cube.tif"
+INDICES_FOLDER = "indices"
 
 
 class ArtifactsFileSystemStorage:
@@ -14,12 +21,29 @@ class ArtifactsFileSystemStorage:
     Usually it doesn't save artifacts by itself
     but provides a path where it should be saved to.
 
+    Satellite products are shared between fields, so every field
+    only keeps a link to the product it was computed from.
+
+    Path getters of field artifacts don't create folders, they are
+    called when artifacts are served. Folders are created by code
+    which writes artifacts, only download folders of products
+    are created by their getters.
+
     Used format:
         base_path/
+            PRODUCTS_FOLDER/
+                product_id/
+                    ZIPPED_FOLDER/
+                    UNZIPPED_FOLDER/
             field_id/
-                ZIPPED_FOLDER/
-                UNZIPPED_FOLDER/
+                PRODUCT_LINK -> PRODUCTS_FOLDER/product_id
                 NDVI_IMAGE_DATA_FOLDER/
+                NDVI_TILES_FOLDER/
+                INDICES_FOLDER/
+                    index.tif
+                TIME_SERIES_FOLDER/
+                    date/NDVI_IMAGE_FILE
+                    NDVI_CUBE_FILE
     """
 
     def __init__(self, base_path):
@@ -33,25 +57,105 @@ class ArtifactsFileSystemStorage:
         except FileExistsError:
             return
 
-    def get_path_to_satellite_data_zipped(self, field_id):
-        self.__create_if_not_exist(field_id=field_id, data_type=ZIPPED_FOLDER)
-        return os.path.join(self.base_path, str(field_id), ZIPPED_FOLDER)
+    def get_path_to_products(self):
+        return os.path.join(self.base_path, PRODUCTS_FOLDER)
 
-    def get_path_to_satellite_data_unzipped(self, field_id):
-        self.__create_if_not_exist(field_id=field_id,
-                                   data_type=UNZIPPED_FOLDER)
-        return os.path.join(self.base_path, str(field_id), UNZIPPED_FOLDER)
+    def get_path_to_product(self, product_id):
+        return os.path.join(self.get_path_to_products(), product_id)
 
-    def get_path_to_ndvi_image(self, field_id):
+    def get_path_to_product_zipped(self, product_id):
+        self.__create_if_not_exist(
+            field_id=os.path.join(PRODUCTS_FOLDER, product_id),
+            data_type=ZIPPED_FOLDER)
+        return os.path.join(self.get_path_to_product(product_id),
+                            ZIPPED_FOLDER)
+
+    def get_path_to_product_unzipped(self, product_id):
+        self.__create_if_not_exist(
+            field_id=os.path.join(PRODUCTS_FOLDER, product_id),
+            data_type=UNZIPPED_FOLDER)
+        return os.path.join(self.get_path_to_product(product_id),
+                            UNZIPPED_FOLDER)
+
+    def link_field_to_product(self, field_id, product_id):
+        """
+        Points field at the cached product instead of keeping
+        a private copy of satellite data.
+        :param field_id: id of the field from user
+        :param str product_id: uuid of the cached product
+        :return str: path to the link
+        """
+        self.__create_if_not_exist(field_id)
+        link_path = os.path.join(self.get_path_to_field_base(field_id),
+                                 PRODUCT_LINK)
+        tmp_link_path = link_path + ".tmp"
+        if os.path.lexists(tmp_link_path):
+            os.remove(tmp_link_path)
+
+        # Replace link atomically in case field is relinked
+        os.symlink(os.path.abspath(self.get_path_to_product(product_id)),
+                   tmp_link_path)
+        os.replace(tmp_link_path, link_path)
+        return link_path
+
+    def share_ndvi_image(self, source_field_id, field_id):
+        """
+        Hard links NDVI image of the source field to the field,
+        so image stays when one of the fields is deleted.
+        Image is copied when hard links are not supported.
+        :param source_field_id: id of the field image is taken from
+        :param field_id: id of the field image is shared with
+        :return str: path to NDVI image of the field
+        """
+        source_path = self.get_path_to_ndvi_image(source_field_id)
+        file_path = self.get_path_to_ndvi_image(field_id)
         self.__create_if_not_exist(field_id=field_id,
                                    data_type=NDVI_IMAGE_DATA_FOLDER)
+        tmp_path = file_path + ".tmp"
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+
+        try:
+            os.link(source_path, tmp_path)
+        except OSError:
+            shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, file_path)
+        return file_path
+
+    def get_path_to_satellite_data(self, field_id):
+        return os.path.join(self.base_path, str(field_id), PRODUCT_LINK)
+
+    def get_path_to_ndvi_image(self, field_id):
         return os.path.join(self.base_path,
                             str(field_id),
                             NDVI_IMAGE_DATA_FOLDER,
                             NDVI_IMAGE_FILE)
 
+    def get_path_to_ndvi_tiles(self, field_id):
+        return os.path.join(self.base_path,
+                            str(field_id),
+                            NDVI_TILES_FOLDER)
+
+    def get_path_to_index_image(self, field_id, index: str):
+        return os.path.join(self.base_path,
+                            str(field_id),
+                            INDICES_FOLDER,
+                            index + ".tif")
+
+    def get_path_to_time_series_ndvi_image(self, field_id, date: str):
+        return os.path.join(self.base_path,
+                            str(field_id),
+                            TIME_SERIES_FOLDER,
+                            date,
+                            NDVI_IMAGE_FILE)
+
+    def get_path_to_ndvi_cube(self, field_id):
+        return os.path.join(self.base_path,
+                            str(field_id),
+                            TIME_SERIES_FOLDER,
+                            NDVI_CUBE_FILE)
+
     def get_path_to_field_base(self, field_id):
-        self.__create_if_not_exist(field_id)
         return os.path.join(
             self.base_path,
             str(field_id))
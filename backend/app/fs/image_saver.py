@@ -1,4 +1,19 @@
+import os
+
 import rasterio
+import rasterio.shutil
+from rasterio.io import MemoryFile
+
+# NDVI images are saved as Cloud Optimized GeoTIFF, so clients can read
+# overviews and tiles of the image with range requests
+COG_PROFILE = {
+    "driver": "COG",
+    "compress": os.getenv("NDVI_IMAGE_COMPRESSION", default="DEFLATE"),
+    "predictor": 3,
+    "blocksize": 512,
+    "overview_resampling": "average",
+    "bigtiff": "IF_SAFER",
+}
 
 
 class ImageSaverToFileSystem:
@@ -11,18 +26,26 @@ class ImageSaverToFileSystem:
         pass
 
     def save_ndvi_image(self, meta, ndvi,
-                        file_path: str):
+                        file_path: str, descriptions=None):
         """
-        Writes image into a file and saves it in file system.
-        You provide either file_path or (file_type and file_name)
+        Writes image into a file and saves it in file system
+        as tiled and compressed Cloud Optimized GeoTIFF
+        with internal overviews.
 
         :param file_path:
-        :param meta: meta of the field
-        :param ndvi: calculated NDVI
-        :param str file_type: file type of the image
-        :param str file_name: file name of the image
+        :param meta: meta of the cropped field image
+        :param ndvi: calculated NDVI, one band per image
+        :param descriptions: optional descriptions of the bands
         :return:
         """
-        # TODO should check which args are provided
-        with rasterio.open(file_path, 'w', **meta) as file:
-            file.write(ndvi.astype(rasterio.float32))
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        # COG driver can't write data directly, so image is written
+        # into memory first and then copied with overviews
+        with MemoryFile() as memfile:
+            with memfile.open(**meta) as dataset:
+                dataset.write(ndvi.astype(rasterio.float32, copy=False))
+                if descriptions is not None:
+                    dataset.descriptions = tuple(descriptions)
+            with memfile.open() as dataset:
+                rasterio.shutil.copy(dataset, file_path, **COG_PROFILE)
@@ -0,0 +1,270 @@
+import fcntl
+import json
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+from backend.app.fs.file_system_storage import ArtifactsFileSystemStorage
+
+INDEX_FILE = "index.json"
+LOCKS_FOLDER = ".locks"
+
+logger = logging.getLogger()
+
+
+def get_folder_size(path: str):
+    """
+    Counts size of all files under the folder.
+    :param str path: path to the folder
+    :return int: size in bytes
+    """
+    size = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            size += os.lstat(os.path.join(root, file)).st_size
+    return size
+
+
+class ProductCache:
+    """
+    This class is responsible for sharing downloaded satellite products
+    between fields. Products are keyed by their uuid, so fields lying in
+    the same tile reuse one download.
+
+    Every product keeps a list of fields referencing it and the time it
+    was used last. Field uses one product for its NDVI image, while
+    time series dates reference products as "field_id/date".
+    Products which are not referenced by any field are evicted in
+    least recently used order once the cache exceeds max_size.
+    Storage manager also evicts products referenced by fields
+    which are not being processed to keep storage within quota.
+
+    Products may be fetched with only some of their bands, such
+    products are fetched again with missing bands when they are needed.
+
+    Index format:
+        {
+            product_id: {
+                "size": int,
+                "last_access": float,
+                "bands": [band, ...] | None,
+                "fields": [field_id | "field_id/date", ...]
+            }
+        }
+    """
+
+    def __init__(self, storage: ArtifactsFileSystemStorage,
+                 max_size: int = 0):
+        """
+        :param storage: artifacts storage where products are kept
+        :param int max_size: cache size limit in bytes, 0 means no limit
+        """
+        self.storage = storage
+        self.max_size = max_size
+
+    @contextmanager
+    def __lock(self, name: str, blocking: bool = True):
+        """
+        Takes file lock shared between celery workers and api.
+        Yields False if lock is busy and blocking is disabled.
+        """
+        locks_folder = os.path.join(self.storage.get_path_to_products(),
+                                    LOCKS_FOLDER)
+        os.makedirs(locks_folder, exist_ok=True)
+
+        with open(os.path.join(locks_folder, name + ".lock"), "w") as file:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | \
+                fcntl.LOCK_NB
+            try:
+                fcntl.flock(file, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def __index_path(self):
+        return os.path.join(self.storage.get_path_to_products(), INDEX_FILE)
+
+    def __read_index(self):
+        try:
+            with open(self.__index_path()) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def __write_index(self, index: dict):
+        tmp_path = self.__index_path() + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(index, file)
+        os.replace(tmp_path, self.__index_path())
+
+    def acquire(self, product_id: str, field_id: int, fetch,
+                date: str = None, bands=None):
+        """
+        Returns cached product for the field. Fetches product if it is
+        not in cache yet or cached product lacks some of the bands.
+        :param str product_id: uuid of the product
+        :param int field_id: id of the field referencing product
+        :param fetch: callable that downloads product by its uuid
+            and band names, all bands are downloaded when bands are None
+        :param str date: acquisition date when product is referenced
+            by the time series of the field
+        :param bands: band names the field needs, whole product
+            is needed when not passed
+        :return str: path to the cached product
+        """
+        reference = field_id if date is None else f"{field_id}/{date}"
+        product_path = self.storage.get_path_to_product(product_id)
+
+        with self.__lock(product_id):
+            with self.__lock(INDEX_FILE):
+                cached_entry = self.__read_index().get(product_id)
+
+            missing_bands = self.__get_missing_bands(cached_entry, bands)
+            if missing_bands is not False:
+                logger.info(f"Product {product_id} is not cached, "
+                            f"fetching it with {missing_bands} bands.")
+                try:
+                    fetch(product_id, missing_bands)
+                except Exception:
+                    # Partial download is kept to be resumed next time
+                    if cached_entry is None:
+                        shutil.rmtree(
+                            self.storage.get_path_to_product_unzipped(
+                                product_id), ignore_errors=True)
+                    raise
+            else:
+                logger.info(f"Reusing cached product {product_id}.")
+
+            with self.__lock(INDEX_FILE):
+                index = self.__read_index()
+
+                # Field can reference only one product per date
+                for entry in index.values():
+                    if reference in entry["fields"]:
+                        entry["fields"].remove(reference)
+
+                entry = index.setdefault(product_id, {"fields": []})
+                if missing_bands is not False:
+                    entry["size"] = get_folder_size(product_path)
+                    entry["bands"] = missing_bands
+                entry["fields"].append(reference)
+                entry["last_access"] = time.time()
+                self.__write_index(index)
+
+        self.evict()
+        return product_path
+
+    @staticmethod
+    def __get_missing_bands(entry: dict, bands):
+        """
+        Finds bands product should be fetched with.
+        :param dict entry: cached product or None
+        :param bands: band names the field needs or None for all bands
+        :return: False if product has all bands, None to fetch
+            whole product or list of bands to fetch with bands
+            already cached
+        """
+        if entry is None:
+            return None if bands is None else sorted(bands)
+
+        # Products cached without bands hold all of them
+        cached_bands = entry.get("bands")
+        if cached_bands is None:
+            return False
+        if bands is None:
+            return None
+        if set(bands) <= set(cached_bands):
+            return False
+        return sorted(set(bands) | set(cached_bands))
+
+    def release(self, field_id: int, date: str = None):
+        """
+        Removes references of the field to cached products.
+        :param int field_id: id of the field from user
+        :param str date: acquisition date to release only time series
+            reference of the date, all references are released by default
+        """
+        if date is not None:
+            released = {f"{field_id}/{date}"}
+        else:
+            released = None
+
+        with self.__lock(INDEX_FILE):
+            index = self.__read_index()
+            for entry in index.values():
+                entry["fields"] = [
+                    reference for reference in entry["fields"]
+                    if not self.__is_released(reference, field_id, released)]
+            self.__write_index(index)
+
+    @staticmethod
+    def __is_released(reference, field_id: int, released: set = None):
+        if released is not None:
+            return reference in released
+        return reference == field_id or \
+            str(reference).startswith(f"{field_id}/")
+
+    def evict(self, max_size: int = None, pinned=None,
+              min_age: float = 0):
+        """
+        Deletes least recently used products until cache fits
+        into max_size. By default only products which are not
+        referenced by any field are deleted. When pinned fields
+        are passed, products referenced only by other fields are
+        deleted too, fields fetch them again when they need them.
+        :param int max_size: size limit in bytes, max_size
+            of the cache by default, 0 means no limit
+        :param pinned: ids of the fields which products are kept
+            e.g. fields being calculated, products of time series
+            dates are always kept
+        :param float min_age: products used less than so many
+            seconds ago are kept
+        :return int: size of cached products in bytes
+        """
+        if max_size is None:
+            max_size = self.max_size
+
+        with self.__lock(INDEX_FILE):
+            index = self.__read_index()
+            total_size = sum(entry["size"] for entry in index.values())
+            if not max_size or total_size <= max_size:
+                return total_size
+
+            def is_evictable(entry: dict):
+                if not entry["fields"]:
+                    return True
+                if pinned is None or \
+                        time.time() - entry["last_access"] < min_age:
+                    return False
+                return not any(
+                    isinstance(reference, str) or reference in pinned
+                    for reference in entry["fields"])
+
+            # Products without fields go first
+            candidates = sorted(
+                (product_id for product_id, entry in index.items()
+                 if is_evictable(entry)),
+                key=lambda product_id: (bool(index[product_id]["fields"]),
+                                        index[product_id]["last_access"]))
+
+            for product_id in candidates:
+                if total_size <= max_size:
+                    break
+
+                # Skip products which are being fetched right now
+                with self.__lock(product_id, blocking=False) as locked:
+                    if not locked:
+                        continue
+                    logger.info(f"Evicting product {product_id}.")
+                    shutil.rmtree(self.storage.get_path_to_product(
+                        product_id), ignore_errors=True)
+                    total_size -= index.pop(product_id)["size"]
+
+            self.__write_index(index)
+        return total_size
@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+import time
+
+from backend.app.fs.file_system_storage import ArtifactsFileSystemStorage
+from backend.app.fs.product_cache import ProductCache
+
+USAGE_FILE = "usage.json"
+
+logger = logging.getLogger()
+
+
+def get_folder_usage(path: str, seen: set = None):
+    """
+    Counts size of all files under the folder and finds when they
+    were used last. Links to products are not followed.
+    :param str path: path to the folder
+    :param set seen: (device, inode) of hard linked files already
+        counted, e.g. NDVI images shared by fields, they are
+        counted once and seen is updated
+    :return tuple(int, float): size in bytes and the latest access
+        or modification time of the files
+    """
+    size = 0
+    last_access = 0.0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                stat = os.lstat(os.path.join(root, file))
+            except FileNotFoundError:
+                continue
+            last_access = max(last_access, stat.st_atime, stat.st_mtime)
+            if seen is not None and stat.st_nlink > 1:
+                inode = (stat.st_dev, stat.st_ino)
+                if inode in seen:
+                    continue
+                seen.add(inode)
+            size += stat.st_size
+    return size, last_access
+
+
+def read_usage(storage: ArtifactsFileSystemStorage):
+    """
+    Reads usage of the storage saved by the last quota check.
+    :return dict: usage or None if storage wasn't checked yet
+    """
+    try:
+        with open(os.path.join(storage.base_path, USAGE_FILE)) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+class StorageManager:
+    """
+    This class keeps artifacts storage within quota. Outputs of fields
+    (NDVI images, indices, time series and tiles) are kept, while
+    raw satellite products are evicted in least recently used order
+    until storage fits into quota. Fields fetch evicted products
+    again when they need them.
+
+    Usage of every field is saved to USAGE_FILE on every check.
+
+    Usage format:
+        {
+            "updated": float,
+            "quota": int,
+            "products_size": int,
+            "fields_size": int,
+            "fields": {field_id: {"size": int, "last_access": float}}
+        }
+    """
+
+    def __init__(self, storage: ArtifactsFileSystemStorage,
+                 product_cache: ProductCache, quota: int = 0,
+                 min_product_age: float = 0):
+        """
+        :param storage: artifacts storage
+        :param product_cache: cache of products shared by fields
+        :param int quota: size limit of the storage in bytes,
+            0 means no limit
+        :param float min_product_age: products used less than
+            so many seconds ago are kept
+        """
+        self.storage = storage
+        self.product_cache = product_cache
+        self.quota = quota
+        self.min_product_age = min_product_age
+
+    def get_fields_usage(self):
+        """
+        Counts size and last access of artifacts of every field.
+        Files shared by fields are counted in the first of them.
+        :return dict: field id -> {"size": int, "last_access": float}
+        """
+        usage = {}
+        seen = set()
+        try:
+            entries = os.scandir(self.storage.base_path)
+        except FileNotFoundError:
+            return usage
+
+        with entries:
+            for entry in entries:
+                if not entry.name.isdigit() or not entry.is_dir():
+                    continue
+                size, last_access = get_folder_usage(entry.path, seen)
+                usage[entry.name] = {"size": size,
+                                     "last_access": last_access}
+        return usage
+
+    def enforce_quota(self, pinned=()):
+        """
+        Evicts products until storage fits into quota and saves usage.
+        Quota can't be kept when outputs of fields alone exceed it.
+        :param pinned: ids of the fields which products are kept
+            e.g. fields being downloaded or calculated
+        :return dict: usage of the storage
+        """
+        fields = self.get_fields_usage()
+        fields_size = sum(field["size"] for field in fields.values())
+
+        # Outputs of fields are kept, so products get the rest of quota
+        if self.quota:
+            products_size = self.product_cache.evict(
+                max_size=max(self.quota - fields_size, 1),
+                pinned=set(pinned), min_age=self.min_product_age)
+        else:
+            products_size = self.product_cache.evict(max_size=0)
+
+        usage = {"updated": time.time(),
+                 "quota": self.quota,
+                 "products_size": products_size,
+                 "fields_size": fields_size,
+                 "fields": fields}
+        if self.quota and products_size + fields_size > self.quota:
+            logger.warning(f"Storage uses {products_size + fields_size} "
+                           f"bytes over quota of {self.quota} bytes.")
+
+        os.makedirs(self.storage.base_path, exist_ok=True)
+        usage_path = os.path.join(self.storage.base_path, USAGE_FILE)
+        tmp_path = usage_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(usage, file)
+        os.replace(tmp_path, usage_path)
+
+        logger.info(f"Storage uses {products_size} bytes by products and "
+                    f"{fields_size} bytes by {len(fields)} fields.")
+        return usage
@@ -0,0 +1,107 @@
+import glob
+import hashlib
+import logging
+import os
+import time
+
+from backend.app.fs.file_system_storage import (NDVI_TILES_FOLDER,
+                                                ArtifactsFileSystemStorage)
+
+# Cache folders are scanned for eviction not more often than this
+EVICTION_INTERVAL = 60
+
+logger = logging.getLogger()
+
+
+class TileCache:
+    """
+    This class is responsible for caching rendered NDVI tiles on disk.
+    Tiles are kept next to the field artifacts, so they are deleted
+    together with the field. Last access time of the tile is its
+    modification time, least recently used tiles are evicted once
+    the cache exceeds max_size.
+    """
+
+    def __init__(self, storage: ArtifactsFileSystemStorage,
+                 max_size: int = 0):
+        """
+        :param storage: artifacts storage where tiles are kept
+        :param int max_size: cache size limit in bytes, 0 means no limit
+        """
+        self.storage = storage
+        self.max_size = max_size
+        self.last_eviction = 0
+
+    @staticmethod
+    def get_etag(ndvi_path: str, z: int, x: int, y: int):
+        """
+        Returns ETag of the tile. It changes when NDVI is recalculated.
+        :param str ndvi_path: path to NDVI image
+        :return str: ETag
+        """
+        stat = os.stat(ndvi_path)
+        version = f"{stat.st_mtime_ns}-{stat.st_size}-{z}/{x}/{y}"
+        return '"' + hashlib.sha1(version.encode()).hexdigest() + '"'
+
+    def get_tile(self, field_id: int, ndvi_path: str,
+                 z: int, x: int, y: int, render):
+        """
+        Returns path to cached tile and renders it on cache miss.
+        :param int field_id: id of the field from user
+        :param str ndvi_path: path to NDVI image tile is rendered from
+        :param render: callable returning PNG bytes or None
+        :return str|None: path to the tile or None if tile is empty
+        """
+        tile_path = os.path.join(
+            self.storage.get_path_to_ndvi_tiles(field_id),
+            f"{z}_{x}_{y}.png")
+
+        try:
+            # Tile is stale if NDVI was recalculated after it
+            if os.stat(tile_path).st_mtime >= os.stat(ndvi_path).st_mtime:
+                os.utime(tile_path)
+                return tile_path
+        except FileNotFoundError:
+            pass
+
+        png = render()
+        if png is None:
+            return None
+
+        os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+        tmp_path = f"{tile_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(png)
+        os.replace(tmp_path, tile_path)
+        return tile_path
+
+    def evict(self):
+        """
+        Deletes least recently used tiles of all fields
+        until cache fits into max_size.
+        """
+        if not self.max_size or \
+                time.time() - self.last_eviction < EVICTION_INTERVAL:
+            return
+        self.last_eviction = time.time()
+
+        tiles = []
+        for path in glob.glob(os.path.join(
+                self.storage.base_path, "*", NDVI_TILES_FOLDER, "*.png")):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            tiles.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in tiles)
+        for _, size, path in sorted(tiles):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+        logger.info(f"Tile cache size is {total_size} bytes.")
@@ -0,0 +1,144 @@
+import functools
+import logging
+import resource
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger()
+
+PROC_IO_FILE = "/proc/self/io"
+PROC_STATUS_FILE = "/proc/self/status"
+# Writing 5 resets peak RSS of the process on Linux
+PROC_CLEAR_REFS_FILE = "/proc/self/clear_refs"
+
+current_run = ContextVar("current_run", default=None)
+
+
+def read_io_counters():
+    """
+    Reads bytes read and written by the process, including network.
+    :return tuple(int, int): read and written bytes, zeros when
+        counters are not available
+    """
+    try:
+        with open(PROC_IO_FILE) as file:
+            counters = dict(line.split(": ") for line in file)
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def read_peak_rss():
+    """
+    Reads peak resident memory of the process since the last reset.
+    :return int: bytes
+    """
+    try:
+        with open(PROC_STATUS_FILE) as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and can't be reset
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_rss():
+    try:
+        with open(PROC_CLEAR_REFS_FILE, "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+
+class PipelineRun:
+    """
+    This class records timings, bytes read and written and peak
+    resident memory of stages of one pipeline run, e.g. download
+    of the field. Stages with the same name are summed up.
+    Nested stages are recorded separately and also count
+    into their outer stage.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stages = {}
+        self.__peaks = []
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Records stage of the run.
+        :param str name: name of the stage
+        """
+        read_before, written_before = read_io_counters()
+        start = time.perf_counter()
+        reset_peak_rss()
+        self.__peaks.append(0)
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            read_after, written_after = read_io_counters()
+            # Nested stages reset peak, so their peaks are kept
+            peak_rss = max(read_peak_rss(), self.__peaks.pop())
+            if self.__peaks:
+                self.__peaks[-1] = max(self.__peaks[-1], peak_rss)
+
+            stage = self.stages.setdefault(name, {
+                "seconds": 0.0, "read_bytes": 0, "written_bytes": 0,
+                "peak_rss_bytes": 0})
+            stage["seconds"] += seconds
+            stage["read_bytes"] += read_after - read_before
+            stage["written_bytes"] += written_after - written_before
+            stage["peak_rss_bytes"] = max(stage["peak_rss_bytes"], peak_rss)
+
+
+@contextmanager
+def pipeline_run(name: str):
+    """
+    Starts recording of the pipeline run, stages entered
+    in the same thread or task are recorded into it.
+    :param str name: name of the run e.g. count_ndvi
+    :return PipelineRun:
+    """
+    run = PipelineRun(name)
+    token = current_run.set(run)
+    try:
+        with run.stage("total"):
+            yield run
+    finally:
+        current_run.reset(token)
+        logger.info(f"Stages of {name}: {run.stages}")
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Records stage into the current pipeline run,
+    does nothing when there is no run.
+    :param str name: name of the stage
+    """
+    run = current_run.get()
+    if run is None:
+        yield
+        return
+
+    with run.stage(name):
+        yield
+
+
+def instrumented(name: str):
+    """
+    Decorator which records every call of the function as stage.
+    :param str name: name of the stage
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
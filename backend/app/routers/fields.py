@@ -1,16 +1,31 @@
+import json
 import logging
 import os
 import shutil
 
-from fastapi import APIRouter, Depends
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import APIRouter, BackgroundTasks, Depends, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import (FileResponse, JSONResponse, Response,
+                               StreamingResponse)
 from geojson_pydantic import FeatureCollection
 
-from backend.app.celery_tasks import count_ndvi, get_satellite_data
-from backend.app.database import crud, schemas
+from backend.app.analytics.geometry import prepare_field
+from backend.app.analytics.indices import INDICES
+from backend.app.analytics.ndvi_tiles import render_tile
+from backend.app.celery_tasks import (count_indices, count_ndvi,
+                                      count_ndvi_batch, count_ndvi_time_series,
+                                      get_satellite_data,
+                                      get_satellite_data_by_tile, run_pipeline)
+from backend.app.database import async_crud, crud, schemas
 from backend.app.fs.file_system_storage import ArtifactsFileSystemStorage
+from backend.app.fs.product_cache import ProductCache
+from backend.app.fs.tile_cache import TileCache
+from backend.app.status_events import iterate_status
 
-from .routers_config import connecting_to_db
+from .file_streaming import file_response
+from .record_stream import (DuplexStreamingResponse, RecordTooLarge,
+                            iterate_records)
+from .routers_config import connecting_to_db, get_tenant
 
 router = APIRouter(
     prefix="/field",
@@ -22,13 +37,46 @@ Status = crud.Status
 storage = ArtifactsFileSystemStorage(
     base_path=os.getenv("FS_STORAGE_BASE_PATH",
                         default="STORAGE"))
+product_cache = ProductCache(
+    storage=storage,
+    max_size=int(os.getenv("PRODUCT_CACHE_MAX_SIZE", default=0)))
+tile_cache = TileCache(
+    storage=storage,
+    max_size=int(os.getenv("TILE_CACHE_MAX_SIZE", default=0)))
+
+# Statuses after which product of the field is downloaded
+DOWNLOADED_STATUSES = {Status.FINISHED_DOWNLOAD, Status.STARTED_CALCULATION,
+                       Status.FINISHED_CALCULATION, Status.ERROR_CALCULATION}
+# Statuses after which field doesn't change without user actions
+FINAL_STATUSES = {None, Status.ERROR_DOWNLOAD, Status.FINISHED_CALCULATION,
+                  Status.ERROR_CALCULATION}
+STATUS_STREAM_TIMEOUT = int(os.getenv("STATUS_STREAM_TIMEOUT", default=3600))
+# Fields inserted at once by bulk ingestion and max size of one field
+BULK_INSERT_BATCH_SIZE = int(os.getenv("BULK_INSERT_BATCH_SIZE",
+                                       default=1000))
+BULK_MAX_RECORD_SIZE = int(os.getenv("BULK_MAX_RECORD_SIZE",
+                                     default=10 * 1024 * 1024))
 
 logger = logging.getLogger()
 
 
+def delete_field_files(field_id: int):
+    """
+    Deletes folders and files of the field from disk,
+    shared product stays in cache.
+    :param int field_id: id of the field from user
+    """
+    # Fields without artifacts have no folder
+    field_path = storage.get_path_to_field_base(field_id)
+    if os.path.lexists(field_path):
+        shutil.rmtree(field_path)
+    product_cache.release(field_id)
+    product_cache.evict()
+
+
 @router.post("/")
-def add_field(field: FeatureCollection,
-              conn: crud.CRUD = Depends(connecting_to_db)):
+async def add_field(field: FeatureCollection,
+                    conn: async_crud.AsyncCRUD = Depends(connecting_to_db)):
     """
     Accepts field information in GeoJSON format and adds
     field information to database. Return field_id
@@ -39,7 +87,13 @@ def add_field(field: FeatureCollection,
 
     # Adding field row to db.
     logger.info(f"Accepted {field} to add to db.")
-    field_id = conn.create_field(field)
+    try:
+        field_id = await conn.create_field(field)
+    except ValueError as ex:
+        return JSONResponse({
+            "status": "INVALID_FIELD",
+            "message": str(ex)
+        }, status_code=422)
 
     logger.info(f"Added {field} to db.")
 
@@ -48,9 +102,81 @@ def add_field(field: FeatureCollection,
     })
 
 
+def parse_field(record: bytes):
+    """
+    Parses and validates one field of bulk ingestion. Geometry
+    of the field is prepared here, so invalid geometry fails
+    only its record and not the whole batch.
+    :param bytes record: GeoJSON FeatureCollection or Feature
+    :return dict: row of the field with geo_json, geometry
+        and geometry_hash
+    :raise ValueError: if record is not valid field
+    """
+    field = json.loads(record)
+    if isinstance(field, dict) and field.get("type") == "Feature":
+        field = {"type": "FeatureCollection", "features": [field]}
+    if not isinstance(field, dict):
+        raise ValueError("Field must be GeoJSON object.")
+
+    return prepare_field(FeatureCollection.model_validate(field).dict())
+
+
+@router.post("/bulk")
+async def add_fields(request: Request):
+    """
+    Accepts stream of fields, one GeoJSON FeatureCollection or Feature
+    per line (NDJSON) or per record of GeoJSON text sequence, and adds
+    them to database. Fields are validated as they arrive and inserted
+    in batches of BULK_INSERT_BATCH_SIZE, so memory stays bounded.
+    Result of every record is streamed back as NDJSON in order
+    of records as soon as its batch is inserted.
+    :param request:
+    :return: stream of {"record", "field_id"} or {"record", "error"}
+    """
+
+    async def results():
+        # Session lives as long as stream does
+        conn = async_crud.AsyncCRUD()
+
+        async def insert(batch):
+            field_ids = iter(await conn.create_fields(
+                [field for _, field, _ in batch if field is not None]))
+            lines = []
+            for record, field, error in batch:
+                result = {"record": record, "error": error} \
+                    if field is None else \
+                    {"record": record, "field_id": next(field_ids)}
+                lines.append(json.dumps(result) + "\n")
+            return "".join(lines)
+
+        try:
+            batch = []
+            async for record, data in iterate_records(request.stream(),
+                                                      BULK_MAX_RECORD_SIZE):
+                try:
+                    if isinstance(data, RecordTooLarge):
+                        raise data
+                    batch.append((record, parse_field(data), None))
+                except ValueError as ex:
+                    batch.append((record, None, str(ex)))
+
+                if len(batch) >= BULK_INSERT_BATCH_SIZE:
+                    yield await insert(batch)
+                    batch = []
+
+            if batch:
+                yield await insert(batch)
+        finally:
+            await conn.close()
+
+    return DuplexStreamingResponse(results(),
+                                   media_type="application/x-ndjson")
+
+
 @router.delete("/")
-def delete_field(field_id: int,
-                 conn: crud.CRUD = Depends(connecting_to_db)):
+async def delete_field(field_id: int,
+                       background_tasks: BackgroundTasks,
+                       conn: async_crud.AsyncCRUD = Depends(connecting_to_db)):
     """
     Deletes field row from database.
     :param int field_id: id of the field from user
@@ -59,17 +185,19 @@ def delete_field(field_id: int,
     """
 
     logger.info(f"Accepted {field_id} to delete from db.")
-    conn.delete_field_data_from_db(field_id)
+    await conn.delete_field_data_from_db(field_id)
 
-    # deleted folders and files from disk
-    shutil.rmtree(storage.get_path_to_field_base(field_id))
+    # delete folders and files from disk after response is sent
+    background_tasks.add_task(delete_field_files, field_id)
 
     logger.info(f"Deleted {field_id} from db.")
 
 
 @router.post("/image")
-def download_satellite_image(field_id: schemas.FieldID,
-                             conn: crud.CRUD = Depends(connecting_to_db)):
+async def download_satellite_image(field_id: schemas.FieldID,
+                                   conn: async_crud.AsyncCRUD = Depends(
+                                       connecting_to_db),
+                                   tenant: str = Depends(get_tenant)):
     """
     Accepts field id and gets satellite data.
     :param int field_id: id of the field from user
@@ -78,19 +206,18 @@ def download_satellite_image(field_id: schemas.FieldID,
     """
 
     logger.info(f"Accepted {field_id.field_id} to get satellite image.")
-    status = conn.get_status(field_id.field_id)
-    if status != Status.FIELD_CREATED:
+    field = await conn.get_field(field_id.field_id)
+    # Unknown field is out of order like the field already downloaded
+    if field is None or field.status != Status.FIELD_CREATED:
         return JSONResponse({
             "status": "OUT_OF_ORDER",
             "message": "Please ensure that you preserve correct order"
                        " of API calls."
         })
 
-    # Get geojson by prod_id
-    geo_json = conn.get_geojson_by_field_id(field_id.field_id)
-
     # Get satellite data
-    get_satellite_data.delay(geo_json, field_id.field_id)
+    await run_in_threadpool(get_satellite_data.delay, field.geo_json,
+                            field_id.field_id, tenant)
 
     logger.info(f"Got {field_id.field_id} satellite image.")
     return JSONResponse({
@@ -99,9 +226,108 @@ def download_satellite_image(field_id: schemas.FieldID,
     })
 
 
+@router.post("/image/batch")
+async def download_satellite_images(field_ids: schemas.FieldIDs,
+                                    conn: async_crud.AsyncCRUD = Depends(
+                                        connecting_to_db),
+                                    tenant: str = Depends(get_tenant)):
+    """
+    Gets satellite data of many fields in one task. Fields are grouped
+    by Sentinel-2 tile, so product of every tile is downloaded once.
+    Fields which download is already started are skipped.
+    :param conn:
+    :param list field_ids: ids of the fields from user
+    :return:
+    """
+
+    fields = await conn.get_fields(field_ids.field_ids)
+    ready = [field.id for field in fields
+             if field.status == Status.FIELD_CREATED]
+    skipped = [field_id for field_id in field_ids.field_ids
+               if field_id not in ready]
+
+    if ready:
+        await run_in_threadpool(get_satellite_data_by_tile.delay, ready,
+                                tenant)
+
+    logger.info(f"Started satellite data download of {ready}, "
+                f"skipped {skipped}.")
+    return JSONResponse({
+        "status": Status.STARTED_DOWNLOAD,
+        "message": "Started satellite data download.",
+        "field_ids": ready,
+        "skipped_field_ids": skipped
+    })
+
+
+@router.post("/pipeline")
+async def run_field_pipeline(field_id: schemas.FieldID,
+                             conn: async_crud.AsyncCRUD = Depends(
+                                 connecting_to_db),
+                             tenant: str = Depends(get_tenant)):
+    """
+    Accepts field id, gets satellite data and calculates NDVI
+    right after data is downloaded. Progress can be followed
+    via status stream.
+    :param int field_id: id of the field from user
+    :param conn:
+    :return:
+    """
+
+    logger.info(f"Accepted {field_id.field_id} to run pipeline.")
+    field = await conn.get_field(field_id.field_id)
+    # Unknown field is out of order like the field already downloaded
+    if field is None or field.status != Status.FIELD_CREATED:
+        return JSONResponse({
+            "status": "OUT_OF_ORDER",
+            "message": "Please ensure that you preserve correct order"
+                       " of API calls."
+        })
+
+    await run_in_threadpool(run_pipeline, field.geo_json, field_id.field_id,
+                            tenant)
+
+    return JSONResponse({
+        "status": Status.STARTED_DOWNLOAD,
+        "message": "Started satellite data download and ndvi calculation."
+    })
+
+
+@router.get("/{field_id}/status/stream")
+async def stream_status(field_id: int):
+    """
+    Streams status changes of the field as server-sent events
+    until status is final.
+    :param int field_id: id of the field from user
+    :return:
+    """
+
+    async def events():
+        # Session lives as long as stream does
+        conn = async_crud.AsyncCRUD()
+        try:
+            async for status in iterate_status(
+                    field_id, lambda: conn.get_status(field_id),
+                    FINAL_STATUSES, STATUS_STREAM_TIMEOUT):
+                if status is None:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield "data: " + json.dumps({
+                    "field_id": field_id,
+                    "status": status
+                }) + "\n\n"
+        finally:
+            await conn.close()
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
 @router.post("/ndvi")
-def calculate_ndvi(field_id: schemas.FieldID,
-                   conn: crud.CRUD = Depends(connecting_to_db)):
+async def calculate_ndvi(field_id: schemas.FieldID,
+                         conn: async_crud.AsyncCRUD = Depends(
+                             connecting_to_db),
+                         tenant: str = Depends(get_tenant)):
     """
     Calculates NDVI and saves path to NDVI image to database.
     :param conn:
@@ -110,11 +336,12 @@ def calculate_ndvi(field_id: schemas.FieldID,
     """
 
     # Check if satellite data is ready
-    status = conn.get_status(field_id.field_id)
+    status = await conn.get_status(field_id.field_id)
 
     if status == Status.FINISHED_DOWNLOAD:
         # Calculate NDVI and create NDVI image.
-        count_ndvi.delay(field_id.field_id)
+        await run_in_threadpool(count_ndvi.delay, field_id.field_id,
+                                tenant)
         message = "Started ndvi calculation."
     elif status == Status.ERROR_DOWNLOAD:
         message = "Error happened during image download."
@@ -133,12 +360,213 @@ def calculate_ndvi(field_id: schemas.FieldID,
     })
 
 
+@router.post("/ndvi/batch")
+async def calculate_ndvi_batch(field_ids: schemas.FieldIDs,
+                               conn: async_crud.AsyncCRUD = Depends(
+                                   connecting_to_db),
+                               tenant: str = Depends(get_tenant)):
+    """
+    Calculates NDVI for many fields in one task. Fields which
+    satellite data is not downloaded yet are skipped.
+    :param conn:
+    :param list field_ids: ids of the fields from user
+    :return:
+    """
+
+    fields = await conn.get_fields(field_ids.field_ids)
+    ready = [field.id for field in fields
+             if field.status == Status.FINISHED_DOWNLOAD]
+    skipped = [field_id for field_id in field_ids.field_ids
+               if field_id not in ready]
+
+    if ready:
+        await run_in_threadpool(count_ndvi_batch.delay, ready, tenant)
+
+    logger.info(f"Started ndvi calculation of {ready}, skipped {skipped}.")
+    return JSONResponse({
+        "status": Status.STARTED_CALCULATION,
+        "message": "Started ndvi calculation.",
+        "field_ids": ready,
+        "skipped_field_ids": skipped
+    })
+
+
+@router.post("/indices")
+async def calculate_indices(request: schemas.IndicesRequest,
+                            conn: async_crud.AsyncCRUD = Depends(
+                                connecting_to_db),
+                            tenant: str = Depends(get_tenant)):
+    """
+    Calculates several spectral indices of the field in one pass,
+    every band is read once for all indices.
+    :param request: field id and names of the indices
+    :param conn:
+    :return:
+    """
+
+    unknown = [name for name in request.indices if name not in INDICES]
+    if unknown or not request.indices:
+        return JSONResponse({
+            "status": "UNKNOWN_INDEX",
+            "message": f"Supported indices are {sorted(INDICES)}.",
+            "indices": unknown
+        })
+
+    field = await conn.get_field(request.field_id)
+    if field is None or field.status not in DOWNLOADED_STATUSES:
+        return JSONResponse({
+            "status": "OUT_OF_ORDER",
+            "message": "Please ensure that you preserve correct order"
+                       " of API calls."
+        })
+
+    await run_in_threadpool(count_indices.delay, request.field_id,
+                            request.indices, tenant)
+
+    return JSONResponse({
+        "status": Status.STARTED_CALCULATION,
+        "message": "Started indices calculation."
+    })
+
+
+@router.get("/{field_id}/indices")
+async def get_indices(field_id: int,
+                      conn: async_crud.AsyncCRUD = Depends(connecting_to_db)):
+    """
+    Returns status and statistics of every calculated index of the field.
+    :param int field_id: id of the field from user
+    :param conn:
+    :return:
+    """
+
+    field = await conn.get_field(field_id)
+    return JSONResponse({
+        "field_id": field_id,
+        "indices": (field.indices or {}) if field is not None else {}
+    })
+
+
+@router.get("/{field_id}/indices/{index}/image")
+async def get_index_image(field_id: int, index: str,
+                          request: Request,
+                          conn: async_crud.AsyncCRUD = Depends(
+                              connecting_to_db)):
+    """
+    Returns image of the index if it is calculated.
+    Image is streamed and supports Range requests.
+    :param int field_id: id of the field from user
+    :param str index: name of the index
+    :param request:
+    :param conn:
+    :return status|FileResponse:
+    """
+
+    field = await conn.get_field(field_id)
+    status = ((field.indices or {}).get(index, {}).get("status")
+              if field is not None else None)
+    if status != Status.FINISHED_CALCULATION:
+        return JSONResponse({
+            "status": status,
+            "message": f"{index} image is not ready."
+        }, status_code=404)
+
+    return file_response(
+        path=storage.get_path_to_index_image(field_id, index),
+        request=request, media_type="image/tiff")
+
+
+@router.post("/ndvi/timeseries")
+async def calculate_ndvi_time_series(request: schemas.TimeSeriesRequest,
+                                     conn: async_crud.AsyncCRUD = Depends(
+                                         connecting_to_db),
+                                     tenant: str = Depends(get_tenant)):
+    """
+    Calculates NDVI of the field for every acquisition date
+    in the date range. Previous time series of the field is replaced.
+    :param request: field id, date range and whether NDVI images
+        of all dates should be stacked into one image
+    :param conn:
+    :return:
+    """
+
+    logger.info(f"Accepted {request.field_id} to calculate NDVI time series "
+                f"from {request.date_from} to {request.date_to}.")
+    field = await conn.get_field(request.field_id)
+    if field is None or request.date_from > request.date_to:
+        return JSONResponse({
+            "status": "OUT_OF_ORDER",
+            "message": "Please ensure that field exists and date range "
+                       "is correct."
+        })
+
+    await run_in_threadpool(count_ndvi_time_series.delay, request.field_id,
+                            request.date_from.isoformat(),
+                            request.date_to.isoformat(), request.build_cube,
+                            tenant)
+
+    return JSONResponse({
+        "status": Status.STARTED_DOWNLOAD,
+        "message": "Started ndvi time series calculation."
+    })
+
+
+@router.get("/{field_id}/ndvi/timeseries")
+async def get_ndvi_time_series(field_id: int,
+                               conn: async_crud.AsyncCRUD = Depends(
+                                   connecting_to_db)):
+    """
+    Returns status and NDVI statistics of every date
+    of the field time series.
+    :param int field_id: id of the field from user
+    :param conn:
+    :return:
+    """
+
+    logger.info(f"Getting NDVI time series of field under {field_id}.")
+    time_series = await conn.get_time_series(field_id)
+
+    return JSONResponse({
+        "field_id": field_id,
+        "dates": [{
+            "date": entry.date.isoformat(),
+            "product_id": entry.product_id,
+            "status": entry.status,
+            "stats": entry.ndvi_stats
+        } for entry in time_series]
+    })
+
+
+@router.get("/{field_id}/ndvi/timeseries/cube")
+async def get_ndvi_cube(field_id: int, request: Request):
+    """
+    Returns NDVI cube of the field, band per date of the time series.
+    Image is streamed and supports Range requests.
+    :param int field_id: id of the field from user
+    :param request:
+    :return status|FileResponse:
+    """
+
+    file_path = storage.get_path_to_ndvi_cube(field_id=field_id)
+    if not os.path.exists(file_path):
+        return JSONResponse({
+            "status": "OUT_OF_ORDER",
+            "message": "NDVI cube is not ready."
+        }, status_code=404)
+
+    return file_response(path=file_path, request=request,
+                         media_type="image/tiff")
+
+
 @router.get("/ndvi/image")
-def get_ndvi_image(field_id: int,
-                   conn: crud.CRUD = Depends(connecting_to_db)):
+async def get_ndvi_image(field_id: int,
+                         request: Request,
+                         conn: async_crud.AsyncCRUD = Depends(
+                             connecting_to_db)):
     """
     Checks if NDVI image is ready and returns image or returns status.
+    Image is streamed and supports Range requests.
     :param int field_id: id of the field from user
+    :param request:
     :param conn:
     :return status|FileResponse:
     """
@@ -146,12 +574,13 @@ def get_ndvi_image(field_id: int,
     logger.info(f"Checking status of field under {field_id}.")
 
     # Get status of the NDVI image calculating
-    status = conn.get_status(field_id)
+    status = await conn.get_status(field_id)
 
     # Check status if image is ready
     if status == Status.FINISHED_CALCULATION:
         file_path = storage.get_path_to_ndvi_image(field_id=field_id)
-        return FileResponse(path=file_path)
+        return file_response(path=file_path, request=request,
+                             media_type="image/tiff")
     else:
         if status == Status.ERROR_CALCULATION:
             message = "Error happened during ndvi calculation."
@@ -166,3 +595,121 @@ def get_ndvi_image(field_id: int,
             "status": status,
             "message": message
         })
+
+
+@router.get("/{field_id}/ndvi/stats")
+async def get_ndvi_stats(field_id: int,
+                         conn: async_crud.AsyncCRUD = Depends(
+                             connecting_to_db)):
+    """
+    Returns NDVI statistics of the field calculated with NDVI image:
+    mean, std, min, max, median, percentiles and histogram.
+    :param int field_id: id of the field from user
+    :param conn:
+    :return:
+    """
+
+    logger.info(f"Getting NDVI statistics of field under {field_id}.")
+    data = await conn.get_ndvi_stats(field_id)
+    status = data.status if data is not None else None
+
+    if status == Status.FINISHED_CALCULATION:
+        return JSONResponse({
+            "field_id": field_id,
+            "stats": data.ndvi_stats
+        })
+    elif status == Status.ERROR_CALCULATION:
+        message = "Error happened during ndvi calculation."
+    elif status == Status.STARTED_CALCULATION:
+        message = "NDVI calculation is in progress."
+    else:
+        status = "OUT_OF_ORDER"
+        message = "Please ensure that you preserve correct " \
+                  "order of API calls."
+
+    return JSONResponse({
+        "status": status,
+        "message": message
+    })
+
+
+@router.get("/{field_id}/metrics")
+async def get_field_metrics(field_id: int,
+                            conn: async_crud.AsyncCRUD = Depends(
+                                connecting_to_db)):
+    """
+    Returns timings, bytes read and written and peak memory
+    of every stage of recorded pipeline runs of the field,
+    latest run first.
+    :param int field_id: id of the field from user
+    :param conn:
+    :return:
+    """
+
+    stages = await conn.get_pipeline_stages(field_id)
+    return JSONResponse({
+        "field_id": field_id,
+        "stages": [{
+            "run": row.run,
+            "stage": row.stage,
+            "seconds": row.seconds,
+            "read_bytes": row.read_bytes,
+            "written_bytes": row.written_bytes,
+            "peak_rss_bytes": row.peak_rss_bytes,
+            "created_at": row.created_at.isoformat()
+            if row.created_at is not None else None
+        } for row in stages]
+    })
+
+
+@router.get("/{field_id}/ndvi/tiles/{z}/{x}/{y}.png")
+async def get_ndvi_tile(field_id: int, z: int, x: int, y: int,
+                        request: Request,
+                        background_tasks: BackgroundTasks,
+                        conn: async_crud.AsyncCRUD = Depends(
+                            connecting_to_db)):
+    """
+    Returns XYZ tile of NDVI image rendered with colormap.
+    Tiles are cached on disk and validated with ETag.
+    :param int field_id: id of the field from user
+    :param int z: zoom
+    :param int x: column of the tile
+    :param int y: row of the tile
+    :param request:
+    :param background_tasks:
+    :param conn:
+    :return status|FileResponse:
+    """
+
+    status = await conn.get_status(field_id)
+    if status != Status.FINISHED_CALCULATION:
+        return JSONResponse({
+            "status": status,
+            "message": "NDVI image is not ready."
+        }, status_code=404)
+
+    ndvi_path = storage.get_path_to_ndvi_image(field_id=field_id)
+    try:
+        # NDVI image is checked on disk outside of event loop
+        etag = await run_in_threadpool(tile_cache.get_etag,
+                                       ndvi_path, z, x, y)
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+
+        tile_path = await run_in_threadpool(
+            tile_cache.get_tile, field_id, ndvi_path, z, x, y,
+            render=lambda: render_tile(ndvi_path, z, x, y))
+    except FileNotFoundError:
+        # Field was deleted or recalculated meanwhile
+        return JSONResponse({
+            "status": "OUT_OF_ORDER",
+            "message": "NDVI image is not ready."
+        }, status_code=404)
+    background_tasks.add_task(tile_cache.evict)
+
+    # Tile doesn't intersect the field
+    if tile_path is None:
+        return Response(status_code=204, headers={"ETag": etag})
+
+    return FileResponse(path=tile_path, media_type="image/png",
+                        headers={"ETag": etag})
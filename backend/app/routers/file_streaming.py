@@ -0,0 +1,90 @@
+import os
+import re
+
+import anyio
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+CHUNK_SIZE = 64 * 1024
+
+# Only single byte range is supported, other ranges return whole file
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(range_header: str, file_size: int):
+    """
+    Parses Range header.
+    :param str range_header: value of Range header
+    :param int file_size: size of requested file
+    :return tuple(int, int)|None: first and last byte or None
+        if range is not supported
+    :raise ValueError: if range can't be satisfied
+    """
+    match = RANGE_PATTERN.match(range_header.strip())
+    if match is None or match.groups() == ("", ""):
+        return None
+
+    start, end = match.groups()
+    if start == "":
+        # Suffix range, last N bytes
+        start, end = max(file_size - int(end), 0), file_size - 1
+    else:
+        start = int(start)
+        end = min(int(end), file_size - 1) if end else file_size - 1
+
+    if start > end or start >= file_size:
+        raise ValueError(f"Range {range_header} is not satisfiable.")
+    return start, end
+
+
+async def stream_file(path: str, start: int, end: int):
+    """
+    Reads part of the file by chunks without blocking event loop.
+    :param str path: path to the file
+    :param int start: first byte
+    :param int end: last byte
+    """
+    async with await anyio.open_file(path, "rb") as file:
+        await file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_response(path: str, request: Request, media_type: str = None):
+    """
+    Returns whole file or its part if request has Range header,
+    so clients can fetch only parts of large images.
+    :param str path: path to the file
+    :param request: request of the client
+    :param str media_type: media type of the file
+    :return: response with file content
+    """
+    range_header = request.headers.get("range")
+    if range_header is None:
+        return FileResponse(path=path, media_type=media_type,
+                            headers={"Accept-Ranges": "bytes"})
+
+    file_size = os.stat(path).st_size
+    try:
+        byte_range = parse_range(range_header, file_size)
+    except ValueError:
+        return Response(status_code=416,
+                        headers={"Content-Range": f"bytes */{file_size}"})
+
+    if byte_range is None:
+        return FileResponse(path=path, media_type=media_type,
+                            headers={"Accept-Ranges": "bytes"})
+
+    start, end = byte_range
+    return StreamingResponse(
+        stream_file(path, start, end),
+        status_code=206,
+        media_type=media_type,
+        headers={"Accept-Ranges": "bytes",
+                 "Content-Range": f"bytes {start}-{end}/{file_size}",
+                 "Content-Length": str(end - start + 1)})
@@ -0,0 +1,104 @@
+import logging
+import os
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+
+from backend.app.database import async_crud
+from backend.app.fs.file_system_storage import ArtifactsFileSystemStorage
+from backend.app.fs.storage_manager import read_usage
+
+from .routers_config import connecting_to_db
+
+router = APIRouter(
+    tags=["metrics"],
+)
+
+METRIC_PREFIX = "field_pipeline_stage"
+STORAGE_METRIC_PREFIX = "field_storage"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+storage = ArtifactsFileSystemStorage(
+    base_path=os.getenv("FS_STORAGE_BASE_PATH",
+                        default="STORAGE"))
+
+logger = logging.getLogger()
+
+
+def format_labels(row):
+    return f'{{run="{row.run}",stage="{row.stage}"}}'
+
+
+def format_metrics(rows):
+    """
+    Formats aggregated pipeline stages in Prometheus text format.
+    :param rows: rows with run, stage, count, sums of seconds
+        and bytes and max of peak memory
+    :return str: metrics
+    """
+    lines = [
+        f"# HELP {METRIC_PREFIX}_seconds Time spent in pipeline stage.",
+        f"# TYPE {METRIC_PREFIX}_seconds summary",
+    ]
+    for row in rows:
+        lines.append(f"{METRIC_PREFIX}_seconds_sum{format_labels(row)} "
+                     f"{row.seconds or 0}")
+        lines.append(f"{METRIC_PREFIX}_seconds_count{format_labels(row)} "
+                     f"{row.count}")
+
+    for name, help_text in (("read_bytes", "Bytes read in pipeline stage."),
+                            ("written_bytes",
+                             "Bytes written in pipeline stage.")):
+        lines.append(f"# HELP {METRIC_PREFIX}_{name}_total {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name}_total counter")
+        for row in rows:
+            lines.append(f"{METRIC_PREFIX}_{name}_total{format_labels(row)} "
+                         f"{getattr(row, name) or 0}")
+
+    lines.append(f"# HELP {METRIC_PREFIX}_peak_rss_bytes "
+                 f"Maximal peak resident memory of pipeline stage.")
+    lines.append(f"# TYPE {METRIC_PREFIX}_peak_rss_bytes gauge")
+    for row in rows:
+        lines.append(f"{METRIC_PREFIX}_peak_rss_bytes{format_labels(row)} "
+                     f"{row.peak_rss_bytes or 0}")
+    return "\n".join(lines) + "\n"
+
+
+def format_storage_metrics(usage):
+    """
+    Formats usage of the storage saved by the last quota check
+    in Prometheus text format.
+    :param dict usage: usage of the storage or None
+    :return str: metrics
+    """
+    if usage is None:
+        return ""
+
+    return "\n".join([
+        f"# HELP {STORAGE_METRIC_PREFIX}_bytes Bytes used by storage.",
+        f"# TYPE {STORAGE_METRIC_PREFIX}_bytes gauge",
+        f'{STORAGE_METRIC_PREFIX}_bytes{{kind="products"}} '
+        f'{usage["products_size"]}',
+        f'{STORAGE_METRIC_PREFIX}_bytes{{kind="fields"}} '
+        f'{usage["fields_size"]}',
+        f"# HELP {STORAGE_METRIC_PREFIX}_quota_bytes Quota of storage, "
+        f"0 means no quota.",
+        f"# TYPE {STORAGE_METRIC_PREFIX}_quota_bytes gauge",
+        f'{STORAGE_METRIC_PREFIX}_quota_bytes {usage["quota"]}',
+    ]) + "\n"
+
+
+@router.get("/metrics")
+async def get_metrics(conn: async_crud.AsyncCRUD = Depends(connecting_to_db)):
+    """
+    Returns pipeline stages of all fields aggregated
+    by run and stage and usage of the storage
+    in Prometheus text format.
+    :param conn:
+    :return:
+    """
+
+    rows = await conn.get_pipeline_stage_totals()
+    return PlainTextResponse(format_metrics(rows) +
+                             format_storage_metrics(read_usage(storage)),
+                             media_type=PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,70 @@
+import re
+
+from fastapi.responses import StreamingResponse
+from starlette.requests import ClientDisconnect
+
+# Records of NDJSON are separated by new lines and records
+# of GeoJSON text sequences (RFC 8142) by record separator
+RECORD_SEPARATOR = re.compile(rb"[\n\x1e]")
+
+
+class RecordTooLarge(ValueError):
+    pass
+
+
+async def iterate_records(stream, max_size: int):
+    """
+    Splits byte stream into records as chunks arrive, so only
+    one record is kept in memory. Blank records are skipped.
+    Records larger than max_size are skipped and reported
+    as RecordTooLarge instead of their content.
+    :param stream: async iterator of bytes chunks e.g. request.stream()
+    :param int max_size: max size of one record in bytes
+    :return: async iterator of (record number from 1, bytes|RecordTooLarge)
+    """
+    buffer = b""
+    number = 0
+    too_large = False
+    async for chunk in stream:
+        parts = RECORD_SEPARATOR.split(buffer + chunk)
+        buffer = parts.pop()
+        for part in parts:
+            if too_large or len(part) > max_size:
+                # The end of too large record
+                too_large = False
+                number += 1
+                yield number, RecordTooLarge(
+                    f"Record is larger than {max_size} bytes.")
+            elif part.strip():
+                number += 1
+                yield number, part
+
+        if len(buffer) > max_size:
+            too_large = True
+            buffer = b""
+
+    if too_large or len(buffer) > max_size:
+        number += 1
+        yield number, RecordTooLarge(
+            f"Record is larger than {max_size} bytes.")
+    elif buffer.strip():
+        number += 1
+        yield number, buffer
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    Streaming response which body is produced while request body
+    is still being read. It doesn't listen for client disconnect
+    like StreamingResponse does on older ASGI servers,
+    since that would consume messages of request body.
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+
+        if self.background is not None:
+            await self.background()
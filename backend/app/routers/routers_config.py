@@ -1,10 +1,29 @@
-from backend.app.database import crud
+from typing import Optional
 
+from fastapi import Header
 
-def connecting_to_db():
+from backend.app.database import async_crud
+from backend.app.fair_share import DEFAULT_TENANT
+
+
+async def connecting_to_db():
     """
-    Creates instance of CRUD class
-    that connects to database.
+    Creates instance of AsyncCRUD class
+    that connects to database and closes
+    its session when request is finished.
     :return:
     """
-    return crud.CRUD()
+    conn = async_crud.AsyncCRUD()
+    try:
+        yield conn
+    finally:
+        await conn.close()
+
+
+async def get_tenant(x_tenant_id: Optional[str] = Header(default=None)):
+    """
+    Reads tenant of the request from X-Tenant-ID header,
+    tasks of every tenant get fair share of workers.
+    :return str: id of the tenant
+    """
+    return (x_tenant_id or "").strip() or DEFAULT_TENANT
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+CHUNK_SIZE = 32 * 1024 * 1024
+MAX_WORKERS = 4
+RETRIES = 5
+RETRY_DELAY = 2
+TIMEOUT = 60
+READ_SIZE = 1024 * 1024
+INCOMPLETE_SUFFIX = ".incomplete"
+CHUNKS_SUFFIX = ".chunks"
+
+
+class DownloadError(Exception):
+    pass
+
+
+class ChunkedDownloader:
+    """
+    This class downloads files with HTTP range requests.
+    File is split into chunks which are fetched in parallel
+    by a bounded pool of threads and written in place
+    into a partial file.
+
+    Completed chunks are recorded next to the partial file,
+    so an interrupted download is resumed from the missing chunks
+    instead of being restarted. Downloaded file is verified
+    against MD5 checksum before it is moved to its final path.
+
+    Files of servers which don't support range requests
+    are downloaded with one stream.
+    """
+
+    def __init__(self, session, chunk_size: int = CHUNK_SIZE,
+                 max_workers: int = MAX_WORKERS, retries: int = RETRIES,
+                 retry_delay: float = RETRY_DELAY):
+        """
+        :param session: requests session with authentication
+        :param int chunk_size: size of the chunk in bytes
+        :param int max_workers: number of chunks fetched at once
+        :param int retries: attempts to fetch every chunk
+        :param float retry_delay: delay before the first retry in seconds,
+            it doubles with every attempt
+        """
+        self.session = session
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+    def download(self, url: str, file_path: str, size: int = None,
+                 md5: str = None):
+        """
+        Downloads file by url.
+        :param str url: url of the file
+        :param str file_path: path where file is saved to
+        :param int size: size of the file, it is requested when not passed
+        :param str md5: expected MD5 checksum of the file
+        :return str: path to the downloaded file
+        """
+        partial_path = file_path + INCOMPLETE_SUFFIX
+        chunks_path = file_path + CHUNKS_SUFFIX
+
+        accepts_ranges = True
+        if size is None:
+            size, accepts_ranges = self.__get_file_info(url)
+
+        if accepts_ranges and size:
+            self.__download_chunks(url, partial_path, chunks_path, size)
+        else:
+            logger.info(f"Server doesn't support range requests, "
+                        f"downloading {url} with one stream.")
+            self.__with_retries(self.__download_stream, url, partial_path)
+
+        if md5 is not None and \
+                self.get_md5(partial_path).lower() != md5.lower():
+            # Partial file is broken, next attempt starts from scratch
+            os.remove(partial_path)
+            if os.path.exists(chunks_path):
+                os.remove(chunks_path)
+            raise DownloadError(f"MD5 checksum of {url} doesn't match.")
+
+        os.replace(partial_path, file_path)
+        if os.path.exists(chunks_path):
+            os.remove(chunks_path)
+        return file_path
+
+    @staticmethod
+    def get_md5(file_path: str):
+        """
+        Calculates MD5 checksum of the file.
+        :param str file_path: path to the file
+        :return str: hex digest
+        """
+        md5 = hashlib.md5()
+        with open(file_path, "rb") as file:
+            for block in iter(lambda: file.read(READ_SIZE), b""):
+                md5.update(block)
+        return md5.hexdigest()
+
+    def __get_file_info(self, url: str):
+        response = self.session.head(url, allow_redirects=True,
+                                     timeout=TIMEOUT)
+        response.raise_for_status()
+        size = int(response.headers.get("Content-Length", 0))
+        accepts_ranges = response.headers.get("Accept-Ranges") == "bytes"
+        return size, accepts_ranges
+
+    def __download_chunks(self, url: str, partial_path: str,
+                          chunks_path: str, size: int):
+        chunks = {start: min(start + self.chunk_size, size) - 1
+                  for start in range(0, size, self.chunk_size)}
+
+        done = self.__read_done_chunks(partial_path, chunks_path, size)
+        missing = sorted(start for start in chunks if start not in done)
+        logger.info(f"Downloading {len(missing)} of {len(chunks)} chunks "
+                    f"of {url}.")
+
+        lock = threading.Lock()
+        fd = os.open(partial_path, os.O_WRONLY | os.O_CREAT)
+        try:
+            os.ftruncate(fd, size)
+
+            def fetch(start):
+                self.__with_retries(self.__download_chunk, url, fd,
+                                    start, chunks[start])
+                # Record chunk only after it is written
+                with lock:
+                    done.add(start)
+                    self.__write_done_chunks(chunks_path, size, done)
+
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                for future in [pool.submit(fetch, start)
+                               for start in missing]:
+                    future.result()
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def __download_chunk(self, url: str, fd: int, start: int, end: int):
+        with self.session.get(url, headers={"Range": f"bytes={start}-{end}"},
+                              stream=True, timeout=TIMEOUT) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise DownloadError(f"Range request to {url} "
+                                    f"is not supported.")
+
+            offset = start
+            for block in response.iter_content(READ_SIZE):
+                os.pwrite(fd, block, offset)
+                offset += len(block)
+
+        if offset != end + 1:
+            raise DownloadError(f"Chunk {start}-{end} of {url} "
+                                f"is incomplete.")
+
+    def __download_stream(self, url: str, partial_path: str):
+        with self.session.get(url, stream=True,
+                              timeout=TIMEOUT) as response:
+            response.raise_for_status()
+            with open(partial_path, "wb") as file:
+                for block in response.iter_content(READ_SIZE):
+                    file.write(block)
+
+    def __with_retries(self, function, *args):
+        for attempt in range(self.retries):
+            try:
+                return function(*args)
+            except Exception as ex:
+                if attempt == self.retries - 1:
+                    raise ex
+                logger.warning(f"Download attempt {attempt + 1} failed "
+                               f"with {ex!r}, retrying.")
+                time.sleep(self.retry_delay * 2 ** attempt)
+
+    def __read_done_chunks(self, partial_path: str, chunks_path: str,
+                           size: int):
+        if not os.path.exists(partial_path) or \
+                not os.path.exists(chunks_path):
+            return set()
+
+        with open(chunks_path) as file:
+            state = json.load(file)
+
+        # Partial file of another size or chunking can't be resumed
+        if state["size"] != size or state["chunk_size"] != self.chunk_size:
+            return set()
+        return set(state["done"])
+
+    def __write_done_chunks(self, chunks_path: str, size: int, done: set):
+        tmp_path = chunks_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"size": size, "chunk_size": self.chunk_size,
+                       "done": sorted(done)}, file)
+        os.replace(tmp_path, chunks_path)
@@ -1,26 +1,76 @@
 import os
+import re
+from datetime import timedelta
+
+from backend.app.instrumentation import instrumented
+from backend.app.satellite_data_providers.satellite_data_extractor import (
+    BAND_FILE_PATTERN, NATIVE_RESOLUTIONS)
+
+# Scene cloud cover percentage range of searched products
+CLOUD_COVER = (0, 10)
+# Sentinel-2 tile of the product, e.g. T37UDB
+TILE_PATTERN = re.compile(r"_(T\d{2}[A-Z]{3})_")
+
+
+def get_tile_id(title: str):
+    """
+    Gets Sentinel-2 tile of the product from its title.
+    :param str title: title of the product
+    :return str: tile id or title when it has no tile
+    """
+    match = TILE_PATTERN.search(title)
+    return match.group(1) if match is not None else title
+
+
+def make_band_filter(bands):
+    """
+    Makes node filter which selects only band files of the product
+    in their native resolution, so other files of the product
+    are not downloaded.
+    :param bands: band names e.g. B04, B08
+    :return: callable which accepts node information
+    """
+    bands = set(bands)
+
+    def band_filter(node_info):
+        match = BAND_FILE_PATTERN.search(node_info["node_path"])
+        if match is None or match.group("band") not in bands:
+            return False
+
+        # L1C band files have no resolution in their names
+        resolution = match.group("resolution")
+        return resolution is None or \
+            "R" + resolution == NATIVE_RESOLUTIONS.get(match.group("band"))
+
+    return band_filter
 
 
 class SatelliteDataClient:
-    def __init__(self, api_client):
+    def __init__(self, api_client, downloader=None):
+        """
+        :param api_client: Copernicus open access hub api client
+        :param downloader: optional ChunkedDownloader, products are
+            downloaded by api client with one stream when not passed
+        """
         self.client = api_client
+        self.downloader = downloader
 
-    def get_data(self,
-                 footprint,
-                 output_folder: str = "satellite_data_providers"):
+    @instrumented("query")
+    def find_product(self, footprint, cloud_cover=CLOUD_COVER):
         """
-        Gets data from Copernicus open access hub api by footprint.
+        Finds the best product from Copernicus open access hub api
+        by footprint.
 
         :param footprint: information about field
-        :param str output_folder: folder where satellite data stores
-        :return: path to zipped data
+        :param cloud_cover: scene cloud cover percentage range
+        :return tuple(str, str): uuid and title of the best product
         """
 
         # search by polygon, time, and SciHub query keywords
         products = self.client.query(footprint,
                                      date=('NOW-1DAY', 'NOW'),
                                      platformname='Sentinel-2',
-                                     cloudcoverpercentage=(0, 10))
+                                     cloudcoverpercentage=cloud_cover)
 
         # convert to Pandas DataFrame
         products_df = self.client.to_dataframe(products)
@@ -31,11 +81,136 @@ class SatelliteDataClient:
             ascending=[True, True]
         )
         products_df_sorted = products_df_sorted.iloc[0]
-        title = products_df_sorted['title']
-        m_uuid = products_df_sorted['uuid']
+        return products_df_sorted['uuid'], products_df_sorted['title']
 
-        # download best results from the search
-        self.client.download(id=m_uuid, directory_path=output_folder)
+    @instrumented("query")
+    def find_products(self, footprint, cloud_cover=CLOUD_COVER):
+        """
+        Finds products from Copernicus open access hub api covering
+        footprint, e.g. area of many fields, with one query.
+
+        :param footprint: information about fields
+        :param cloud_cover: scene cloud cover percentage range
+        :return list(tuple(str, str, str)): uuid, title and footprint
+            in WKT of products sorted from the best one
+        """
+
+        products = self.client.query(footprint,
+                                     date=('NOW-1DAY', 'NOW'),
+                                     platformname='Sentinel-2',
+                                     cloudcoverpercentage=cloud_cover)
+
+        products_df = self.client.to_dataframe(products)
+        if products_df.empty:
+            return []
+
+        products_df_sorted = products_df.sort_values(
+            ['cloudcoverpercentage', 'ingestiondate'],
+            ascending=[True, True]
+        )
+        return [(row.uuid, row.title, row.footprint)
+                for row in products_df_sorted.itertuples()]
+
+    @instrumented("query")
+    def find_products_by_date(self, footprint, date_from, date_to,
+                              cloud_cover=CLOUD_COVER):
+        """
+        Finds the best product of every acquisition date in the date range
+        from Copernicus open access hub api by footprint.
+
+        :param footprint: information about field
+        :param date_from: first date of the range
+        :param date_to: last date of the range, inclusive
+        :param cloud_cover: scene cloud cover percentage range
+        :return list(tuple(str, str, str)): acquisition date in ISO format,
+            uuid and title of the best product of the date sorted by date
+        """
+
+        # search by polygon, time range, and SciHub query keywords
+        products = self.client.query(footprint,
+                                     date=(date_from,
+                                           date_to + timedelta(days=1)),
+                                     platformname='Sentinel-2',
+                                     cloudcoverpercentage=cloud_cover)
+
+        products_df = self.client.to_dataframe(products)
+        if products_df.empty:
+            return []
+
+        # keep the best product of every acquisition date
+        products_df['acquisition_date'] = \
+            products_df['beginposition'].dt.date
+        products_df_best = products_df.sort_values(
+            ['acquisition_date', 'cloudcoverpercentage', 'ingestiondate'],
+            ascending=[True, True, True]
+        ).drop_duplicates('acquisition_date')
+
+        return [(row.acquisition_date.isoformat(), row.uuid, row.title)
+                for row in products_df_best.itertuples()]
+
+    def get_product_title(self, product_id: str):
+        """
+        Gets title of the product by its uuid.
+
+        :param str product_id: uuid of the product
+        :return str: title of the product
+        """
+        return self.client.get_product_odata(product_id)["title"]
+
+    @instrumented("download")
+    def download_product(self, product_id: str, title: str,
+                         output_folder: str, bands=None):
+        """
+        Downloads product by its uuid.
+
+        :param str product_id: uuid of the product
+        :param str title: title of the product
+        :param str output_folder: folder where satellite data stores
+        :param bands: band names e.g. B04, B08, only files of these bands
+            are downloaded unzipped when passed
+        :return: path to zipped data or to product folder when
+            bands are passed
+        """
+
+        if bands is not None:
+            # Files of the product are listed in its manifest and
+            # downloaded one by one, already downloaded files are skipped
+            product_info = self.client.download(
+                id=product_id, directory_path=output_folder,
+                nodefilter=make_band_filter(bands))
+            return os.path.join(output_folder,
+                                product_info["product_root_dir"])
+
+        file_path = os.path.join(output_folder, title + ".zip")
+
+        product_info = None
+        if self.downloader is not None:
+            product_info = self.client.get_product_odata(product_id)
+
+        # Offline products are requested from long term archive by api client
+        if product_info is None or not product_info["Online"]:
+            self.client.download(id=product_id, directory_path=output_folder)
+        else:
+            self.downloader.download(url=product_info["url"],
+                                     file_path=file_path,
+                                     size=product_info["size"],
+                                     md5=product_info["md5"])
 
         # return path to downloaded data
-        return os.path.join(output_folder, title + ".zip")
+        return file_path
+
+    def get_data(self,
+                 footprint,
+                 output_folder: str = "satellite_data_providers"):
+        """
+        Gets data from Copernicus open access hub api by footprint.
+
+        :param footprint: information about field
+        :param str output_folder: folder where satellite data stores
+        :return: path to zipped data
+        """
+
+        # download best results from the search
+        m_uuid, title = self.find_product(footprint)
+        return self.download_product(product_id=m_uuid, title=title,
+                                     output_folder=output_folder)
@@ -1,4 +1,27 @@
+import json
 import os
+import posixpath
+import re
+import zipfile
+
+from backend.app.instrumentation import instrumented
+
+INDEX_FILE = "product_index.json"
+
+# Band file names look like T39VVG_20220601T080611_B04_10m.jp2 in L2A
+# and T39VVG_20220601T080611_B04.jp2 in L1C products
+BAND_FILE_PATTERN = re.compile(
+    r"_(?P<band>B\d[\dA]|SCL|AOT|WVP|TCI)(_(?P<resolution>\d+m))?"
+    r"\.(jp2|tif)$")
+RESOLUTION_FOLDER_PATTERN = re.compile(r"^R\d+m$")
+
+# Native resolutions are used when product has no resolution folders
+NATIVE_RESOLUTIONS = {
+    "B01": "R60m", "B02": "R10m", "B03": "R10m", "B04": "R10m",
+    "B05": "R20m", "B06": "R20m", "B07": "R20m", "B08": "R10m",
+    "B8A": "R20m", "B09": "R60m", "B10": "R60m", "B11": "R20m",
+    "B12": "R20m", "TCI": "R10m", "SCL": "R20m",
+}
 
 
 class SciHubSatelliteDataExtractor:
@@ -10,41 +33,175 @@ class SciHubSatelliteDataExtractor:
     'data/
     S2A_MSIL2A_20220601T080611_N0400_R078_T39VVG_20220601T120411.SAFE/
     GRANULE/L2A_T39VVG_A036254_20220601T081244/IMG_DATA/R10m'
+
+    Product is scanned once and its layout is saved next to it
+    as band -> resolution -> path index, so every band lookup
+    is served from the index.
+
+    Zipped products are not extracted, their files are resolved from
+    zip central directory and returned as GDAL /vsizip/ paths.
     """
 
     def __init__(self, path_to_data):
         self.path = path_to_data
+        self.__index = None
 
-    def __extract_base_path(self, resolution: str):
+    def __walk(self):
         """
-        Extracts base path for NIR and Red files.
-        :param str resolution: resolution of image R10m|R20m|R30m
-        :return:
-        """
-
-        resolution_present = len([
-            p for p in os.walk(self.path)
-            if "R10m" in p[0] or "R20m" in p[0] or "R60m" in p[0]
-            ]) > 0
-
-        if resolution_present:
-            res = [p for p in os.walk(self.path)
-                   if "GRANULE" in p[0]
-                   and "IMG_DATA" in p[0]
-                   and resolution in p[0]]
-        else:
-            res = [p for p in os.walk(self.path)
-                   if "GRANULE" in p[0]
-                   and "IMG_DATA" in p[0]
-                   ]
-
-        if len(res) == 0:
+        Walks satellite data folder like os.walk
+        and also walks inside zipped products.
+        """
+        for root, dirs, files in os.walk(self.path):
+            yield root, dirs, files
+            for file in files:
+                if file.endswith(".zip"):
+                    yield from self.__walk_zip(os.path.join(root, file))
+
+    @staticmethod
+    def __walk_zip(path_to_zip: str):
+        """
+        Walks zipped product without extracting it.
+        :param str path_to_zip: path to zipped product
+        """
+        folders = {}
+        with zipfile.ZipFile(path_to_zip, 'r') as zip_ref:
+            for name in zip_ref.namelist():
+                folder, file = posixpath.split(name)
+                files = folders.setdefault(folder, [])
+                if file:
+                    files.append(file)
+
+        for folder, files in folders.items():
+            yield posixpath.join(path_to_zip, folder), [], files
+
+    @instrumented("scan")
+    def __scan(self):
+        """
+        Scans product once and builds band -> resolution -> path index.
+        Paths are relative to the product folder.
+        :return dict: index of band files
+        """
+        index = {}
+        for root, _, files in self.__walk():
+            if "GRANULE" not in root or "IMG_DATA" not in root:
+                continue
+
+            folder = os.path.basename(root)
+            for file in files:
+                match = BAND_FILE_PATTERN.search(file)
+                if match is None:
+                    continue
+
+                band = match.group("band")
+                if match.group("resolution"):
+                    resolution = "R" + match.group("resolution")
+                elif RESOLUTION_FOLDER_PATTERN.match(folder):
+                    resolution = folder
+                else:
+                    resolution = NATIVE_RESOLUTIONS.get(band)
+
+                index.setdefault(band, {})[resolution] = os.path.relpath(
+                    os.path.join(root, file), self.path)
+
+        if len(index) == 0:
             raise Exception(
                 f"Impossible to parse provided folder {self.path}. "
                 f"Please check if path is correct!"
             )
 
-        return res[0]
+        return index
+
+    def __load_index(self):
+        """
+        Loads index saved next to the product or scans product
+        and saves index if there is no one yet.
+        :return dict: index of band files
+        """
+        if self.__index is not None:
+            return self.__index
+
+        index_path = os.path.join(self.path, INDEX_FILE)
+        try:
+            with open(index_path) as file:
+                self.__index = json.load(file)
+        except FileNotFoundError:
+            self.__index = self.__scan()
+
+            tmp_path = f"{index_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(self.__index, file)
+            os.replace(tmp_path, index_path)
+
+        return self.__index
+
+    def reset_index(self):
+        """
+        Removes index saved next to the product, so product
+        is scanned again when its files change.
+        """
+        self.__index = None
+        try:
+            os.remove(os.path.join(self.path, INDEX_FILE))
+        except FileNotFoundError:
+            pass
+
+    def __to_full_path(self, path: str):
+        """
+        Converts path from index to path rasterio can open.
+        """
+        path = os.path.abspath(os.path.join(self.path, path))
+        if ".zip" + os.sep in path:
+            return "/vsizip/" + path
+        return path
+
+    def get_bands(self):
+        """
+        Returns bands available in product with their resolutions.
+        :return dict: band -> list of resolutions
+        """
+        return {band: list(resolutions)
+                for band, resolutions in self.__load_index().items()}
+
+    def extract_band_image_path(self, band: str, resolution: str = 'R10m'):
+        """
+        Extracts path to band image.
+        :param str band: band name e.g. B04|B8A|SCL
+        :param str resolution: resolution of image R10m|R20m|R60m
+        :return str path: path to the band image
+        """
+        try:
+            path = self.__load_index()[band][resolution]
+        except KeyError:
+            raise Exception(
+                f"There is no {band} band in {resolution} resolution "
+                f"in provided folder {self.path}."
+            )
+        return self.__to_full_path(path)
+
+    def extract_finest_band_image_path(self, band: str):
+        """
+        Extracts path to band image in the finest resolution
+        available in product.
+        :param str band: band name e.g. B04|B8A|SCL
+        :return str path: path to the band image
+        """
+        resolutions = self.get_bands().get(band)
+        if not resolutions:
+            raise Exception(
+                f"There is no {band} band in provided folder {self.path}."
+            )
+        resolution = min(resolutions, key=lambda name: int(name[1:-1]))
+        return self.extract_band_image_path(band, resolution)
+
+    def extract_scl_image_path(self):
+        """
+        Extracts path to scene classification image of L2A product.
+        :return str|None: path to the SCL image or None when
+            product has no scene classification e.g. L1C product
+        """
+        if "SCL" not in self.get_bands():
+            return None
+        return self.extract_finest_band_image_path("SCL")
 
     def extract_nir_image_path(self, resolution: str = 'R10m'):
         """
@@ -52,9 +209,7 @@ class SciHubSatelliteDataExtractor:
         :param str resolution: resolution of image R10m|R20m|R30m
         :return str path: path to the NIR image
         """
-        bp = self.__extract_base_path(resolution)
-        nir = [p for p in bp[2] if "B08" in p][0]
-        return os.path.join(bp[0], nir)
+        return self.extract_band_image_path("B08", resolution)
 
     def extract_red_image_path(self, resolution: str = 'R10m'):
         """
@@ -62,6 +217,4 @@ class SciHubSatelliteDataExtractor:
         :param str resolution: resolution of image R10m|R20m|R30m
         :return str path: path to the Red image
         """
-        bp = self.__extract_base_path(resolution)
-        red = [p for p in bp[2] if "B04" in p][0]
-        return os.path.join(bp[0], red)
+        return self.extract_band_image_path("B04", resolution)
@@ -0,0 +1,104 @@
+import asyncio
+import json
+import logging
+import os
+
+import redis
+import redis.asyncio
+
+# Status changes are pushed to clients via redis channels,
+# so clients don't need to poll database
+STATUS_EVENTS_URL = os.environ.get("STATUS_EVENTS_URL",
+                                   os.environ.get("BROKER_URL"))
+CHANNEL_PREFIX = "field_status:"
+# Heartbeat is sent to client if status doesn't change for so long
+HEARTBEAT_INTERVAL = 15
+# Database is polled with this interval if redis is not configured
+POLL_INTERVAL = 5
+
+logger = logging.getLogger()
+
+_client = None
+_async_client = None
+
+
+def get_channel(field_id: int):
+    return f"{CHANNEL_PREFIX}{field_id}"
+
+
+def is_enabled():
+    return STATUS_EVENTS_URL is not None and \
+        STATUS_EVENTS_URL.startswith(("redis://", "rediss://"))
+
+
+def publish_status(field_ids: list, status: str):
+    """
+    Publishes status change of fields. Errors are only logged,
+    because status is already saved to database.
+    :param list field_ids: ids of the fields from user
+    :param str status: status text
+    """
+    global _client
+    if not is_enabled():
+        return
+
+    try:
+        if _client is None:
+            _client = redis.Redis.from_url(STATUS_EVENTS_URL)
+        with _client.pipeline(transaction=False) as pipeline:
+            for field_id in field_ids:
+                pipeline.publish(get_channel(field_id), json.dumps({
+                    "field_id": field_id,
+                    "status": status
+                }))
+            pipeline.execute()
+    except redis.RedisError:
+        logger.exception(f"Failed to publish {status} of {field_ids}.")
+
+
+async def iterate_status(field_id: int, get_status, final_statuses,
+                         timeout: float):
+    """
+    Yields current status of the field and then its changes until
+    status is final or timeout is reached. None is yielded
+    as heartbeat when status doesn't change.
+    :param int field_id: id of the field from user
+    :param get_status: coroutine function returning status from database
+    :param final_statuses: statuses after which nothing changes
+    :param float timeout: max time of waiting in seconds
+    """
+    global _async_client
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    if not is_enabled():
+        status = await get_status()
+        yield status
+        while status not in final_statuses and loop.time() < deadline:
+            await asyncio.sleep(POLL_INTERVAL)
+            new_status = await get_status()
+            yield new_status if new_status != status else None
+            status = new_status
+        return
+
+    if _async_client is None:
+        _async_client = redis.asyncio.Redis.from_url(STATUS_EVENTS_URL)
+    pubsub = _async_client.pubsub()
+
+    # Subscribe before reading status, so no change is missed
+    await pubsub.subscribe(get_channel(field_id))
+    try:
+        status = await get_status()
+        yield status
+        while status not in final_statuses and loop.time() < deadline:
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True,
+                timeout=min(HEARTBEAT_INTERVAL, deadline - loop.time()))
+            if message is None:
+                yield None
+                continue
+            status = json.loads(message["data"])["status"]
+            yield status
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
@@ -1,6 +1,9 @@
 import zipfile
 
+from backend.app.instrumentation import instrumented
 
+
+@instrumented("unzip")
 def unzip_files(path_to_zip: str,
                 output_folder: str):
     """
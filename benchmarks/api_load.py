@@ -0,0 +1,116 @@
+"""
+Load benchmark of status polls against API running
+on a local SQLite database.
+Requires aiosqlite to be installed.
+
+Usage:
+    python -m benchmarks.api_load --fields 100 --requests 5000 \
+        --concurrency 100
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+FOLDER = tempfile.mkdtemp()
+os.environ.setdefault("SQLALCHEMY_DATABASE_URL",
+                      f"sqlite:///{FOLDER}/benchmark.db")
+os.environ.setdefault("FS_STORAGE_BASE_PATH", f"{FOLDER}/STORAGE")
+os.environ.setdefault("BROKER_URL", "memory://")
+os.environ.setdefault("api", "http://localhost/")
+
+import httpx  # noqa: E402
+
+from backend.app.database.crud import CRUD, Status  # noqa: E402
+from backend.app.database.database_config import init_tables  # noqa: E402
+
+FIELD = {"type": "FeatureCollection", "features": [{
+    "type": "Feature", "properties": {},
+    "geometry": {"type": "Polygon", "coordinates": [[
+        [37.545, 54.091], [37.552, 54.091], [37.552, 54.095],
+        [37.545, 54.095], [37.545, 54.091]]]}}]}
+
+
+def create_fields(count):
+    """
+    Creates fields which NDVI is being calculated.
+    """
+    from geojson_pydantic import FeatureCollection
+
+    init_tables()
+    conn = CRUD()
+    field_ids = [conn.create_field(FeatureCollection(**FIELD))
+                 for _ in range(count)]
+    conn.change_status_bulk(field_ids, Status.STARTED_CALCULATION)
+    conn.close()
+    return field_ids
+
+
+def start_server(port):
+    """
+    Starts API in a separate process, so client doesn't share GIL with it.
+    """
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.app.endpoint:app",
+         "--port", str(port), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return server
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+
+
+async def poll(client, field_ids, requests, latencies):
+    for i in range(requests):
+        start = time.perf_counter()
+        response = await client.get(
+            "/field/ndvi/image",
+            params={"field_id": field_ids[i % len(field_ids)]})
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(port, field_ids, requests, concurrency):
+    latencies = []
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}",
+                                 limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            poll(client, field_ids, requests // concurrency, latencies)
+            for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    return elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fields", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    field_ids = create_fields(args.fields)
+    server = start_server(args.port)
+    elapsed, latencies = asyncio.run(
+        run(args.port, field_ids, args.requests, args.concurrency))
+    server.terminate()
+
+    latencies.sort()
+    print(f"requests: {len(latencies)}, "
+          f"throughput: {len(latencies) / elapsed:8.1f} req/s")
+    print(f"latency p50: {statistics.median(latencies) * 1000:8.2f} ms, "
+          f"p95: {latencies[int(len(latencies) * 0.95)] * 1000:8.2f} ms, "
+          f"p99: {latencies[int(len(latencies) * 0.99)] * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
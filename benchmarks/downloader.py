@@ -0,0 +1,133 @@
+"""
+Compares single stream download with chunked parallel download
+against a local HTTP server standing in for Copernicus open access hub.
+Server adds latency to every response and limits bandwidth
+of every connection, and can drop connections to check resume.
+
+Usage:
+    python -m benchmarks.downloader --size 256 --latency 0.05 \
+        --bandwidth 50 --workers 4 --drop-rate 0.1
+"""
+import argparse
+import hashlib
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from backend.app.satellite_data_providers.downloader import ChunkedDownloader
+
+BLOCK_SIZE = 64 * 1024
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves one file with support of single byte ranges.
+    """
+    data = b""
+    latency = 0.0
+    bandwidth = 0
+    drop_rate = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.data)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        start, end = 0, len(self.data) - 1
+        match = re.match(r"bytes=(\d+)-(\d+)",
+                         self.headers.get("Range", ""))
+        if match:
+            start, end = int(match.group(1)), int(match.group(2))
+            self.send_response(206)
+            self.send_header("Content-Range",
+                             f"bytes {start}-{end}/{len(self.data)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+
+        # Connection is dropped in the middle of the response
+        if random.random() < self.drop_rate:
+            end = start + (end - start) // 2
+
+        for offset in range(start, end + 1, BLOCK_SIZE):
+            self.wfile.write(self.data[offset:min(offset + BLOCK_SIZE,
+                                                  end + 1)])
+            if self.bandwidth:
+                time.sleep(BLOCK_SIZE / self.bandwidth)
+
+
+def start_server(size, latency, bandwidth, drop_rate):
+    RangeRequestHandler.data = os.urandom(size)
+    RangeRequestHandler.latency = latency
+    RangeRequestHandler.bandwidth = bandwidth
+    RangeRequestHandler.drop_rate = drop_rate
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def single_stream(session, url, file_path):
+    with session.get(url, stream=True) as response:
+        response.raise_for_status()
+        with open(file_path, "wb") as file:
+            for block in response.iter_content(BLOCK_SIZE):
+                file.write(block)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=256,
+                        help="file size in MB")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="latency of every response in seconds")
+    parser.add_argument("--bandwidth", type=int, default=50,
+                        help="bandwidth of every connection in MB/s")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=16,
+                        help="chunk size in MB")
+    parser.add_argument("--drop-rate", type=float, default=0.0,
+                        help="share of chunked responses which are dropped")
+    args = parser.parse_args()
+
+    server = start_server(args.size * 1024 * 1024, args.latency,
+                          args.bandwidth * 1024 * 1024, 0.0)
+    url = f"http://127.0.0.1:{server.server_port}/product.zip"
+    md5 = hashlib.md5(RangeRequestHandler.data).hexdigest()
+    folder = tempfile.mkdtemp()
+    session = requests.Session()
+
+    start = time.perf_counter()
+    single_stream(session, url, os.path.join(folder, "single.zip"))
+    single = time.perf_counter() - start
+
+    RangeRequestHandler.drop_rate = args.drop_rate
+    downloader = ChunkedDownloader(session=session,
+                                   chunk_size=args.chunk_size * 1024 * 1024,
+                                   max_workers=args.workers, retry_delay=0)
+    start = time.perf_counter()
+    file_path = downloader.download(url, os.path.join(folder, "chunked.zip"),
+                                    md5=md5)
+    chunked = time.perf_counter() - start
+    server.shutdown()
+
+    assert downloader.get_md5(file_path) == md5
+    print(f"single stream: {single:8.3f} s")
+    print(f"chunked, {args.workers} workers: {chunked:8.3f} s "
+          f"({single / chunked:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
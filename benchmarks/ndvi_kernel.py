@@ -0,0 +1,66 @@
+"""
+Compares NDVI kernel with the formula used before it
+on random uint16 bands.
+
+Usage:
+    python -m benchmarks.ndvi_kernel --size 4096 --repeat 5
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from backend.app.analytics.ndvi_kernel import compute_ndvi
+
+
+def legacy_ndvi(nir, red, mask):
+    """
+    NDVI formula as it was before the kernel.
+    """
+    nir = np.where(mask, 0, nir).astype(nir.dtype)
+    red = np.where(mask, 0, red).astype(red.dtype)
+    return (nir.astype(float) - red.astype(float)) / (nir + red)
+
+
+def kernel_ndvi(nir, red, mask, out):
+    return compute_ndvi(nir, red, mask=mask, out=out)
+
+
+def measure(func, repeat, *args):
+    timings = []
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return min(timings), peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=4096)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    shape = (args.size, args.size)
+    nir = rng.integers(0, 10000, shape, dtype="uint16")
+    red = rng.integers(0, 10000, shape, dtype="uint16")
+    mask = rng.random(shape) < 0.3
+    out = np.empty(shape, dtype=np.float32)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for name, func, func_args in [
+                ("legacy", legacy_ndvi, (nir, red, mask)),
+                ("kernel", kernel_ndvi, (nir, red, mask, out))]:
+            best, peak = measure(func, args.repeat, *func_args)
+            print(f"{name:>10}: {best * 1000:8.2f} ms, "
+                  f"peak memory {peak / 2 ** 20:8.2f} MiB")
+
+
+if __name__ == "__main__":
+    main()
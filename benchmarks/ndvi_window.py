@@ -0,0 +1,80 @@
+"""
+Compares full-scene masking with windowed band reads
+on a synthetic Sentinel-2 like GeoTIFF.
+
+Usage:
+    python -m benchmarks.ndvi_window --size 10980 --repeat 5
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import rasterio
+import rasterio.mask
+
+from backend.app.analytics.geometry import reproject_field
+from backend.app.analytics.ndvi_counter import calculate_ndvi
+
+from .synthetic import BAND_SEEDS, create_band, create_field
+
+
+def legacy_ndvi(nir, red, shapes):
+    """
+    NDVI calculation as it was done before windowed reads.
+    """
+    with rasterio.open(red) as src:
+        out_image_red, _ = rasterio.mask.mask(src, shapes, crop=True)
+    with rasterio.open(nir) as src:
+        out_image_nir, _ = rasterio.mask.mask(src, shapes, crop=True)
+    b4 = rasterio.open(red)
+    meta = b4.meta
+    ndvi = (out_image_nir.astype(float) - out_image_red.astype(float)) / (
+        out_image_nir + out_image_red)
+    return ndvi, meta
+
+
+def windowed_ndvi(nir, red, shapes):
+    with rasterio.open(nir) as nir_src, rasterio.open(red) as red_src:
+        return calculate_ndvi(nir_src, red_src, shapes)
+
+
+def measure(func, repeat, *args):
+    timings = []
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return min(timings), peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=10980)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        red = os.path.join(folder, "T37UDB_B04_10m.tif")
+        nir = os.path.join(folder, "T37UDB_B08_10m.tif")
+        create_band(red, args.size, seed=BAND_SEEDS["B04"])
+        create_band(nir, args.size, seed=BAND_SEEDS["B08"])
+        with rasterio.open(red) as src:
+            shapes = reproject_field(create_field(args.size), src.crs)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for name, func in [("legacy", legacy_ndvi),
+                               ("windowed", windowed_ndvi)]:
+                best, peak = measure(func, args.repeat, nir, red, shapes)
+                print(f"{name:>10}: {best * 1000:8.2f} ms, "
+                      f"peak memory {peak / 2 ** 20:8.2f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Benchmark suite of pipeline stages on synthetic SAFE structured
+Sentinel-2 products: band extraction, unzip, NDVI calculation
+for fields of different area and vertex count with and without
+cloud masking and API end-to-end
+with a local SQLite database. Reports time, throughput and memory.
+
+Results can be saved and compared with a baseline, the suite fails
+when any benchmark is slower than the baseline more than tolerance.
+Requires aiosqlite to be installed.
+
+Usage:
+    python -m benchmarks.suite --size 4096 --repeat 3 --output base.json
+    python -m benchmarks.suite --size 4096 --repeat 3 --baseline base.json \
+        --tolerance 0.2
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from backend.app.instrumentation import read_peak_rss, reset_peak_rss
+
+from .synthetic import PIXEL_SIZE, PRODUCT_TITLE, create_field, create_product
+
+FOLDER = tempfile.mkdtemp()
+FIELD_AREAS = (1, 20, 200)
+FIELD_VERTICES = (4, 64, 1024)
+
+
+class LocalApi:
+    """
+    Stands in for SentinelAPI and serves synthetic product from disk.
+    """
+
+    def __init__(self, product_path, zip_path):
+        self.product_path = product_path
+        self.zip_path = zip_path
+
+    def get_product_odata(self, product_id):
+        return {"title": PRODUCT_TITLE}
+
+    def download(self, id, directory_path=".", nodefilter=None):
+        if nodefilter is None:
+            shutil.copy(self.zip_path, directory_path)
+            return {"title": PRODUCT_TITLE}
+
+        root = os.path.basename(self.product_path)
+        for folder, _, files in os.walk(self.product_path):
+            for file in files:
+                path = os.path.join(folder, file)
+                node_path = os.path.relpath(path, self.product_path)
+                if not nodefilter({"node_path": node_path}):
+                    continue
+                target = os.path.join(directory_path, root, node_path)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copy(path, target)
+        return {"product_root_dir": root}
+
+
+def configure_environment():
+    """
+    Points application to a local SQLite database and storage,
+    it is called before application modules are imported.
+    """
+    os.environ.setdefault("SQLALCHEMY_DATABASE_URL",
+                          f"sqlite:///{FOLDER}/benchmark.db")
+    os.environ.setdefault("FS_STORAGE_BASE_PATH", f"{FOLDER}/STORAGE")
+    os.environ.setdefault("BROKER_URL", "memory://")
+    os.environ.setdefault("api", "http://localhost/")
+
+
+def measure(func, repeat, setup=None):
+    """
+    Runs function several times and measures its time, peak
+    of Python allocations and peak resident memory of the process.
+    :return dict: best and median time in seconds and peaks in bytes
+    """
+    timings = []
+    peak_memory = 0
+    peak_rss = 0
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        reset_peak_rss()
+        tracemalloc.start()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+        peak_memory = max(peak_memory, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        peak_rss = max(peak_rss, read_peak_rss())
+    return {"seconds": min(timings),
+            "median_seconds": statistics.median(timings),
+            "peak_memory_bytes": peak_memory,
+            "peak_rss_bytes": peak_rss}
+
+
+def benchmark_extractor(product_path, repeat):
+    from backend.app.satellite_data_providers.satellite_data_extractor import \
+        SciHubSatelliteDataExtractor
+
+    def extract(extractor):
+        extractor.extract_nir_image_path()
+        extractor.extract_red_image_path()
+
+    def scan():
+        extractor = SciHubSatelliteDataExtractor(path_to_data=product_path)
+        extractor.reset_index()
+        extract(extractor)
+
+    # Product is scanned once, later lookups are served from saved index
+    return measure(scan, repeat), measure(
+        lambda: extract(SciHubSatelliteDataExtractor(
+            path_to_data=product_path)), repeat)
+
+
+def benchmark_unzip(zip_path, repeat):
+    from backend.app.utils import unzip_files
+
+    output_folder = os.path.join(FOLDER, "unzipped")
+    return measure(
+        lambda: unzip_files(path_to_zip=zip_path,
+                            output_folder=output_folder),
+        repeat,
+        setup=lambda: shutil.rmtree(output_folder, ignore_errors=True))
+
+
+def benchmark_ndvi(product_path, size, area, vertices, repeat, scl=False):
+    from backend.app.analytics.ndvi_counter import \
+        calculate_and_save_ndvi_image
+    from backend.app.satellite_data_providers.satellite_data_extractor import \
+        SciHubSatelliteDataExtractor
+
+    extractor = SciHubSatelliteDataExtractor(path_to_data=product_path)
+    field = create_field(size, area=area, vertices=vertices)
+    file_path = os.path.join(FOLDER, f"NDVI_{area}_{vertices}.tif")
+    return measure(
+        lambda: calculate_and_save_ndvi_image(
+            nir=extractor.extract_nir_image_path(),
+            red=extractor.extract_red_image_path(),
+            file_path=file_path, field_geojson=field,
+            scl=extractor.extract_scl_image_path() if scl else None),
+        repeat)
+
+
+def benchmark_api(product_path, zip_path, size, fields):
+    """
+    Adds fields, downloads product and calculates NDVI
+    through API with celery tasks executed eagerly.
+    """
+    from fastapi.testclient import TestClient
+
+    from backend.app import celery_tasks
+    from backend.app.endpoint import app
+    from backend.app.satellite_data_providers.satellite_data_client import \
+        SatelliteDataClient
+
+    client = SatelliteDataClient(api_client=LocalApi(product_path, zip_path))
+    client.find_product = lambda footprint: ("synthetic", PRODUCT_TITLE)
+    celery_tasks.dp_client = client
+    celery_tasks.app.conf.task_always_eager = True
+
+    # Every field is shifted by a pixel, so its geometry is new and
+    # NDVI is calculated instead of being reused from identical field
+    field_list = [create_field(size, offset=i * PIXEL_SIZE)
+                  for i in range(fields)]
+
+    def run():
+        with TestClient(app) as api:
+            for field in field_list:
+                field_id = api.post("/field/", json=field).json()["field_id"]
+                api.post("/field/pipeline", json={"field_id": field_id})
+                image = api.get("/field/ndvi/image",
+                                params={"field_id": field_id})
+                assert image.headers["content-type"] == "image/tiff"
+                api.get(f"/field/{field_id}/ndvi/stats").raise_for_status()
+
+    return measure(run, 1)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares results with baseline.
+    :return list: names of benchmarks which became slower
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["seconds"] / baseline[name]["seconds"]
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            print(f"REGRESSION {name}: {ratio:.2f}x slower than baseline")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=4096,
+                        help="width and height of 10 m bands in pixels")
+    parser.add_argument("--driver", default="GTiff",
+                        choices=["GTiff", "JP2OpenJPEG"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--fields", type=int, default=20,
+                        help="fields processed through API")
+    parser.add_argument("--output", help="file results are saved to")
+    parser.add_argument("--baseline", help="file with baseline results")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    configure_environment()
+
+    product_folder = os.path.join(FOLDER, "product")
+    zip_folder = os.path.join(FOLDER, "zipped")
+    os.makedirs(product_folder)
+    os.makedirs(zip_folder)
+    product_path = create_product(product_folder, args.size,
+                                  bands=("B04", "B08", "SCL"),
+                                  driver=args.driver)
+    zip_path = create_product(zip_folder, args.size, driver=args.driver,
+                              zipped=True)
+    megabytes = os.path.getsize(zip_path) / 2 ** 20
+
+    results = {}
+    throughput = {}
+    # Zipped products are kept in a folder like in product cache
+    for name, path in (("unzipped", product_path), ("zipped", zip_folder)):
+        scan, lookup = benchmark_extractor(path, args.repeat)
+        results[f"extractor_scan_{name}"] = scan
+        results[f"extractor_lookup_{name}"] = lookup
+
+    results["unzip"] = benchmark_unzip(zip_path, args.repeat)
+    throughput["unzip"] = f"{megabytes / results['unzip']['seconds']:.1f} MB/s"
+
+    for area in FIELD_AREAS:
+        for vertices in FIELD_VERTICES:
+            name = f"ndvi_{area}ha_{vertices}_vertices"
+            results[name] = benchmark_ndvi(product_path, args.size, area,
+                                           vertices, args.repeat)
+            pixels = area * 10000 / PIXEL_SIZE ** 2
+            throughput[name] = \
+                f"{pixels / results[name]['seconds'] / 1e3:.1f} kpx/s"
+
+        # Clouds are masked with 20 m scene classification
+        name = f"ndvi_{area}ha_{FIELD_VERTICES[0]}_vertices_scl"
+        results[name] = benchmark_ndvi(product_path, args.size, area,
+                                       FIELD_VERTICES[0], args.repeat,
+                                       scl=True)
+        throughput[name] = \
+            f"{pixels / results[name]['seconds'] / 1e3:.1f} kpx/s"
+
+    results["api_pipeline"] = benchmark_api(product_path, zip_path,
+                                            args.size, args.fields)
+    throughput["api_pipeline"] = \
+        f"{args.fields / results['api_pipeline']['seconds']:.1f} fields/s"
+
+    print(f"{'benchmark':<30}{'best ms':>10}{'median ms':>11}"
+          f"{'throughput':>15}{'py MiB':>9}{'rss MiB':>9}")
+    for name, result in results.items():
+        print(f"{name:<30}{result['seconds'] * 1000:>10.2f}"
+              f"{result['median_seconds'] * 1000:>11.2f}"
+              f"{throughput.get(name, ''):>15}"
+              f"{result['peak_memory_bytes'] / 2 ** 20:>9.1f}"
+              f"{result['peak_rss_bytes'] / 2 ** 20:>9.1f}")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
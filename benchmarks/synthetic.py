@@ -0,0 +1,132 @@
+"""
+Generators of synthetic Sentinel-2 products and fields
+shared by benchmarks.
+"""
+import math
+import os
+import shutil
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+from pyproj import Transformer
+from rasterio.transform import from_origin
+
+# Upper left corner of the T37UDB tile in EPSG:32637
+ORIGIN_X, ORIGIN_Y = 399960, 6000000
+PIXEL_SIZE = 10
+CRS = "EPSG:32637"
+
+PRODUCT_TITLE = "S2A_MSIL2A_20230601T080611_N0509_R078_T37UDB_20230601T120411"
+GRANULE = "L2A_T37UDB_A041234_20230601T081244"
+BAND_PREFIX = "T37UDB_20230601T080611"
+
+# Different seeds, so NDVI of synthetic bands is not constant
+BAND_SEEDS = {"B02": 2, "B03": 3, "B04": 4, "B05": 5, "B08": 8,
+              "B11": 11, "B8A": 18, "SCL": 20}
+BAND_RESOLUTIONS = {"B02": 10, "B03": 10, "B04": 10, "B08": 10,
+                    "B05": 20, "B8A": 20, "B11": 20, "SCL": 20}
+DRIVER_EXTENSIONS = {"GTiff": "tif", "JP2OpenJPEG": "jp2"}
+# Reflectance of bands and scene classes of SCL band
+BAND_VALUES = {"SCL": (0, 12)}
+REFLECTANCE_VALUES = (1, 10000)
+
+
+def create_band(path, size, seed=0, driver="GTiff",
+                pixel_size=PIXEL_SIZE, values=REFLECTANCE_VALUES):
+    """
+    Writes random uint16 band tiled the same way as Sentinel-2 JP2 files.
+    :param str path: path to the band image
+    :param int size: width and height of the band in pixels
+    :param int seed: seed of random values
+    :param str driver: GTiff or JP2OpenJPEG
+    :param int pixel_size: resolution of the band in meters
+    :param values: range of random values, upper bound is excluded
+    """
+    profile = {"driver": "GTiff", "dtype": "uint16", "count": 1,
+               "width": size, "height": size, "crs": CRS,
+               "transform": from_origin(ORIGIN_X, ORIGIN_Y,
+                                        pixel_size, pixel_size),
+               "tiled": True, "blockxsize": 1024, "blockysize": 1024}
+    rng = np.random.default_rng(seed)
+
+    # JP2 driver can't write data directly, so band is written
+    # as GeoTIFF first and then converted
+    tif_path = path if driver == "GTiff" else path + ".tif"
+    with rasterio.open(tif_path, "w", **profile) as dst:
+        for _, window in dst.block_windows(1):
+            dst.write(rng.integers(*values,
+                                   (window.height, window.width),
+                                   dtype="uint16"), 1, window=window)
+
+    if driver != "GTiff":
+        with rasterio.open(tif_path) as src:
+            rasterio.shutil.copy(src, path, driver=driver,
+                                 QUALITY=100, REVERSIBLE="YES")
+        os.remove(tif_path)
+
+
+def create_product(folder, size, bands=("B04", "B08"), driver="GTiff",
+                   zipped=False):
+    """
+    Creates SAFE structured L2A product with random bands.
+    :param str folder: folder product is created in
+    :param int size: width and height of 10 m bands in pixels,
+        20 m bands are twice smaller
+    :param bands: band names
+    :param str driver: GTiff or JP2OpenJPEG
+    :param bool zipped: product is zipped like it is downloaded
+    :return str: path to the product folder or zip archive
+    """
+    product_path = os.path.join(folder, PRODUCT_TITLE + ".SAFE")
+    img_data = os.path.join(product_path, "GRANULE", GRANULE, "IMG_DATA")
+    extension = DRIVER_EXTENSIONS[driver]
+
+    for band in bands:
+        resolution = BAND_RESOLUTIONS[band]
+        band_folder = os.path.join(img_data, f"R{resolution}m")
+        os.makedirs(band_folder, exist_ok=True)
+        create_band(os.path.join(
+            band_folder, f"{BAND_PREFIX}_{band}_{resolution}m.{extension}"),
+            size * PIXEL_SIZE // resolution, seed=BAND_SEEDS[band],
+            driver=driver, pixel_size=resolution,
+            values=BAND_VALUES.get(band, REFLECTANCE_VALUES))
+
+    with open(os.path.join(product_path, "manifest.safe"), "w") as file:
+        file.write("<xfdu:XFDU/>\n")
+
+    if not zipped:
+        return product_path
+
+    zip_path = shutil.make_archive(os.path.join(folder, PRODUCT_TITLE),
+                                   "zip", folder,
+                                   os.path.basename(product_path))
+    shutil.rmtree(product_path)
+    return zip_path
+
+
+def create_field(size, area=20, vertices=4, offset=0):
+    """
+    Creates field in the middle of the scene as regular polygon.
+    :param int size: width and height of the scene in pixels
+    :param float area: area of the field in hectares
+    :param int vertices: number of vertices of the polygon
+    :param float offset: shift of the field to the east in meters
+    :return dict: field in GeoJSON format
+    """
+    to_wgs = Transformer.from_crs(CRS, "EPSG:4326", always_xy=True)
+    center_x = ORIGIN_X + size * PIXEL_SIZE / 2 + offset
+    center_y = ORIGIN_Y - size * PIXEL_SIZE / 2
+
+    # Radius of regular polygon of the area
+    radius = math.sqrt(area * 10000 * 2 /
+                       (vertices * math.sin(2 * math.pi / vertices)))
+    angles = [math.pi / 4 + 2 * math.pi * i / vertices
+              for i in range(vertices)]
+    ring = [to_wgs.transform(center_x + radius * math.cos(angle),
+                             center_y + radius * math.sin(angle))
+            for angle in angles]
+    ring.append(ring[0])
+    return {"type": "FeatureCollection", "features": [{
+        "type": "Feature", "properties": {},
+        "geometry": {"type": "Polygon", "coordinates": [ring]}}]}